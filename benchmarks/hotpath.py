@@ -0,0 +1,267 @@
+"""
+Microbenchmarks of the steps of one message lifecycle in gainfixtrader, run offline without a session.
+Incoming messages are parsed from canned raw FIX strings, outgoing messages go to a stubbed transport.
+
+    python benchmarks/hotpath.py --number 20000 --repeat 5 --filter unpack --output hotpath.json
+
+ns/op is the best of the repeats less the cost of the empty benchmark loop. B/op is the average peak of
+Python memory traced by tracemalloc during one operation, blocks/op the Python heap blocks an operation
+leaves allocated (sys.getallocatedblocks). Allocations made inside the QuickFIX C++ library are not seen.
+"""
+import argparse
+import gc
+import json
+import logging
+import os
+import platform
+import sys
+import time
+import quickfix as fix
+from transfixed import gainfixtrader as gain
+
+try:
+    import tracemalloc
+except ImportError:
+    tracemalloc = None
+
+CONFIG = os.path.join(os.path.dirname(gain.__file__), 'gain_config.ini')
+SOH = '\x01'
+SENDING = '20170606-03:52:24.324'
+timer = getattr(time, 'perf_counter', time.time)
+
+# body fields of the canned messages, %(id)s is replaced by a ClOrdID, PosReqID or CollInquiryID
+MESSAGES = {
+    'NewOrderSingle': (fix.MsgType_NewOrderSingle, (
+        (1, 'ACCOUNT'), (11, '%(id)s'), (38, 1), (40, fix.OrdType_LIMIT), (44, 1.1), (54, fix.Side_BUY),
+        (55, '6E'), (60, SENDING), (200, '201712'), (461, 'FXXXXS'))),
+    'ExecutionReport New': (fix.MsgType_ExecutionReport, (
+        (6, 0), (11, '%(id)s'), (14, 0), (17, 'E%(id)s'), (37, 'O%(id)s'), (38, 1), (39, fix.OrdStatus_NEW),
+        (54, fix.Side_BUY), (55, '6E'), (60, SENDING), (150, fix.ExecType_NEW), (151, 1), (200, '201712'))),
+    'ExecutionReport Filled': (fix.MsgType_ExecutionReport, (
+        (6, 1.1), (11, '%(id)s'), (14, 1), (17, 'E%(id)s'), (37, 'O%(id)s'), (38, 1), (39, fix.OrdStatus_FILLED),
+        (54, fix.Side_BUY), (55, '6E'), (60, SENDING), (150, fix.ExecType_TRADE), (151, 0), (200, '201712'))),
+    'ExecutionReport Cancelled': (fix.MsgType_ExecutionReport, (
+        (6, 0), (11, 'C%(id)s'), (14, 0), (17, 'E%(id)s'), (37, 'O%(id)s'), (38, 1), (39, fix.OrdStatus_CANCELED),
+        (41, '%(id)s'), (54, fix.Side_BUY), (55, '6E'), (60, SENDING), (150, fix.ExecType_CANCELED), (151, 0),
+        (200, '201712'))),
+    'OrderCancelReject': (fix.MsgType_OrderCancelReject, (
+        (11, 'C%(id)s'), (37, 'O%(id)s'), (39, fix.OrdStatus_FILLED), (41, '%(id)s'), (60, SENDING),
+        (102, fix.CxlRejReason_UNKNOWN_ORDER), (434, fix.CxlRejResponseTo_ORDER_CANCEL_REQUEST))),
+    'CollateralInquiry': (fix.MsgType_CollateralInquiry, (
+        (1, 'ACCOUNT'), (909, '%(id)s'))),
+    'CollateralReport': (fix.MsgType_CollateralReport, (
+        (1, 'ACCOUNT'), (15, 'USD'), (901, 100000), (908, 'R%(id)s'), (909, '%(id)s'), (910, 0))),
+    'PositionReport': (fix.MsgType_PositionReport, (
+        (1, 'ACCOUNT'), (55, '6E'), (200, '201712'), (702, 1), (704, 2), (705, 0), (708, 0), (710, '%(id)s'),
+        (715, '20170606'), (721, 'P%(id)s'), (727, 1), (728, 0), (730, 1.1), (731, 1), (753, 0))),
+    'RequestForPositionsAck': (fix.MsgType_RequestForPositionsAck, (
+        (1, 'ACCOUNT'), (710, '%(id)s'), (721, 'P%(id)s'), (727, 0), (728, 0), (729, 0))),
+}
+
+
+def raw(name, id, seq=1):
+    """
+    Canned message as a raw FIX string with BodyLength and CheckSum
+    """
+    msgType, fields = MESSAGES[name]
+    header = ((35, msgType), (49, 'GAIN'), (56, 'CLIENT'), (34, seq), (52, SENDING))
+    body = ''.join('%s=%s%s' % (tag, value, SOH) for tag, value in header + fields) % {'id': id}
+    head = '8=FIX.4.4%s9=%d%s' % (SOH, len(body), SOH)
+    return '%s%s10=%03d%s' % (head, body, sum(bytearray((head + body).encode())) % 256, SOH)
+
+
+def message(name, id, seq=1):
+    return fix.Message(raw(name, id, seq), False)
+
+
+class Ids(object):
+    """
+    Unique ids, messages of different repeats never share a ClOrdID
+    """
+    def __init__(self):
+        self.Last = 0
+
+    def take(self, count):
+        first = self.Last + 1
+        self.Last += count
+        return [str(i) for i in range(first, self.Last + 1)]
+
+
+class Bench(object):
+    def __init__(self, name, setup):
+        """
+        :param setup: callable(number) returning (operation, list of number arguments of the operation),
+        called before every repeat and not timed
+        """
+        self.Name = name
+        self.Setup = setup
+
+
+def loop(operation, args):
+    start = timer()
+    for arg in args:
+        operation(arg)
+    return timer() - start
+
+
+def noop(arg):
+    pass
+
+
+def measure(bench, number, repeat, sample, overhead):
+    """
+    :param overhead: seconds per operation of the empty benchmark loop
+    :return: dict with ns_per_op, bytes_per_op and blocks_per_op
+    """
+    best, blocks = None, None
+    enabled = gc.isenabled()
+    for i in range(repeat):
+        operation, args = bench.Setup(number)
+        gc.collect()
+        gc.disable()
+        before = sys.getallocatedblocks() if hasattr(sys, 'getallocatedblocks') else None
+        try:
+            elapsed = loop(operation, args)
+        finally:
+            if enabled:
+                gc.enable()
+        if before is not None and i == 0:
+            gc.collect()
+            blocks = float(sys.getallocatedblocks() - before) / number
+        del operation, args
+        best = elapsed if best is None else min(best, elapsed)
+
+    peak = None
+    if tracemalloc is not None and sample:
+        operation, args = bench.Setup(sample)
+        gc.collect()
+        tracemalloc.start()
+        total = 0
+        for arg in args:
+            # clear_traces also resets the peak, the peak then covers this operation only
+            tracemalloc.clear_traces()
+            operation(arg)
+            total += tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        peak = float(total) / len(args)
+    return {'ns_per_op': max(0.0, best / number - overhead) * 1e9, 'bytes_per_op': peak, 'blocks_per_op': blocks}
+
+
+def store_benches(settings, logger, ids):
+    def store(number, request, response, requests):
+        messageStore = gain.MessageStore(logger, settings)
+        pairs = [(message(request, id), message(response, id)) for id in ids.take(number)]
+        if requests:
+            return lambda m: messageStore.addRequest(m, m.getHeader().getField(35)), [p[0] for p in pairs]
+        for m, _ in pairs:
+            messageStore.addRequest(m)
+        return lambda m: messageStore.addResponse(m, m.getHeader().getField(35)), [p[1] for p in pairs]
+
+    benches = []
+    for request, response in (('NewOrderSingle', 'ExecutionReport New'), ('CollateralInquiry', 'CollateralReport')):
+        benches.append(Bench('store addRequest %s' % request,
+                             lambda number, q=request, r=response: store(number, q, r, True)))
+        benches.append(Bench('store addResponse %s' % response.split()[0],
+                             lambda number, q=request, r=response: store(number, q, r, False)))
+    # the store correlates with UTCTimestamp.toMicros, strptime is kept as the baseline it replaced
+    for value in ('20170606-03:52:24', '20170606-03:52:24.324'):
+        benches.append(Bench('store toMicros %s' % value,
+                             lambda number, v=value: (gain.UTCTimestamp.toMicros, [v] * number)))
+        benches.append(Bench('baseline strptime %s' % value,
+                             lambda number, v=value: (gain.MessageStore.parse, [v] * number)))
+    benches.append(Bench('quickfix parse ExecutionReport',
+                         lambda number: (lambda s: fix.Message(s, False),
+                                         [raw('ExecutionReport Filled', id) for id in ids.take(number)])))
+    return benches
+
+
+def notify_benches(listeners):
+    def notify(number, count):
+        notifier = gain.Observable()
+        for _ in range(count):
+            notifier.addMessageHandler(gain.Notify.Order, lambda e: None)
+        values = {'ClientOrderId': '1', 'Status': gain.OrderStatus.Filled, 'AvgPx': 1.1, 'Quantity': 1.0,
+                  'Side': gain.OrderSide.Buy, 'Symbol': '6E', 'Maturity': '201712', 'OrigClOrdID': None,
+                  'Sender': None}
+        return lambda v: notifier.notifyMsgHandlers(gain.Notify.Order, **v), [values] * number
+    return [Bench('notify %d listeners' % count, lambda number, c=count: notify(number, c)) for count in listeners]
+
+
+def unpack_benches(client, ids):
+    application = client.SocketInitiator.application
+    unpack = getattr(application, '_GainApplication__unpackMessage')
+    sessionID = fix.SessionID('FIX.4.4', 'CLIENT', 'GAIN')
+
+    def unpacked(number, name):
+        messages = [message(name, id) for id in ids.take(number)]
+        return lambda m: unpack(m, m.getHeader().getField(35), application.Default), messages
+
+    def received(number):
+        messages = []
+        for id in ids.take(number):
+            application.toApp(message('NewOrderSingle', id), sessionID)
+            messages.append(message('ExecutionReport Filled', id))
+        return lambda m: application.fromApp(m, sessionID), messages
+
+    benches = [Bench('unpack %s' % name, lambda number, n=name: unpacked(number, n)) for name in (
+        'ExecutionReport New', 'ExecutionReport Filled', 'ExecutionReport Cancelled', 'OrderCancelReject',
+        'CollateralReport', 'PositionReport', 'RequestForPositionsAck')]
+    benches.append(Bench('fromApp ExecutionReport Filled', received))
+    return benches
+
+
+def order_benches(client):
+    orders = ((gain.BuyFutureLimitOrder, ('6E', '201712', 1, 1.1)),
+              (gain.SellFutureLimitOrder, ('6E', '201712', 1, 1.1)),
+              (gain.BuyFutureMarketOrder, ('6E', '201712', 1)),
+              (gain.SellFutureMarketOrder, ('6E', '201712', 1)))
+    benches = [Bench('order %s' % cls.__name__, lambda number, c=cls, a=args: (lambda x: c(*x), [a] * number))
+               for cls, args in orders]
+    for cls, args in orders[::2]:
+        benches.append(Bench('send %s' % cls.__name__,
+                             lambda number, c=cls, a=args: (client.send, [c(*a) for _ in range(number)])))
+    return benches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--number', type=int, default=20000, help='operations per repeat')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--sample', type=int, default=1000, help='operations traced for B/op, 0 to skip')
+    parser.add_argument('--listeners', default='0,1,4,16', help='listener counts of the notify benchmarks')
+    parser.add_argument('--filter', help='only benchmarks with this text in their name')
+    parser.add_argument('--output', help='JSON result file')
+    args = parser.parse_args()
+
+    logger = logging.getLogger()
+    client = gain.FixClient.Create(logger, CONFIG, False)
+    logger.setLevel(logging.WARNING)
+    # stub the transport, only message building is measured
+    client.SocketInitiator.application.send = lambda m: None
+    settings = client.SocketInitiator.application.Settings
+    ids = Ids()
+    benches = store_benches(settings, logger, ids) + \
+        notify_benches([int(count) for count in args.listeners.split(',')]) + \
+        unpack_benches(client, ids) + order_benches(client)
+    if args.filter:
+        benches = [bench for bench in benches if args.filter in bench.Name]
+
+    overhead = min(loop(noop, [None] * args.number) for _ in range(args.repeat)) / args.number
+    results = {}
+    print('%-42s %10s %10s %10s' % ('benchmark', 'ns/op', 'B/op', 'blocks/op'))
+    for bench in benches:
+        result = results[bench.Name] = measure(bench, args.number, args.repeat, args.sample, overhead)
+        print('%-42s %10.0f %10s %10s' % (
+            bench.Name, result['ns_per_op'],
+            '-' if result['bytes_per_op'] is None else '%.0f' % result['bytes_per_op'],
+            '-' if result['blocks_per_op'] is None else '%.1f' % result['blocks_per_op']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(),
+                       'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+                       'number': args.number, 'repeat': args.repeat, 'loop_ns': overhead * 1e9,
+                       'results': results}, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,142 @@
+"""
+Cold start of use_case/lambdatrader.py: module import time and time from the handler call to the
+first order handed to the FixClient. Every run is a fresh interpreter. DynamoDB and the FIX session
+are replaced by in-process stubs, so only the trader's own start-up work is measured.
+"""
+import json
+import logging
+import os
+import subprocess
+import sys
+import time
+
+USE_CASE = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'use_case')
+HEAVY = ('boto3', 'botocore', 'smtplib', 'email.mime.multipart')
+
+SECURITY = {'Symbol': '6E', 'TradingEnabled': True, 'Description': {'Exchange': 'CME', 'MarketGroup': 'Currencies'},
+            'Risk': {'RiskFactor': 1, 'MaxPosition': 10, 'Margin': {'Amount': 1000, 'Currency': 'USD'}}}
+
+
+class StubTable(object):
+
+    def get_item(self, Key):
+        return {'Item': SECURITY} if Key['Symbol'] == SECURITY['Symbol'] else {}
+
+    def update_item(self, **update):
+        return {'Attributes': {'Status': update['ExpressionAttributeValues'][':s']}}
+
+
+class StubDynamoDB(object):
+
+    def Table(self, name):
+        return StubTable()
+
+    def batch_get_item(self, RequestItems):
+        return {'Responses': dict((table, [SECURITY]) for table in RequestItems)}
+
+
+def stub_fix_client(gain, firstOrder):
+    from concurrent.futures import Future
+
+    def done(result):
+        future = Future()
+        future.set_result(result)
+        return future
+
+    reservations = {}
+
+    class StubFixClient(object):
+        def __init__(self):
+            application = type('Application', (object,), {})()
+            application.connected = True
+            self.SocketInitiator = type('Initiator', (object,), {'application': application})()
+
+        def addOrderListener(self, handler):
+            pass
+        removeOrderListener = addAccountInquiryListener = removeAccountInquiryListener = addOrderListener
+
+        def start(self):
+            pass
+
+        def stop(self):
+            pass
+
+        def position(self, symbol, maturity):
+            return 0
+
+        def positionsSynchronised(self):
+            return True
+
+        def balance(self, maxAge=None, timeout=None):
+            return 100000.0, 'USD'
+
+        def tryReserve(self, key, amount, predicate, maxAge=None, timeout=None):
+            balance, ccy = self.balance(maxAge, timeout)
+            if not predicate(balance, ccy):
+                return False, balance, ccy
+            reservations[key] = amount
+            return True, balance, ccy
+
+        def release(self, key):
+            reservations.pop(key, None)
+
+        def send(self, order, reply=False, timeout=None, until=None):
+            if not firstOrder:
+                firstOrder.append(time.time())
+            event = gain.FixEvent()
+            event.ClientOrderId, event.Status, event.AvgPx = '1', gain.OrderStatus.Filled, 1.1
+            trade = gain.Trade('1', order.Symbol.getString(), order.Maturity.getString(), order.Quantity.getValue(),
+                               gain.OrderType.Market, gain.OrderSide.Buy)
+            trade.Reply = done(event)
+            return trade
+
+    return StubFixClient
+
+
+def child():
+    logging.disable(logging.CRITICAL)
+    sys.path.insert(0, USE_CASE)
+    start = time.time()
+    import lambdatrader as lt
+    imported = time.time()
+    heavy = [name for name in HEAVY if name in sys.modules]
+
+    firstOrder = []
+    lt.dynamodb = lambda: StubDynamoDB()
+    lt.LambdaTrader.orders_table = staticmethod(lambda: StubTable())
+    lt.LambdaTrader.SendReport = lambda self, text: None
+    lt.gain.FixClient.Create = staticmethod(lambda *args: stub_fix_client(lt.gain, firstOrder)())
+    with open(os.path.join(USE_CASE, 'event.json')) as json_file:
+        event = json.load(json_file)
+    event['Records'][0]['dynamodb']['NewImage']['Details']['M']['Maturity']['S'] = '%s12' % (time.gmtime().tm_year + 1)
+
+    called = time.time()
+    response = lt.main(event, None)
+    print(json.dumps({'import': imported - start, 'first_order': firstOrder[0] - called if firstOrder else None,
+                      'modules': len(sys.modules), 'heavy': heavy, 'state': response['State']}))
+
+
+def main(runs=10):
+    results = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, os.path.abspath(__file__), '--child'])
+        results.append(json.loads(out.decode().strip().splitlines()[-1]))
+
+    def median(values):
+        values = sorted(values)
+        return values[len(values) // 2]
+    print('import        %8.1f ms' % (1000 * median([r['import'] for r in results])))
+    orders = [r['first_order'] for r in results if r['first_order'] is not None]
+    if orders:
+        print('first order   %8.1f ms' % (1000 * median(orders)))
+    else:
+        print('first order   no order sent: %s' % results[-1]['state'])
+    print('modules       %8d' % results[-1]['modules'])
+    print('heavy imports %s' % (', '.join(results[-1]['heavy']) or 'none'))
+    print('handler state %s' % results[-1]['state'])
+
+if __name__ == '__main__':
+    if '--child' in sys.argv:
+        child()
+    else:
+        main()
@@ -0,0 +1,312 @@
+"""
+End to end FIX round trips: FixClient against the local exchange simulator (test_gain/executor.py)
+started as a QuickFIX acceptor on localhost in a separate process.
+
+    python benchmarks/roundtrip.py --mix market:60,limit:20,cancel:10,inquiry:10 --arrival poisson --rate 2000
+        --count 20000 --output roundtrip.json
+
+Operations and their terminal reply:
+    market  - market order, Filled
+    limit   - marketable limit order, Filled
+    cancel  - passive limit order cancelled once it is New, Cancelled
+    inquiry - CollateralInquiry, CollateralReport
+
+Arrivals: closed (next operation after the previous reply), fixed (constant rate), poisson (open loop,
+exponential gaps at the mean rate). CPU time and peak RSS are those of the client process.
+"""
+import argparse
+import json
+import logging
+import os
+import platform
+import random
+import re
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import Future
+from transfixed import gainfixtrader as gain
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+CONFIG = os.path.join(os.path.dirname(gain.__file__), 'gain_config.ini')
+EXECUTOR = os.path.join(ROOT, 'test_gain', 'executor.py')
+SYMBOL, MATURITY, MID = '6E', '201712', 1.1
+
+ACCEPTOR = """[DEFAULT]
+ConnectionType=acceptor
+SenderCompID=SIM
+FileLogPath=%(dir)s/AcceptorLogs/
+StartTime=00:00:00
+EndTime=00:00:00
+UseDataDictionary=N
+ValidateFieldsOutOfOrder=N
+ValidateUserDefinedFields=N
+ValidateFieldsHaveValues=N
+CheckLatency=N
+ResetOnLogon=Y
+SocketAcceptPort=%(port)s
+SimPrices=%(symbol)s:%(mid)s
+SimSpread=0.0002
+SimLatency=%(latency)s
+SimJitter=%(jitter)s
+SimLatencyDistribution=%(distribution)s
+
+[SESSION]
+BeginString=FIX.4.4
+TargetCompID=BENCH
+HeartBtInt=30
+"""
+
+
+def free_port():
+    s = socket.socket()
+    s.bind(('127.0.0.1', 0))
+    port = s.getsockname()[1]
+    s.close()
+    return port
+
+
+def initiator_config(path, overrides):
+    """
+    Copy of the client configuration with the overridden settings
+    """
+    with open(CONFIG) as f:
+        text = f.read()
+    for key, value in overrides.items():
+        line = '%s=%s' % (key, value)
+        text, found = re.subn(r'(?m)^%s=.*$' % re.escape(key), line.replace('\\', '\\\\'), text)
+        if not found:
+            text = text.replace('[DEFAULT]\n', '[DEFAULT]\n%s\n' % line, 1)
+    with open(path, 'w') as f:
+        f.write(text)
+
+
+class Operations(object):
+    """
+    Starts one operation and returns a Future resolved with its terminal reply
+    """
+    def __init__(self, client, timeout):
+        self.Client = client
+        self.Timeout = timeout
+        self.Sent = 0
+        self.__buy = False
+
+    def __side(self):
+        self.__buy = not self.__buy
+        return self.__buy
+
+    def market(self):
+        self.Sent += 1
+        order = gain.BuyFutureMarketOrder(SYMBOL, MATURITY, 1) if self.__side() else \
+            gain.SellFutureMarketOrder(SYMBOL, MATURITY, 1)
+        return self.Client.send(order, reply=True, timeout=self.Timeout).Reply
+
+    def limit(self):
+        self.Sent += 1
+        order = gain.BuyFutureLimitOrder(SYMBOL, MATURITY, 1, round(MID * 1.01, 4)) if self.__side() else \
+            gain.SellFutureLimitOrder(SYMBOL, MATURITY, 1, round(MID * 0.99, 4))
+        return self.Client.send(order, reply=True, timeout=self.Timeout).Reply
+
+    def cancel(self):
+        self.Sent += 2
+        done = Future()
+        trade = self.Client.send(gain.BuyFutureLimitOrder(SYMBOL, MATURITY, 1, round(MID * 0.5, 4)), reply=True,
+                                 timeout=self.Timeout, until=(gain.OrderStatus.New,) + gain.TerminalStatuses)
+
+        def cancelled(reply):
+            if reply.exception() is not None:
+                done.set_exception(reply.exception())
+            else:
+                done.set_result(reply.result())
+
+        def acknowledged(reply):
+            if reply.exception() is not None:
+                done.set_exception(reply.exception())
+            else:
+                self.Client.cancel(trade, reply=True, timeout=self.Timeout).add_done_callback(cancelled)
+        trade.Reply.add_done_callback(acknowledged)
+        return done
+
+    def inquiry(self):
+        self.Sent += 1
+        return self.Client.collateralInquiry(reply=True, timeout=self.Timeout)
+
+
+def parse_mix(mix):
+    weights = []
+    for part in mix.split(','):
+        name, _, weight = part.partition(':')
+        if name not in ('market', 'limit', 'cancel', 'inquiry'):
+            raise ValueError('Unknown operation %s' % name)
+        weights.append((name, float(weight or 1)))
+    return weights
+
+
+def run(client, operations, mix, arrival, rate, count, timeout, seed):
+    """
+    :return: result dictionary of one run
+    """
+    rnd = random.Random(seed)
+    names = [name for name, _ in mix]
+    weights = [weight for _, weight in mix]
+    total = sum(weights)
+    plan = []
+    for _ in range(count):
+        pick, acc = rnd.random() * total, 0.0
+        for name, weight in zip(names, weights):
+            acc += weight
+            if pick < acc:
+                break
+        plan.append(name)
+
+    histogram = gain.LatencyHistogram()
+    byOperation = dict((name, gain.LatencyHistogram()) for name in names)
+    lock = threading.Lock()
+    finished = threading.Event()
+    state = {'completed': 0, 'errors': 0, 'last': None, 'pending': count}
+    received = [0]
+
+    def event(e):
+        received[0] += 1
+    client.addOrderListener(event)
+    client.addAccountInquiryListener(event)
+
+    def record(name, start):
+        def done(future):
+            now = gain.monotonic()
+            with lock:
+                if future.exception() is None:
+                    elapsed = int((now - start) * 1000000)
+                    histogram.record(elapsed)
+                    byOperation[name].record(elapsed)
+                    state['completed'] += 1
+                else:
+                    state['errors'] += 1
+                state['last'] = now
+                state['pending'] -= 1
+                if state['pending'] == 0:
+                    finished.set()
+        return done
+
+    sent = operations.Sent
+    cpu = time.process_time() if hasattr(time, 'process_time') else time.clock()
+    begin = gain.monotonic()
+    due = begin
+    for name in plan:
+        if arrival == 'fixed':
+            due += 1.0 / rate
+        elif arrival == 'poisson':
+            due += rnd.expovariate(rate)
+        delay = due - gain.monotonic()
+        if delay > 0 and arrival != 'closed':
+            time.sleep(delay)
+        # open loop latency counts from the scheduled time, a late send is part of it
+        start = gain.monotonic() if arrival == 'closed' else due
+        future = getattr(operations, name)()
+        future.add_done_callback(record(name, start))
+        if arrival == 'closed':
+            try:
+                future.result(timeout)
+            except Exception:
+                pass
+    finished.wait(timeout + 5)
+    cpu = (time.process_time() if hasattr(time, 'process_time') else time.clock()) - cpu
+    client.removeOrderListener(event)
+    client.removeAccountInquiryListener(event)
+
+    elapsed = (state['last'] or gain.monotonic()) - begin
+    messages = operations.Sent - sent + received[0]
+    latency = dict((k, v * 1000) for k, v in histogram.snapshot().items() if k != 'count')
+    return {
+        'mix': dict(mix), 'arrival': arrival, 'rate': rate, 'count': count,
+        'completed': state['completed'], 'errors': state['errors'],
+        'ops_per_sec': state['completed'] / elapsed if elapsed > 0 else 0,
+        'latency_ms': latency,
+        'latency_ms_by_operation': dict((name, dict((k, v * 1000) for k, v in h.snapshot().items() if k != 'count'))
+                                        for name, h in byOperation.items()),
+        'messages': messages,
+        'cpu_sec': cpu,
+        'cpu_us_per_message': cpu * 1000000 / messages if messages else None,
+        'peak_rss_kb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+    }
+
+
+def commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT).decode().strip()
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--mix', default='market:60,limit:20,cancel:10,inquiry:10')
+    parser.add_argument('--arrival', choices=('closed', 'fixed', 'poisson'), default='fixed')
+    parser.add_argument('--rate', type=float, default=1000, help='operations per second for fixed and poisson')
+    parser.add_argument('--count', type=int, default=10000)
+    parser.add_argument('--warmup', type=int, default=500)
+    parser.add_argument('--timeout', type=float, default=30)
+    parser.add_argument('--latency', type=float, default=0, help='simulator reply latency in milliseconds')
+    parser.add_argument('--jitter', type=float, default=0, help='simulator reply jitter in milliseconds')
+    parser.add_argument('--distribution', default='uniform')
+    parser.add_argument('--set', action='append', default=[], metavar='KEY=VALUE',
+                        help='client setting, e.g. DispatchThreads=2')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='JSON result file')
+    args = parser.parse_args()
+    mix = parse_mix(args.mix)
+
+    workdir = tempfile.mkdtemp(prefix='roundtrip')
+    port = free_port()
+    acceptorIni = os.path.join(workdir, 'executor.ini')
+    with open(acceptorIni, 'w') as f:
+        f.write(ACCEPTOR % {'dir': workdir, 'port': port, 'symbol': SYMBOL, 'mid': MID, 'latency': args.latency,
+                            'jitter': args.jitter, 'distribution': args.distribution})
+    overrides = {'SenderCompID': 'BENCH', 'TargetCompID': 'SIM', 'SocketConnectHost': '127.0.0.1',
+                 'SocketConnectPort': port, 'ReconnectInterval': 1, 'Account': 'BENCH',
+                 'FileLogPath': os.path.join(workdir, 'Logs'), 'FileStorePath': os.path.join(workdir, 'Sessions'),
+                 # below the WARNING root level, message text is not formatted
+                 'MessageLogLevel': 'DEBUG'}
+    settings = dict(kv.split('=', 1) for kv in args.set)
+    overrides.update(settings)
+    initiatorIni = os.path.join(workdir, 'client.ini')
+    initiator_config(initiatorIni, overrides)
+
+    logging.basicConfig(level=logging.WARNING)
+    logger = logging.getLogger()
+    acceptor = subprocess.Popen([sys.executable, EXECUTOR, acceptorIni], cwd=workdir,
+                                stdout=open(os.devnull, 'w'), env=dict(os.environ, PYTHONPATH=ROOT))
+    client = gain.FixClient.Create(logger, initiatorIni, False)
+    try:
+        client.start()
+        operations = Operations(client, args.timeout)
+        if args.warmup:
+            run(client, operations, mix, 'closed', 0, args.warmup, args.timeout, args.seed)
+        result = run(client, operations, mix, args.arrival, args.rate, args.count, args.timeout, args.seed)
+    finally:
+        client.stop()
+        acceptor.terminate()
+        acceptor.wait()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {'commit': commit(), 'python': platform.python_version(), 'platform': platform.platform(),
+              'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+              'settings': settings,
+              'simulator': {'latency_ms': args.latency, 'jitter_ms': args.jitter,
+                            'distribution': args.distribution},
+              'result': result}
+    latency = result['latency_ms']
+    print('%-8s %8.0f ops/sec  p50 %7.3f ms  p99 %7.3f ms  max %7.3f ms  %6.1f us cpu/msg  %d KB rss  errors %d'
+          % (args.arrival, result['ops_per_sec'], latency['p50'], latency['p99'], latency['max'],
+             result['cpu_us_per_message'] or 0, result['peak_rss_kb'], result['errors']))
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+if __name__ == '__main__':
+    main()
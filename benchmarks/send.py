@@ -0,0 +1,63 @@
+import logging
+import os
+import time
+import quickfix as fix
+import quickfix44 as fix44
+from transfixed import gainfixtrader as gain
+
+CONFIG = os.path.join(os.path.dirname(gain.__file__), 'gain_config.ini')
+
+
+def legacy_send(client, order):
+    """
+    FixClient.send before message templates and cached settings
+    """
+    application = client.SocketInitiator.application
+    orderId = application.genOrderID()
+    account = application.Settings.get().getString('Account')
+
+    trade = fix44.NewOrderSingle()
+    trade.setField(fix.Account(account))
+    trade.setField(fix.ClOrdID(orderId))
+
+    trade.setField(order.CFICode)
+    trade.setField(order.TransactionTime)
+    trade.setField(order.Quantity)
+    trade.setField(order.OrdType)
+    trade.setField(order.Side)
+    trade.setField(order.Symbol)
+    trade.setField(order.Maturity)
+
+    if isinstance(order, gain.FutureLimitOrder):
+        trade.setField(order.Price)
+
+    application.send(trade)
+
+    ordType = gain.OrderType.Limit if isinstance(order, gain.FutureLimitOrder) else gain.OrderType.Market
+    ordSide = gain.OrderSide.Buy if isinstance(order, gain.BuyOrder) else gain.OrderSide.Sell
+    price = order.Price.getValue() if isinstance(order, gain.FutureLimitOrder) else None
+    return gain.Trade(orderId, order.Symbol.getString(), order.Maturity.getString(), order.Quantity.getValue(),
+                      ordType, ordSide, price)
+
+
+def bench(name, send, orders):
+    start = time.time()
+    for order in orders:
+        send(order)
+    elapsed = time.time() - start
+    print('%-10s %10.0f orders/sec' % (name, len(orders) / elapsed))
+
+
+def main(count=50000):
+    logger = logging.getLogger()
+    client = gain.FixClient.Create(logger, CONFIG, False)
+    logger.setLevel(logging.WARNING)
+    # stub the transport, only message building is measured
+    client.SocketInitiator.application.send = lambda message: None
+    orders = [gain.BuyFutureLimitOrder('6E', '201709', 1, 1.1) if i % 2 else
+              gain.SellFutureMarketOrder('6B', '201709', 2) for i in range(count)]
+    bench('before', lambda order: legacy_send(client, order), orders)
+    bench('after', client.send, orders)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,22 @@
+import timeit
+from transfixed import gainfixtrader as gain
+
+VALUES = ['20170606-03:52:24', '20170606-03:52:24.324', '20170606-03:52:24.324512']
+
+
+def bench(name, fn, number):
+    for value in VALUES:
+        seconds = min(timeit.repeat(lambda: fn(value), number=number, repeat=5))
+        print('%-12s %-26s %8.0f ns/op' % (name, value, seconds / number * 1e9))
+
+
+def main(number=100000):
+    bench('strptime', gain.MessageStore.parse, number)
+    bench('UTCTimestamp', gain.UTCTimestamp.toMicros, number)
+    seconds = min(timeit.repeat(lambda: gain.datetime.now().strftime('%Y%m%d-%H:%M:%S'), number=number, repeat=5))
+    print('%-12s %-26s %8.0f ns/op' % ('strftime', 'now', seconds / number * 1e9))
+    seconds = min(timeit.repeat(gain.UTCTimestamp.now, number=number, repeat=5))
+    print('%-12s %-26s %8.0f ns/op' % ('UTCTimestamp', 'now', seconds / number * 1e9))
+
+if __name__ == '__main__':
+    main()
@@ -26,7 +26,7 @@ setup(
 
     packages=find_packages(exclude=['transfixed.egg-info', 'test_gain', 'use_case']),
 
-    install_requires=['quickfix', 'future'],
+    install_requires=['quickfix', 'future', 'futures; python_version < "3"'],
 
     package_data={
         'transfixed': ['fix/FIX42.xml', 'fix/FIX44.xml', 'gain_config.ini', 'cqg_config.ini'],
@@ -1,140 +1,457 @@
+import heapq
+import itertools
+import random
+import threading
+import sys
 import time
+import datetime
 import quickfix as fix
 import quickfix44 as fix44
+from transfixed.gainfixtrader import getSetting
 
 
-class Application(fix.Application):
-    orderID = 1
-    execID = 1
+class Order(object):
+    __slots__ = ('ClOrdID', 'OrderID', 'SessionID', 'Account', 'Symbol', 'Maturity', 'Side', 'OrdType', 'Price',
+                 'Quantity', 'Leaves', 'CumQty', 'CumValue', 'Seq', 'Open')
+
+    def __init__(self, clOrdID, sessionID, account, symbol, maturity, side, ordType, quantity, price=None):
+        self.ClOrdID = clOrdID
+        self.OrderID = None
+        self.SessionID = sessionID
+        self.Account = account
+        self.Symbol = symbol
+        self.Maturity = maturity
+        self.Side = side
+        self.OrdType = ordType
+        self.Price = price
+        self.Quantity = quantity
+        self.Leaves = quantity
+        self.CumQty = 0
+        self.CumValue = 0.0
+        self.Seq = 0
+        self.Open = True
+
+    def avgPx(self):
+        return self.CumValue / self.CumQty if self.CumQty else 0.0
 
+
+class OrderBook(object):
+    """
+    Price-time priority book of one symbol and maturity. Cancelled orders are left in the heaps
+    and skipped when they reach the top.
+    """
     def __init__(self):
-        super(Application, self).__init__()
+        self.__bids = []
+        self.__asks = []
+
+    def __side(self, side):
+        return self.__bids if side == fix.Side_BUY else self.__asks
+
+    def add(self, order):
+        heapq.heappush(self.__side(order.Side), (-order.Price if order.Side == fix.Side_BUY else order.Price,
+                                                 order.Seq, order))
+
+    def best(self, side):
+        """
+        :param side: side of the resting orders
+        :return: first open order in priority or None
+        """
+        book = self.__side(side)
+        while book and not book[0][2].Open:
+            heapq.heappop(book)
+        return book[0][2] if book else None
+
+    def depth(self, side):
+        return sum(entry[2].Leaves for entry in self.__side(side) if entry[2].Open)
+
+
+class Account(object):
+    __slots__ = ('Name', 'Balance', 'Currency', 'Positions')
+
+    def __init__(self, name, balance, currency):
+        self.Name = name
+        self.Balance = balance
+        self.Currency = currency
+        # (symbol, maturity) -> net quantity
+        self.Positions = {}
 
-    def genOrderID(self):
-        Application.orderID = Application.orderID+1
-        return repr(Application.orderID)
 
-    def genExecID(self):
-        Application.execID += 1
-        return str(Application.execID)
+class Exchange(object):
+    """
+    Matching engine with simulated accounts. Incoming orders match the book first and then a market maker
+    quoting mid -/+ half the spread with unlimited size, unless the market maker is disabled.
+    """
+    def __init__(self, prices=None, defaultPrice=100.0, spread=0.02, marketMaker=True, balance=100000.0,
+                 currency='USD', commission=0.0):
+        self.Prices = prices or {}
+        self.DefaultPrice = defaultPrice
+        self.Spread = spread
+        self.MarketMaker = marketMaker
+        self.InitialBalance = balance
+        self.Currency = currency
+        self.Commission = commission
+        self.__books = {}
+        self.__orders = {}
+        self.__accounts = {}
+        self.__seq = itertools.count(1)
+        self.__orderIds = itertools.count(1)
+
+    def book(self, symbol, maturity):
+        book = self.__books.get((symbol, maturity))
+        if book is None:
+            book = self.__books[(symbol, maturity)] = OrderBook()
+        return book
+
+    def account(self, name):
+        account = self.__accounts.get(name)
+        if account is None:
+            account = self.__accounts[name] = Account(name, self.InitialBalance, self.Currency)
+        return account
+
+    def quote(self, symbol, side):
+        """
+        :param side: side of the incoming order
+        :return: market maker price the order trades at
+        """
+        mid = self.Prices.get(symbol, self.DefaultPrice)
+        return mid + self.Spread / 2 if side == fix.Side_BUY else mid - self.Spread / 2
+
+    def __fill(self, order, quantity, price, fills):
+        order.Leaves -= quantity
+        order.CumQty += quantity
+        order.CumValue += quantity * price
+        if order.Leaves <= 0:
+            order.Open = False
+            self.__orders.pop(order.ClOrdID, None)
+        account = self.account(order.Account)
+        key = (order.Symbol, order.Maturity)
+        account.Positions[key] = account.Positions.get(key, 0) + (quantity if order.Side == fix.Side_BUY else -quantity)
+        account.Balance -= self.Commission * quantity
+        fills.append((order, quantity, price, order.Leaves, order.CumQty, order.avgPx()))
+
+    def newOrder(self, order):
+        """
+        :return: list of (order, quantity, price, leaves, cumQty, avgPx) fills of the incoming and the resting orders,
+                 the incoming order is open on the book if it is not filled and not a market order
+        """
+        order.OrderID = str(next(self.__orderIds))
+        order.Seq = next(self.__seq)
+        book = self.book(order.Symbol, order.Maturity)
+        contra = fix.Side_SELL if order.Side == fix.Side_BUY else fix.Side_BUY
+        buy = order.Side == fix.Side_BUY
+        fills = []
+        while order.Leaves > 0:
+            resting = book.best(contra)
+            quote = self.quote(order.Symbol, order.Side) if self.MarketMaker else None
+            if resting is not None and (quote is None or (resting.Price <= quote if buy else resting.Price >= quote)):
+                price = resting.Price
+            elif quote is not None:
+                price, resting = quote, None
+            else:
+                break
+            if order.Price is not None and (price > order.Price if buy else price < order.Price):
+                break
+            quantity = order.Leaves if resting is None else min(order.Leaves, resting.Leaves)
+            if resting is not None:
+                self.__fill(resting, quantity, price, fills)
+            self.__fill(order, quantity, price, fills)
+        if order.Leaves > 0:
+            if order.Price is None:
+                order.Open = False
+            else:
+                book.add(order)
+                self.__orders[order.ClOrdID] = order
+        return fills
+
+    def cancel(self, origClOrdID):
+        """
+        :return: the cancelled order or None if it is not open
+        """
+        order = self.__orders.pop(origClOrdID, None)
+        if order is not None:
+            order.Open = False
+        return order
+
+
+class LatencyModel(object):
+    """
+    Reply delay in seconds drawn from a fixed, uniform, normal or exponential distribution
+    """
+    def __init__(self, latency=0.0, jitter=0.0, distribution='uniform', seed=None):
+        self.Latency = latency
+        self.Jitter = jitter
+        self.Distribution = distribution.lower()
+        self.__random = random.Random(seed)
+
+    def sample(self):
+        if self.Distribution == 'fixed' or self.Jitter <= 0 and self.Distribution != 'exponential':
+            delay = self.Latency
+        elif self.Distribution == 'uniform':
+            delay = self.__random.uniform(self.Latency - self.Jitter, self.Latency + self.Jitter)
+        elif self.Distribution == 'normal':
+            delay = self.__random.gauss(self.Latency, self.Jitter)
+        elif self.Distribution == 'exponential':
+            delay = self.__random.expovariate(1.0 / self.Latency) if self.Latency > 0 else 0.0
+        else:
+            raise ValueError('Unknown latency distribution %s' % self.Distribution)
+        return max(0.0, delay)
+
+
+class Scheduler(object):
+    """
+    Runs calls after a delay on one background thread, calls without delay run inline
+    """
+    def __init__(self):
+        self.__calls = []
+        self.__seq = itertools.count()
+        self.__condition = threading.Condition()
+        self.__running = True
+        self.__thread = threading.Thread(target=self.__run, name='Simulator Scheduler')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def call(self, delay, func, *args):
+        if delay <= 0:
+            func(*args)
+            return
+        with self.__condition:
+            heapq.heappush(self.__calls, (time.time() + delay, next(self.__seq), func, args))
+            self.__condition.notify()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while self.__running and (not self.__calls or self.__calls[0][0] > time.time()):
+                    self.__condition.wait(self.__calls[0][0] - time.time() if self.__calls else None)
+                if not self.__running:
+                    return
+                _, _, func, args = heapq.heappop(self.__calls)
+            try:
+                func(*args)
+            except Exception as e:
+                print('Error in Scheduler: %s' % e)
+
+    def stop(self):
+        with self.__condition:
+            self.__running = False
+            self.__condition.notify()
+        self.__thread.join()
+
+
+class Application(fix.Application):
+    """
+    Acceptor side exchange simulator. Replies to an inbound message share one delay from the latency model.
+    Settings in [DEFAULT]: SimPrices (6E:1.1,VX:12.5), SimDefaultPrice, SimSpread, SimMarketMaker (Y/N),
+    SimBalance, SimCurrency, SimCommission, SimLatency and SimJitter (milliseconds), SimLatencyDistribution.
+    """
+    def __init__(self, settings=None):
+        super(Application, self).__init__()
+        setting = (lambda name, default, cast=float: getSetting(settings, name, default, cast)) if settings \
+            else (lambda name, default, cast=float: default)
+        prices = dict((p.split(':')[0].strip(), float(p.split(':')[1])) for p in
+                      setting('SimPrices', '', str).split(',') if ':' in p)
+        self.Exchange = Exchange(prices, setting('SimDefaultPrice', 100.0), setting('SimSpread', 0.02),
+                                 setting('SimMarketMaker', 'Y', str).upper() == 'Y', setting('SimBalance', 100000.0),
+                                 setting('SimCurrency', 'USD', str), setting('SimCommission', 0.0))
+        self.Latency = LatencyModel(setting('SimLatency', 0.0) / 1000, setting('SimJitter', 0.0) / 1000,
+                                    setting('SimLatencyDistribution', 'uniform', str))
+        self.Scheduler = Scheduler()
+        self.__lock = threading.Lock()
+        self.__execIds = itertools.count(1)
+        self.__reportIds = itertools.count(1)
+        self.Received = 0
 
     def onCreate(self, sessionID):
-        print('onCreate')
         return
 
     def onLogon(self, sessionID):
-        print('onLogon')
+        print('onLogon %s' % sessionID)
         return
 
     def onLogout(self, sessionID):
-        print('onLogout')
+        print('onLogout %s' % sessionID)
         return
 
     def toAdmin(self, message, sessionID):
-        print('toAdmin')
-        sndTime = fix.SendingTime()
-        message.getHeader().getField(sndTime)
-        print((sndTime.getString()))
         return
 
     def fromAdmin(self, message, sessionID):
-        print('fromAdmin')
         return
 
     def toApp(self, message, sessionID):
-        print('toApp')
         return
 
     def fromApp(self, message, sessionID):
-        print('fromApp')
-        beginString = fix.BeginString()
-        msgType = fix.MsgType()
-        message.getHeader().getField(beginString)
-        message.getHeader().getField(msgType)
-
-        if msgType.getValue() == fix.MsgType_NewOrderSingle:
-            self.new_order(message, beginString, sessionID)
-        if msgType.getValue() == fix.MsgType_OrderCancelRequest:
-            self.cancel(message, sessionID)
-
-    def cancel(self, message, sessionID):
-        symbol = fix.Symbol()
-        side = fix.Side()
-        orderQty = fix.OrderQty()
-        clOrdID = fix.ClOrdID()
-        org = fix.OrigClOrdID()
-        message.getField(symbol)
-        message.getField(side)
-        message.getField(orderQty)
-        message.getField(clOrdID)
-        message.getField(org)
-
-        cancel = fix44.OrderCancelReject()
-        cancel.setField(clOrdID)
-        cancel.setField(fix.OrderID(self.genOrderID()))
-        cancel.setField(fix.OrdStatus(fix.OrdStatus_NEW))
-        cancel.setField(fix.OrigClOrdID(org.getValue()))
-        cancel.setField(fix.Text('order completed'))
-        cancel.setField(fix.TransactTime())
-        cancel.setField(fix.CxlRejReason(fix.CxlRejReason_BROKER))
-        cancel.setField(fix.CxlRejResponseTo(fix.CxlRejResponseTo_ORDER_CANCEL_REQUEST))
-
-        fix.Session.sendToTarget(cancel, sessionID)
-
-    def new_order(self, message, beginString, sessionID):
-        symbol = fix.Symbol()
-        side = fix.Side()
-        ordType = fix.OrdType()
-        orderQty = fix.OrderQty()
-        price = fix.Price(50)
-        clOrdID = fix.ClOrdID()
-
-        message.getField(ordType)
-
-        message.getField(symbol)
-        message.getField(side)
-        message.getField(orderQty)
-        #message.getField(price)
-        message.getField(clOrdID)
-
-        executionReport = fix.Message()
-        executionReport.getHeader().setField(beginString)
-        executionReport.getHeader().setField(fix.MsgType(fix.MsgType_ExecutionReport))
-
-        executionReport.setField(fix.TransactTime())
-        executionReport.setField(fix.OrderID(self.genOrderID()))
-        executionReport.setField(fix.ExecID(self.genExecID()))
-        executionReport.setField(fix.OrdStatus(fix.OrdStatus_NEW))
-        executionReport.setField(symbol)
-        executionReport.setField(side)
-        executionReport.setField(fix.CumQty(orderQty.getValue()))
-        executionReport.setField(fix.AvgPx(price.getValue()))
-        executionReport.setField(fix.LastShares(orderQty.getValue()))
-        executionReport.setField(fix.LastPx(price.getValue()))
-        executionReport.setField(clOrdID)
-        executionReport.setField(orderQty)
-        executionReport.setField(fix.ExecType(fix.ExecType_NEW))
-        executionReport.setField(fix.LeavesQty(orderQty.getValue()))
-
-        try:
-            fix.Session.sendToTarget(executionReport, sessionID)
-            time.sleep(1)
-            if ordType.getValue() == fix.OrdType_MARKET:
-                executionReport.setField(fix.OrdStatus(fix.OrdStatus_FILLED))
-                executionReport.setField(fix.ExecType(fix.ExecType_TRADE))
-                fix.Session.sendToTarget(executionReport, sessionID)
-
-        except fix.SessionNotFound as e:
+        msgType = message.getHeader().getField(35)
+        handler = self.Handlers.get(msgType)
+        if handler is None:
             return
+        with self.__lock:
+            self.Received += 1
+            replies = handler(self, message, sessionID)
+        self.Scheduler.call(self.Latency.sample(), self.__send, replies)
+
+    @staticmethod
+    def __send(replies):
+        for message, sessionID in replies:
+            try:
+                fix.Session.sendToTarget(message, sessionID)
+            except fix.SessionNotFound:
+                pass
+
+    @staticmethod
+    def __field(message, tag, default=None):
+        return message.getField(tag) if message.isSetField(tag) else default
+
+    def __executionReport(self, order, execType, ordStatus, lastQty=0, lastPx=0.0, leaves=None, cumQty=None,
+                          avgPx=None):
+        report = fix44.ExecutionReport()
+        report.setField(fix.OrderID(order.OrderID or 'NONE'))
+        report.setField(fix.ExecID(str(next(self.__execIds))))
+        report.setField(fix.ExecType(execType))
+        report.setField(fix.OrdStatus(ordStatus))
+        report.setField(fix.Account(order.Account))
+        report.setField(fix.ClOrdID(order.ClOrdID))
+        report.setField(fix.Symbol(order.Symbol))
+        report.setField(fix.MaturityMonthYear(order.Maturity))
+        report.setField(fix.Side(order.Side))
+        report.setField(fix.OrdType(order.OrdType))
+        report.setField(fix.OrderQty(order.Quantity))
+        if order.Price is not None:
+            report.setField(fix.Price(order.Price))
+        report.setField(fix.LeavesQty((order.Leaves if order.Open else 0) if leaves is None else leaves))
+        report.setField(fix.CumQty(order.CumQty if cumQty is None else cumQty))
+        report.setField(fix.AvgPx(order.avgPx() if avgPx is None else avgPx))
+        if lastQty:
+            report.setField(fix.LastQty(lastQty))
+            report.setField(fix.LastPx(lastPx))
+        report.setField(fix.TransactTime())
+        return report
+
+    def __order(self, message, sessionID, account=None):
+        ordType = message.getField(40)
+        price = float(message.getField(44)) if ordType == fix.OrdType_LIMIT else None
+        return Order(message.getField(11), sessionID, self.__field(message, 1, account), message.getField(55),
+                     self.__field(message, 200, ''), message.getField(54), ordType,
+                     float(message.getField(38)), price)
+
+    def __execute(self, order):
+        if order.OrdType not in (fix.OrdType_MARKET, fix.OrdType_LIMIT) or order.Quantity <= 0:
+            return [(self.__executionReport(order, fix.ExecType_REJECTED, fix.OrdStatus_REJECTED), order.SessionID)]
+        fills = self.Exchange.newOrder(order)
+        replies = [(self.__executionReport(order, fix.ExecType_NEW, fix.OrdStatus_NEW, leaves=order.Quantity,
+                                           cumQty=0, avgPx=0.0), order.SessionID)]
+        for filled, quantity, price, leaves, cumQty, avgPx in fills:
+            status = fix.OrdStatus_PARTIALLY_FILLED if leaves > 0 else fix.OrdStatus_FILLED
+            replies.append((self.__executionReport(filled, fix.ExecType_TRADE, status, quantity, price, leaves,
+                                                   cumQty, avgPx), filled.SessionID))
+        if order.OrdType == fix.OrdType_MARKET and order.Leaves > 0:
+            replies.append((self.__executionReport(order, fix.ExecType_CANCELED, fix.OrdStatus_CANCELED),
+                            order.SessionID))
+        return replies
+
+    def newOrderSingle(self, message, sessionID):
+        return self.__execute(self.__order(message, sessionID))
+
+    def newOrderList(self, message, sessionID):
+        account = self.__field(message, 1)
+        group = fix44.NewOrderList.NoOrders()
+        replies = []
+        count = int(message.getField(73))
+        for i in range(1, count + 1):
+            message.getGroup(i, group)
+            replies.extend(self.__execute(self.__order(group, sessionID, account)))
+        status = fix44.ListStatus()
+        status.setField(fix.ListID(message.getField(66)))
+        status.setField(fix.ListStatusType(fix.ListStatusType_ACK))
+        status.setField(fix.NoRpts(1))
+        status.setField(fix.ListOrderStatus(fix.ListOrderStatus_EXECUTING))
+        status.setField(fix.RptSeq(1))
+        status.setField(fix.TotNoOrders(count))
+        return [(status, sessionID)] + replies
+
+    def orderCancelRequest(self, message, sessionID):
+        origClOrdID = message.getField(41)
+        order = self.Exchange.cancel(origClOrdID)
+        if order is None:
+            reject = fix44.OrderCancelReject()
+            reject.setField(fix.OrderID('NONE'))
+            reject.setField(fix.ClOrdID(message.getField(11)))
+            reject.setField(fix.OrigClOrdID(origClOrdID))
+            reject.setField(fix.OrdStatus(fix.OrdStatus_REJECTED))
+            reject.setField(fix.CxlRejResponseTo(fix.CxlRejResponseTo_ORDER_CANCEL_REQUEST))
+            reject.setField(fix.CxlRejReason(fix.CxlRejReason_UNKNOWN_ORDER))
+            reject.setField(fix.Text('order is not open'))
+            reject.setField(fix.TransactTime())
+            return [(reject, sessionID)]
+        report = self.__executionReport(order, fix.ExecType_CANCELED, fix.OrdStatus_CANCELED)
+        report.setField(fix.ClOrdID(message.getField(11)))
+        report.setField(fix.OrigClOrdID(origClOrdID))
+        return [(report, sessionID)]
+
+    def collateralInquiry(self, message, sessionID):
+        account = self.Exchange.account(self.__field(message, 1, ''))
+        report = fix44.CollateralReport()
+        report.setField(fix.CollRptID(str(next(self.__reportIds))))
+        report.setField(fix.CollInquiryID(message.getField(909)))
+        report.setField(fix.CollStatus(fix.CollStatus_UNASSIGNED))
+        report.setField(fix.Account(account.Name))
+        report.setField(fix.Currency(account.Currency))
+        report.setField(fix.CashOutstanding(account.Balance))
+        return [(report, sessionID)]
+
+    def requestForPositions(self, message, sessionID):
+        account = self.Exchange.account(self.__field(message, 1, ''))
+        posReqID = message.getField(710)
+        clearingDate = self.__field(message, 715, datetime.datetime.utcnow().strftime('%Y%m%d'))
+        positions = [(key, quantity) for key, quantity in sorted(account.Positions.items()) if quantity]
+        ack = fix44.RequestForPositionsAck()
+        ack.setField(fix.PosMaintRptID(str(next(self.__reportIds))))
+        ack.setField(fix.PosReqID(posReqID))
+        ack.setField(fix.TotalNumPosReports(len(positions)))
+        ack.setField(fix.PosReqResult(fix.PosReqResult_VALID_REQUEST))
+        ack.setField(fix.PosReqStatus(fix.PosReqStatus_COMPLETED))
+        ack.setField(fix.Account(account.Name))
+        ack.setField(fix.AccountType(fix.AccountType_ACCOUNT_IS_CARRIED_ON_CUSTOMER_SIDE_OF_BOOKS))
+        replies = [(ack, sessionID)]
+        for (symbol, maturity), quantity in positions:
+            mid = self.Exchange.Prices.get(symbol, self.Exchange.DefaultPrice)
+            report = fix44.PositionReport()
+            report.setField(fix.PosMaintRptID(str(next(self.__reportIds))))
+            report.setField(fix.PosReqID(posReqID))
+            report.setField(fix.TotalNumPosReports(len(positions)))
+            report.setField(fix.PosReqResult(fix.PosReqResult_VALID_REQUEST))
+            report.setField(fix.ClearingBusinessDate(clearingDate))
+            report.setField(fix.Account(account.Name))
+            report.setField(fix.AccountType(fix.AccountType_ACCOUNT_IS_CARRIED_ON_CUSTOMER_SIDE_OF_BOOKS))
+            report.setField(fix.SettlPrice(mid))
+            report.setField(fix.Symbol(symbol))
+            report.setField(fix.MaturityMonthYear(maturity))
+            # groups are sent flat, the client reads them without a data dictionary
+            report.setField(fix.NoPositions(1))
+            report.setField(fix.LongQty(max(quantity, 0)))
+            report.setField(fix.ShortQty(max(-quantity, 0)))
+            report.setField(fix.NoPosAmt(1))
+            report.setField(fix.PosAmt(quantity * mid))
+            replies.append((report, sessionID))
+        return replies
+
+    Handlers = {
+        fix.MsgType_NewOrderSingle: newOrderSingle,
+        fix.MsgType_NewOrderList: newOrderList,
+        fix.MsgType_OrderCancelRequest: orderCancelRequest,
+        fix.MsgType_CollateralInquiry: collateralInquiry,
+        fix.MsgType_RequestForPositions: requestForPositions,
+    }
 
 
 def main(file_name):
 
     try:
         settings = fix.SessionSettings(file_name)
-        application = Application()
-        storeFactory = fix.FileStoreFactory(settings)
-        logFactory = fix.FileLogFactory(settings)
+        application = Application(settings)
+        storeFactory = fix.MemoryStoreFactory()
+        logFactory = fix.ScreenLogFactory(False, False, False)
 
         acceptor = fix.SocketAcceptor(application, storeFactory, settings, logFactory)
         print('starting acceptor')
@@ -146,4 +463,4 @@ def main(file_name):
         print(e)
 
 if __name__ == '__main__':
-    main('executor.ini')
+    main(sys.argv[1] if len(sys.argv) > 1 else 'executor.ini')
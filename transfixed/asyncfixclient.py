@@ -0,0 +1,140 @@
+import asyncio
+import functools
+from transfixed import gainfixtrader as gain
+
+
+class EventStream(object):
+    """
+    Async iterator over FixClient events. Events are handed over from the QuickFIX
+    callback threads to the event loop with call_soon_threadsafe. The queue is created
+    on the loop itself, so it is bound to that loop and not to the default one.
+    """
+    def __init__(self, loop, logger, add, remove, maxsize=0):
+        self.Logger = logger
+        self.__loop = loop
+        self.__maxsize = maxsize
+        self.__queue = None
+        self.__remove = remove
+        self.__closed = False
+        add(self.__receive)
+
+    def __events(self):
+        if self.__queue is None:
+            self.__queue = asyncio.Queue(self.__maxsize)
+        return self.__queue
+
+    def __receive(self, event):
+        self.__loop.call_soon_threadsafe(self.__put, event)
+
+    def __put(self, event):
+        try:
+            self.__events().put_nowait(event)
+        except asyncio.QueueFull:
+            self.Logger.error('Event stream is full. Event dropped: %s' % vars(event))
+
+    def __wake(self):
+        # a full queue has no waiting consumer, __anext__ sees the stream closed
+        if not self.__events().full():
+            self.__events().put_nowait(None)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.__closed:
+            raise StopAsyncIteration
+        event = await self.__events().get()
+        if event is None:
+            raise StopAsyncIteration
+        return event
+
+    def close(self):
+        if not self.__closed:
+            self.__closed = True
+            self.__remove(self.__receive)
+            self.__loop.call_soon_threadsafe(self.__wake)
+
+
+class AsyncFixClient(object):
+    """
+    asyncio facade over FixClient. Replies are awaited through the request futures,
+    so any number of orders and inquiries can be in flight without a thread per request.
+    Requests are sent on the default executor because sending can wait for the throttle
+    or a reconnect.
+    """
+    def __init__(self, client, loop=None):
+        self.FixClient = client
+        self.Logger = client.Logger
+        self.__loop = loop or asyncio.get_event_loop()
+        self.__streams = []
+
+    @classmethod
+    def Create(cls, logger, config, storeMessages, loop=None):
+        return cls(gain.FixClient.Create(logger, config, storeMessages), loop)
+
+    async def start(self):
+        await self.__loop.run_in_executor(None, self.FixClient.start)
+
+    async def stop(self):
+        for stream in self.__streams:
+            stream.close()
+        del self.__streams[:]
+        await self.__loop.run_in_executor(None, self.FixClient.stop)
+
+    async def __request(self, method, *args, **kwargs):
+        return await self.__loop.run_in_executor(None, functools.partial(method, *args, reply=True, **kwargs))
+
+    async def send(self, order, timeout=None, until=gain.TerminalStatuses, account=None, strategy=None):
+        """
+        Send a new order
+        :param order: one of the Buy/Sell Future Limit/Market orders
+        :param timeout: seconds to wait for the reply, ReplyTimeout setting by default
+        :param until: order statuses that complete the call
+        :param account: account to trade, of the default session by default
+        :param strategy: strategy tag of the sessions to send on
+        :return: order event in one of the until statuses
+        """
+        trade = await self.__request(self.FixClient.send, order, timeout=timeout, until=until, account=account,
+                                     strategy=strategy)
+        return await asyncio.wrap_future(trade.Reply, loop=self.__loop)
+
+    async def cancel(self, trade, timeout=None):
+        """
+        Cancel an order
+        :param trade: Trade of the order, OrderId is the ClientOrderId of its events
+        :return: Cancelled or CancelRejected event
+        """
+        future = await self.__request(self.FixClient.cancel, trade, timeout=timeout)
+        return await asyncio.wrap_future(future, loop=self.__loop)
+
+    async def collateral_inquiry(self, timeout=None, account=None):
+        """
+        :return: CollateralReport event
+        """
+        future = await self.__request(self.FixClient.collateralInquiry, timeout=timeout, account=account)
+        return await asyncio.wrap_future(future, loop=self.__loop)
+
+    async def request_for_positions(self, timeout=None, account=None):
+        """
+        :return: list of PositionReport events
+        """
+        future = await self.__request(self.FixClient.requestForPositions, timeout=timeout, account=account)
+        return await asyncio.wrap_future(future, loop=self.__loop)
+
+    def orders(self, maxsize=0):
+        """
+        Async iterator over all order events, closed by stop() or close()
+        """
+        stream = EventStream(self.__loop, self.Logger, self.FixClient.addOrderListener,
+                             self.FixClient.removeOrderListener, maxsize)
+        self.__streams.append(stream)
+        return stream
+
+    def account_events(self, maxsize=0):
+        """
+        Async iterator over all collateral and position events, closed by stop() or close()
+        """
+        stream = EventStream(self.__loop, self.Logger, self.FixClient.addAccountInquiryListener,
+                             self.FixClient.removeAccountInquiryListener, maxsize)
+        self.__streams.append(stream)
+        return stream
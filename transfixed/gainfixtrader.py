@@ -2,10 +2,37 @@ import quickfix as fix
 import quickfix44 as fix44
 import logging
 import threading
+import heapq
+from concurrent.futures import Future, TimeoutError
+from queue import Queue, Full
 from datetime import datetime
+from collections import OrderedDict, deque, namedtuple
 import calendar
 import time
 
+# wall clock fallback for python 2 which has no monotonic clock
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+def getSetting(settings, name, default, cast=int, sessionID=None):
+    """
+    Read an optional value from the session settings
+    :param settings: quickfix SessionSettings
+    :param name: setting name
+    :param default: value returned when the setting is not configured
+    :param cast: conversion applied to the configured string
+    :param sessionID: read the [SESSION] section of this session, [DEFAULT] by default
+    :return: setting value
+    """
+    dictionary = settings.get() if sessionID is None else settings.get(sessionID)
+    if dictionary.has(name):
+        return cast(dictionary.getString(name))
+    return default
+
+
+# session settings used on the send path, resolved once per application
+ClientSettings = namedtuple('ClientSettings', ['Account', 'Username', 'Password', 'MaxLatency', 'NewOrderList'])
+
 
 class AccountInquiry:
     CollateralInquiry = 'CollateralInquiry'
@@ -14,18 +41,28 @@ class AccountInquiry:
 
 class Notify:
     Latency = 'Latency'
+    Session = 'Session'
     Order = 'Order'
     Account = 'Account'
+    PositionDrift = 'PositionDrift'
 
 
 class OrderStatus:
+    PendingNew = 'PendingNew'
     New = 'New'
+    PartiallyFilled = 'PartiallyFilled'
     Filled = 'Filled'
     Cancelled = 'Cancelled'
     Rejected = 'Rejected'
     CancelRejected = 'CancelRejected'
 
 
+class DispatchOverflow:
+    Block = 'Block'
+    Drop = 'Drop'
+    Inline = 'Inline'
+
+
 class OrderSide:
     Buy = 'Buy'
     Sell = 'Sell'
@@ -36,8 +73,19 @@ class OrderType:
     Market = 'Market'
 
 
+# statuses after which an order receives no further execution reports
+TerminalStatuses = (OrderStatus.Filled, OrderStatus.Cancelled, OrderStatus.Rejected)
+# execution types of the reports carrying a fill in LastQty, Trade in FIX 4.4 and the older fill types
+FillExecTypes = (fix.ExecType_TRADE, fix.ExecType_PARTIAL_FILL, fix.ExecType_FILL)
+
+
+class ReplyTimeout(TimeoutError):
+    pass
+
+
 class Trade(object):
     def __init__(self, orderId, symbol, maturity, qty, ordType, ordSide, price=None):
+        self.Reply = None
         self.OrderId = orderId
         self.Symbol = symbol
         self.Maturity = maturity
@@ -46,6 +94,7 @@ class Trade(object):
         self.OrderSide = ordSide
         self.Price = price
         self.CFICode = fix.CFICode('FXXXXS')
+        self.Session = None
 
 
 class BuyOrder(object):
@@ -115,6 +164,10 @@ class FixClient(object):
     def __init__(self, init, logger):
         self.SocketInitiator = init
         self.Logger = logger
+        self.__templates = {}
+        self.__syncStop = threading.Event()
+        self.__syncs = {}
+        self.__syncLock = threading.Lock()
 
     @classmethod
     def Create(cls, logger, config, storeMessages):
@@ -129,14 +182,50 @@ class FixClient(object):
         application.FixClientRef = client
         return client
 
+    @staticmethod
+    def __stamp(message, session):
+        """
+        Address a message to a session, GainApplication.send reads the session from the header
+        """
+        message.getHeader().setField(fix.SenderCompID(session.SenderCompID))
+        message.getHeader().setField(fix.TargetCompID(session.TargetCompID))
+        return message
+
     def heartbeat(self):
-        message = fix.Message()
-        message.getHeader().setField(fix.MsgType(fix.MsgType_Heartbeat))
-        self.SocketInitiator.application.send(message)
+        for session in self.SocketInitiator.application.Sessions.values():
+            message = fix.Message()
+            message.getHeader().setField(fix.MsgType(fix.MsgType_Heartbeat))
+            self.SocketInitiator.application.send(FixClient.__stamp(message, session))
 
     def logout(self):
-        message = fix44.Logout()
-        self.SocketInitiator.application.send(message)
+        for session in self.SocketInitiator.application.Sessions.values():
+            self.SocketInitiator.application.send(FixClient.__stamp(fix44.Logout(), session))
+
+    def sessions(self, reset=False):
+        """
+        State of every session in the configuration
+        :param reset: clear the latency histograms after reading them
+        :return: dict of SessionID string -> dict with Account, Strategies, Connected, Sent, Received,
+        NextSenderMsgSeqNum, NextTargetMsgSeqNum and Latency
+        """
+        return OrderedDict((name, session.snapshot(reset))
+                           for name, session in self.SocketInitiator.application.Sessions.items())
+
+    def route(self, account=None, strategy=None):
+        """
+        Session the next request of an account or strategy is sent on
+        :return: SessionID string
+        """
+        return self.SocketInitiator.application.Router.route(account, strategy).Name
+
+    def addSessionListener(self, callback):
+        """
+        :param callback: called with an event with Session, Account and Connected on every logon and logout
+        """
+        self.SocketInitiator.application.Notifier.addMessageHandler(Notify.Session, callback)
+
+    def removeSessionListener(self, callback):
+        self.SocketInitiator.application.Notifier.removeMsgHandler(Notify.Session, callback)
 
     def addAccountInquiryListener(self, callback):
         self.SocketInitiator.application.Notifier.addMessageHandler(Notify.Account, callback)
@@ -144,12 +233,143 @@ class FixClient(object):
     def addOrderListener(self, callback):
         self.SocketInitiator.application.Notifier.addMessageHandler(Notify.Order, callback)
 
-    def cancel(self, trade):
-        orderId = self.SocketInitiator.application.genOrderID()
-        account = self.SocketInitiator.application.Settings.get().getString('Account')
+    def removeAccountInquiryListener(self, callback):
+        self.SocketInitiator.application.Notifier.removeMsgHandler(Notify.Account, callback)
+
+    def removeOrderListener(self, callback):
+        self.SocketInitiator.application.Notifier.removeMsgHandler(Notify.Order, callback)
+
+    def addPositionDriftListener(self, callback):
+        for book in self.SocketInitiator.application.Accounts.values():
+            book.Positions.addMessageHandler(Notify.PositionDrift, callback)
+
+    def position(self, symbol, maturity, account=None):
+        """
+        Net position kept from fills since the last syncPositions
+        :param account: account of the position, of the default session by default
+        :return: net position, None until positions are synchronised
+        """
+        return self.SocketInitiator.application.account(account).Positions.position(symbol, maturity)
+
+    def syncPositions(self, timeout=None, account=None):
+        """
+        Replace the kept positions with a RequestForPositions snapshot. When the snapshot does not complete
+        the error is raised and the kept positions are not seeded from it. Concurrent callers for the same
+        account share one request, so a late snapshot never replaces the positions seeded by another.
+        :param timeout: seconds to wait for the position reports, ReplyTimeout setting by default
+        :param account: account to synchronise, of the default session by default
+        :return: list of ((symbol, maturity), expected, actual) that drifted
+        """
+        book = self.SocketInitiator.application.account(account)
+        with self.__syncLock:
+            future = self.__syncs.get(book.Account)
+            sender = future is None or future.done()
+            if sender:
+                future = self.__syncs[book.Account] = Future()
+        if sender:
+            try:
+                reports = self.requestForPositions(reply=True, timeout=timeout, account=account).result()
+                future.set_result(book.Positions.seed(reports))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def positionsSynchronised(self, account=None):
+        """
+        :return: True once the positions of the account were seeded by syncPositions
+        """
+        return self.SocketInitiator.application.account(account).Positions.seeded()
+
+    def startPositionSync(self, interval):
+        """
+        Synchronise the positions now and then every interval seconds until stop
+        """
+        def sync():
+            while not self.__syncStop.is_set():
+                for account in self.SocketInitiator.application.Accounts:
+                    try:
+                        self.syncPositions(account=account)
+                    except Exception as e:
+                        self.Logger.error('Position sync of %s failed: %s' % (account, e))
+                self.__syncStop.wait(interval)
+        self.__syncStop.clear()
+        worker = threading.Thread(target=sync)
+        worker.daemon = True
+        worker.name = 'Position Sync'
+        worker.start()
+
+    def balance(self, maxAge=None, timeout=None, account=None):
+        """
+        Account balance less reservations, refreshed with a CollateralInquiry when older than maxAge
+        :param maxAge: seconds a cached balance stays valid, BalanceMaxAge setting by default
+        :param timeout: seconds to wait for a refresh, ReplyTimeout setting by default
+        :param account: account of the default session by default
+        :return: (available balance, currency)
+        """
+        application = self.SocketInitiator.application
+        if maxAge is None:
+            maxAge = getSetting(application.Settings, 'BalanceMaxAge', 5, float)
+        return application.account(account).Balance.get(
+            maxAge, lambda: self.collateralInquiry(reply=True, timeout=timeout, account=account))
+
+    def reserve(self, key, amount, account=None):
+        """
+        Deduct an amount from the available balance until release or until the order with ClOrdID key terminates
+        """
+        self.SocketInitiator.application.account(account).Balance.reserve(key, amount)
 
-        cancel = fix44.OrderCancelRequest()
-        cancel.setField(fix.Account(account))
+    def tryReserve(self, key, amount, predicate, maxAge=None, timeout=None, account=None):
+        """
+        Reserve an amount only if predicate(available balance, currency) holds for the balance at that moment
+        :param maxAge: seconds a cached balance stays valid, BalanceMaxAge setting by default
+        :param timeout: seconds to wait for a refresh, ReplyTimeout setting by default
+        :param account: account of the default session by default
+        :return: (reserved, available balance before the reservation, currency)
+        """
+        self.balance(maxAge, timeout, account)
+        return self.SocketInitiator.application.account(account).Balance.tryReserve(key, amount, predicate)
+
+    def release(self, key):
+        for book in self.SocketInitiator.application.Accounts.values():
+            book.Balance.release(key)
+
+    def order(self, orderId):
+        """
+        :param orderId: ClOrdID of an order or of a cancel request
+        :return: OrderRecord with the latest known state of the order or None
+        """
+        return self.SocketInitiator.application.Orders.get(orderId)
+
+    def openOrders(self, symbol=None, maturity=None):
+        """
+        :return: OrderRecords of the open orders, all of them or of one symbol and maturity
+        """
+        return self.SocketInitiator.application.Orders.openOrders(symbol, maturity)
+
+    def latencySnapshot(self, reset=False, session=None):
+        """
+        Broker round trip latency percentiles per request message type
+        :param reset: clear the histograms after reading them
+        :param session: SessionID string, the default session by default, see sessions for all of them
+        :return: dict of round trip name -> dict with count, p50, p90, p99 and max in seconds
+        """
+        return self.SocketInitiator.application.latencySnapshot(reset, session)
+
+    def cancel(self, trade, reply=False, timeout=None):
+        """
+        Cancel an order
+        :param trade: Trade returned by send
+        :param reply: return a Future resolved with the Cancelled or CancelRejected event
+        :param timeout: seconds before the Future fails with ReplyTimeout, ReplyTimeout setting by default
+        :return: Future if reply is requested
+        """
+        application = self.SocketInitiator.application
+        orderId = application.genOrderID()
+        # a cancel goes to the session of the order
+        session = application.Sessions.get(trade.Session) or application.Default
+
+        cancel = FixClient.__stamp(fix44.OrderCancelRequest(), session)
+        cancel.setField(fix.Account(session.Account))
         cancel.setField(fix.ClOrdID(orderId))
         cancel.setField(fix.OrigClOrdID(trade.OrderId))
 
@@ -160,61 +380,175 @@ class FixClient(object):
         cancel.setField(fix.Symbol(trade.Symbol))
         cancel.setField(fix.MaturityMonthYear(trade.Maturity))
 
+        future = self.SocketInitiator.application.Replies.register(
+            orderId, timeout, (OrderStatus.Cancelled, OrderStatus.CancelRejected)) if reply else None
+        self.SocketInitiator.application.Orders.addCancel(orderId, trade.OrderId)
         self.SocketInitiator.application.send(cancel)
+        return future
 
-    def requestForPositions(self):
+    def requestForPositions(self, reply=False, timeout=None, account=None):
+        """
+        Request the open positions of the account
+        :param reply: return a Future resolved with the list of PositionReport events instead of the PosReqID
+        :param timeout: seconds before the Future fails with ReplyTimeout, ReplyTimeout setting by default
+        :param account: account of the default session by default
+        :return: PosReqID or Future
+        """
         clrDate = datetime.now().strftime("%Y%m%d")
         inqId = self.SocketInitiator.application.genInquiryID()
-        account = self.SocketInitiator.application.Settings.get().getString('Account')
-        message = fix44.RequestForPositions()
-        message.setField(fix.Account(account))
+        session = self.SocketInitiator.application.Router.route(account)
+        message = FixClient.__stamp(fix44.RequestForPositions(), session)
+        message.setField(fix.Account(session.Account))
         message.setField(fix.TransactTime())
         message.setField(fix.AccountType(fix.AccountType_ACCOUNT_IS_CARRIED_ON_CUSTOMER_SIDE_OF_BOOKS))
         message.setField(fix.ClearingBusinessDate(clrDate))
         message.setField(fix.PosReqType(fix.PosReqType_POSITIONS))
         message.setField(fix.PosReqID(inqId))
 
+        future = self.SocketInitiator.application.Replies.register(inqId, timeout, collect=True) if reply else None
         self.SocketInitiator.application.send(message)
 
-        return inqId
+        return future if reply else inqId
 
-    def collateralInquiry(self):
+    def collateralInquiry(self, reply=False, timeout=None, account=None):
+        """
+        Request the account balance
+        :param reply: return a Future resolved with the CollateralReport event instead of the CollInquiryID
+        :param timeout: seconds before the Future fails with ReplyTimeout, ReplyTimeout setting by default
+        :param account: account of the default session by default
+        :return: CollInquiryID or Future
+        """
         inqId = self.SocketInitiator.application.genInquiryID()
-        account = self.SocketInitiator.application.Settings.get().getString('Account')
-        message = fix44.CollateralInquiry()
-        message.setField(fix.Account(account))
+        session = self.SocketInitiator.application.Router.route(account)
+        message = FixClient.__stamp(fix44.CollateralInquiry(), session)
+        message.setField(fix.Account(session.Account))
         message.setField(fix.CollInquiryID(inqId))
 
+        future = self.SocketInitiator.application.Replies.register(inqId, timeout) if reply else None
         self.SocketInitiator.application.send(message)
 
-        return inqId
+        return future if reply else inqId
 
-    def send(self, order):
-        orderId = self.SocketInitiator.application.genOrderID()
-        account = self.SocketInitiator.application.Settings.get().getString('Account')
-
-        trade = fix44.NewOrderSingle()
-        trade.setField(fix.Account(account))
-        trade.setField(fix.ClOrdID(orderId))
-
-        trade.setField(order.CFICode)
-        trade.setField(order.TransactionTime)
-        trade.setField(order.Quantity)
-        trade.setField(order.OrdType)
-        trade.setField(order.Side)
-        trade.setField(order.Symbol)
-        trade.setField(order.Maturity)
+    def __template(self, order, session):
+        """
+        NewOrderSingle with the fields shared by all orders in the same session, instrument, side and type
+        :param order: one of the Buy/Sell Future Limit/Market orders
+        :param session: SessionState the order is sent on
+        :return: message to be copied and stamped with ClOrdID, TransactTime, OrderQty and Price
+        """
+        key = (session.Name, order.Symbol.getString(), order.Maturity.getString(), order.Side.getString(),
+               order.OrdType.getString())
+        template = self.__templates.get(key)
+        if template is None:
+            template = FixClient.__stamp(fix44.NewOrderSingle(), session)
+            template.setField(fix.Account(session.Account))
+            template.setField(order.CFICode)
+            template.setField(order.OrdType)
+            template.setField(order.Side)
+            template.setField(order.Symbol)
+            template.setField(order.Maturity)
+            self.__templates[key] = template
+        return template
+
+    def __newOrder(self, order, orderId, session):
+        message = fix.Message(self.__template(order, session))
+        message.setField(fix.ClOrdID(orderId))
+        message.setField(fix.TransactTime())
+        message.setField(order.Quantity)
 
         if isinstance(order, FutureLimitOrder):
-            trade.setField(order.Price)
-
-        self.SocketInitiator.application.send(trade)
+            message.setField(order.Price)
+        return message
 
+    @staticmethod
+    def __trade(order, orderId, future, session):
         ordType = OrderType.Limit if isinstance(order, FutureLimitOrder) else OrderType.Market
         ordSide = OrderSide.Buy if isinstance(order, BuyOrder) else OrderSide.Sell
         price = order.Price.getValue() if isinstance(order, FutureLimitOrder) else None
-        return Trade(orderId, order.Symbol.getString(), order.Maturity.getString(), order.Quantity.getValue(),
-                     ordType, ordSide, price)
+        result = Trade(orderId, order.Symbol.getString(), order.Maturity.getString(), order.Quantity.getValue(),
+                       ordType, ordSide, price)
+        result.Reply = future
+        result.Session = session.Name
+        return result
+
+    def send(self, order, reply=False, timeout=None, until=TerminalStatuses, account=None, strategy=None):
+        """
+        Send a new order
+        :param order: one of the Buy/Sell Future Limit/Market orders
+        :param reply: set Trade.Reply to a Future resolved with the first order event in one of the until statuses
+        :param timeout: seconds before the Future fails with ReplyTimeout, ReplyTimeout setting by default
+        :param until: order statuses that resolve the Future
+        :param account: account to trade, of the default session by default
+        :param strategy: strategy tag routing the order to the sessions with this tag in their Strategies setting
+        :return: Trade
+        """
+        session = self.SocketInitiator.application.Router.route(account, strategy)
+        orderId = self.SocketInitiator.application.genOrderID()
+        trade = self.__newOrder(order, orderId, session)
+
+        future = self.SocketInitiator.application.Replies.register(orderId, timeout, until) if reply else None
+        result = FixClient.__trade(order, orderId, future, session)
+        self.SocketInitiator.application.Orders.add(result)
+        self.SocketInitiator.application.send(trade)
+
+        return result
+
+    def __newOrderList(self, orders, orderIds, session):
+        message = FixClient.__stamp(fix44.NewOrderList(), session)
+        message.setField(fix.ListID('L%s' % orderIds[0]))
+        message.setField(fix.BidType(fix.BidType_NO_BIDDING_PROCESS))
+        message.setField(fix.TotNoOrders(len(orders)))
+        for sequence, (order, orderId) in enumerate(zip(orders, orderIds)):
+            group = fix44.NewOrderList.NoOrders()
+            group.setField(fix.ClOrdID(orderId))
+            group.setField(fix.ListSeqNo(sequence + 1))
+            group.setField(fix.Account(session.Account))
+            group.setField(order.CFICode)
+            group.setField(order.Symbol)
+            group.setField(order.Maturity)
+            group.setField(order.Side)
+            group.setField(fix.TransactTime())
+            group.setField(order.Quantity)
+            group.setField(order.OrdType)
+            if isinstance(order, FutureLimitOrder):
+                group.setField(order.Price)
+            message.addGroup(group)
+        return message
+
+    def sendMany(self, orders, reply=False, timeout=None, until=TerminalStatuses, orderList=None, account=None,
+                 strategy=None):
+        """
+        Send a batch of new orders back to back on one session. ClOrdIDs are reserved in one block and
+        all messages are built before the first one is sent.
+        :param orders: list of Buy/Sell Future Limit/Market orders
+        :param reply: set Trade.Reply of every trade to a Future, see send
+        :param timeout: seconds before the Futures fail with ReplyTimeout, ReplyTimeout setting by default
+        :param until: order statuses that resolve the Futures
+        :param orderList: send a single NewOrderList instead of one NewOrderSingle per order,
+        NewOrderList setting by default. Orders in a list are not timed by the latency check.
+        :param account: account to trade, see send
+        :param strategy: strategy tag, see send
+        :return: list of Trade in the order of orders
+        """
+        if not orders:
+            return []
+        application = self.SocketInitiator.application
+        session = application.Router.route(account, strategy)
+        orderIds = application.genOrderIDs(len(orders))
+        if orderList is None:
+            orderList = application.Config.NewOrderList
+        messages = [self.__newOrderList(orders, orderIds, session)] if orderList else \
+            [self.__newOrder(order, orderId, session) for order, orderId in zip(orders, orderIds)]
+
+        futures = [application.Replies.register(orderId, timeout, until) if reply else None for orderId in orderIds]
+        trades = [FixClient.__trade(order, orderId, future, session)
+                  for order, orderId, future in zip(orders, orderIds, futures)]
+        for trade in trades:
+            application.Orders.add(trade)
+        for message in messages:
+            application.send(message)
+
+        return trades
 
     def start(self):
         self.Logger.info("Open FIX Connection")
@@ -222,17 +556,46 @@ class FixClient(object):
         while not self.SocketInitiator.application.connected:
             self.Logger.info('Waiting to logon ...')
             self.SocketInitiator.application.connection_trigger.wait(2)
+        interval = getSetting(self.SocketInitiator.application.Settings, 'PositionSyncInterval', 0)
+        if interval > 0:
+            self.startPositionSync(interval)
+
+    def dispatcherStats(self, reset=False):
+        """
+        Queue depth and listener execution time when DispatchThreads is configured
+        :param reset: clear the listener execution time histograms after reading them
+        :return: dict of dispatcher metrics or None when events are delivered synchronously
+        """
+        dispatcher = self.SocketInitiator.application.Dispatcher
+        return dispatcher.stats(reset) if dispatcher is not None else None
 
     def stop(self):
         self.Logger.info("Close FIX Connection")
-        self.SocketInitiator.application.Notifier.removeAllMsgHandler()
+        self.__syncStop.set()
         self.SocketInitiator.stop()
+        if self.SocketInitiator.application.Dispatcher is not None:
+            self.SocketInitiator.application.Dispatcher.stop()
+        self.SocketInitiator.application.Notifier.removeAllMsgHandler()
+        self.SocketInitiator.application.Replies.cancelAll()
+        self.SocketInitiator.application.MessageLog.stop()
 
 
 class Observable(object):
-    def __init__(self):
+    # event attributes, in order of preference, that identify the order or inquiry an event belongs to
+    DispatchKeys = ('OrigClOrdID', 'ClientOrderId', 'PosReqID', 'CollInquiryID')
+
+    def __init__(self, logger=None):
         super(Observable, self).__init__()
         self.__callbacks = {}
+        self.__dispatcher = None
+        self.__logger = logger if logger is not None else logging.getLogger()
+
+    def setDispatcher(self, dispatcher):
+        """
+        Deliver events on the dispatcher worker threads instead of the notifying thread
+        :param dispatcher: EventDispatcher or None for synchronous delivery
+        """
+        self.__dispatcher = dispatcher
 
     def addMessageHandler(self, name, callback):
         if name in self.__callbacks:
@@ -251,128 +614,1213 @@ class Observable(object):
             if self.__callbacks[key]:
                 del self.__callbacks[key][:]
 
-    def notifyMsgHandlers(self, name, **kwargs):
+    def createEvent(self, **kwargs):
         e = FixEvent()
         e.source = self
         for k, v in list(kwargs.items()):
             setattr(e, k, v)
+        return e
+
+    def notifyEvent(self, name, e):
+        """
+        Deliver an event created with createEvent. A listener raising an error is logged and
+        does not stop the other listeners.
+        """
         if name in self.__callbacks:
-            for fn in self.__callbacks[name]:
-                fn(e)
+            if self.__dispatcher is not None:
+                key = next((getattr(e, k) for k in Observable.DispatchKeys if getattr(e, k, None) is not None), None)
+                self.__dispatcher.dispatch(key, list(self.__callbacks[name]), e)
+                return e
+            for fn in list(self.__callbacks[name]):
+                try:
+                    fn(e)
+                except Exception as error:
+                    self.__logger.error('Listener %s failed: %s' % (fn, error))
+        return e
+
+    def notifyMsgHandlers(self, name, **kwargs):
+        return self.notifyEvent(name, self.createEvent(**kwargs))
+
+
+class PendingReply(object):
+    __slots__ = ('Future', 'Statuses', 'Events', 'Total', 'Deadline')
+
+    def __init__(self, statuses, collect, deadline):
+        self.Future = Future()
+        self.Statuses = statuses
+        self.Events = [] if collect else None
+        self.Total = None
+        self.Deadline = deadline
+
+
+class ReplyRegistry(object):
+    """
+    Futures of outstanding requests keyed by ClOrdID, CollInquiryID or PosReqID.
+    Replies resolve them in O(1); a single timer thread fails the ones that time out.
+    """
+    def __init__(self, logger, timeout):
+        self.Logger = logger
+        self.__timeout = timeout
+        self.__pending = {}
+        self.__deadlines = []
+        self.__condition = threading.Condition()
+        self.__timer = None
+
+    def register(self, key, timeout=None, statuses=None, collect=False):
+        """
+        Register a request before it is sent
+        :param key: ClOrdID, CollInquiryID or PosReqID of the request
+        :param timeout: seconds to wait for the reply, ReplyTimeout setting by default
+        :param statuses: order statuses that resolve the request, any event if None
+        :param collect: resolve with the list of position reports once TotalNumPosReports of them arrived,
+        the ack reports no positions or a report is marked LastRptRequested; otherwise the request times out
+        :return: Future
+        """
+        deadline = monotonic() + (self.__timeout if timeout is None else timeout)
+        pending = PendingReply(statuses, collect, deadline)
+        with self.__condition:
+            self.__pending[key] = pending
+            heapq.heappush(self.__deadlines, (deadline, key))
+            if self.__timer is None:
+                self.__timer = threading.Thread(target=self.__expire)
+                self.__timer.daemon = True
+                self.__timer.name = 'Reply Timer'
+                self.__timer.start()
+            self.__condition.notify()
+        return pending.Future
+
+    def pending(self):
+        with self.__condition:
+            return len(self.__pending)
+
+    def resolve(self, key, event):
+        """
+        Offer an event to the request registered under key
+        :param key: ClOrdID, OrigClOrdID, CollInquiryID or PosReqID of the event
+        :param event: FixEvent
+        """
+        with self.__condition:
+            pending = self.__pending.get(key)
+            if pending is None:
+                return
+            if pending.Statuses is not None and getattr(event, 'Status', None) not in pending.Statuses:
+                return
+            if pending.Events is not None:
+                if event.Symbol is not None:
+                    pending.Events.append(event)
+                # TotalNumPosReports is optional, without it only an explicit marker completes the snapshot
+                if getattr(event, 'TotalNumPosReports', None) is not None:
+                    pending.Total = event.TotalNumPosReports
+                if getattr(event, 'PosReqResult', None) == fix.PosReqResult_NO_POSITIONS_FOUND_THAT_MATCH_CRITERIA:
+                    pending.Total = len(pending.Events)
+                if getattr(event, 'LastRptRequested', None) == 'Y':
+                    pending.Total = len(pending.Events)
+                if pending.Total is None or len(pending.Events) < pending.Total:
+                    return
+            del self.__pending[key]
+        if not pending.Future.done():
+            pending.Future.set_result(pending.Events if pending.Events is not None else event)
+
+    def cancelAll(self):
+        with self.__condition:
+            pending = list(self.__pending.items())
+            self.__pending.clear()
+            del self.__deadlines[:]
+        for key, reply in pending:
+            reply.Future.cancel()
+
+    def __expire(self):
+        while True:
+            expired = []
+            with self.__condition:
+                now = monotonic()
+                while self.__deadlines and self.__deadlines[0][0] <= now:
+                    deadline, key = heapq.heappop(self.__deadlines)
+                    pending = self.__pending.get(key)
+                    if pending is not None and pending.Deadline == deadline:
+                        del self.__pending[key]
+                        expired.append((key, pending))
+                if not expired:
+                    self.__condition.wait(self.__deadlines[0][0] - now if self.__deadlines else None)
+            for key, pending in expired:
+                self.Logger.error('No reply received for %s' % key)
+                if not pending.Future.done():
+                    pending.Future.set_exception(ReplyTimeout('No reply received for %s' % key))
+
+
+class EventDispatcher(object):
+    """
+    Delivers events to listeners on a pool of worker threads. Events with the same key
+    always go to the same worker, so they are delivered in the order they were notified.
+    With the Inline overflow a full worker queue is run on the notifying thread, the queued
+    events first, so the order per key is kept.
+    """
+    def __init__(self, logger, threads=4, queueSize=10000, overflow=DispatchOverflow.Block):
+        self.Logger = logger
+        self.__overflow = overflow
+        self.__queueSize = queueSize
+        self.__queues = [deque() for _ in range(threads)]
+        # guards a queue and whether its worker is running an event taken from it
+        self.__conditions = [threading.Condition(threading.RLock()) for _ in range(threads)]
+        self.__busy = [False] * threads
+        self.__lock = threading.Lock()
+        self.__timings = {}
+        self.__dropped = 0
+        self.__workers = []
+        for i in range(threads):
+            worker = threading.Thread(target=self.__run, args=(i,))
+            worker.daemon = True
+            worker.name = 'Dispatcher %s' % i
+            worker.start()
+            self.__workers.append(worker)
+
+    @classmethod
+    def Create(cls, logger, settings):
+        threads = getSetting(settings, 'DispatchThreads', 0)
+        if threads < 1:
+            return None
+        return cls(logger, threads, getSetting(settings, 'DispatchQueueSize', 10000),
+                   getSetting(settings, 'DispatchOverflow', DispatchOverflow.Block, str))
+
+    def __execute(self, handlers, event):
+        for fn in handlers:
+            start = monotonic()
+            try:
+                fn(event)
+            except Exception as e:
+                self.Logger.error('Listener %s failed: %s' % (fn, e))
+            elapsed = monotonic() - start
+            name = getattr(fn, '__qualname__', getattr(fn, '__name__', repr(fn)))
+            with self.__lock:
+                if name not in self.__timings:
+                    self.__timings[name] = LatencyHistogram()
+                self.__timings[name].record(elapsed * 1000000)
+
+    def __run(self, index):
+        queue, condition = self.__queues[index], self.__conditions[index]
+        while True:
+            with condition:
+                while not queue:
+                    condition.wait()
+                item = queue.popleft()
+                self.__busy[index] = item is not None
+                condition.notify_all()
+            if item is None:
+                break
+            self.__execute(*item)
+            with condition:
+                self.__busy[index] = False
+                condition.notify_all()
+
+    def dispatch(self, key, handlers, event):
+        index = hash(key) % len(self.__queues)
+        queue, condition = self.__queues[index], self.__conditions[index]
+        with condition:
+            if len(queue) < self.__queueSize:
+                queue.append((handlers, event))
+                condition.notify_all()
+                return
+            if self.__overflow == DispatchOverflow.Block:
+                while len(queue) >= self.__queueSize:
+                    condition.wait()
+                queue.append((handlers, event))
+                condition.notify_all()
+            elif self.__overflow == DispatchOverflow.Inline:
+                # wait for the event the worker is running, then run the queued ones and this one here
+                while self.__busy[index]:
+                    condition.wait()
+                while queue and queue[0] is not None:
+                    self.__execute(*queue.popleft())
+                self.__execute(handlers, event)
+                condition.notify_all()
+            else:
+                with self.__lock:
+                    self.__dropped += 1
+                self.Logger.error('Dispatcher queue is full. Event dropped for %s' % key)
+
+    def stats(self, reset=False):
+        """
+        Dispatcher metrics
+        :param reset: clear the listener execution time histograms after reading them
+        :return: dict with QueueDepth per worker, Dropped events and Listeners execution time percentiles
+        """
+        with self.__lock:
+            return {'QueueDepth': [len(queue) for queue in self.__queues],
+                    'Dropped': self.__dropped,
+                    'Listeners': dict((name, histogram.snapshot(reset)) for name, histogram in self.__timings.items())}
+
+    def stop(self, timeout=None):
+        """
+        Deliver the queued events and stop the workers
+        """
+        for queue, condition in zip(self.__queues, self.__conditions):
+            with condition:
+                queue.append(None)
+                condition.notify_all()
+        for worker in self.__workers:
+            worker.join(timeout)
+
+
+class UTCTimestamp(object):
+    """
+    Parser and formatter for FIX UTCTimestamp values YYYYMMDD-HH:MM:SS[.sss[sss[sss]]]
+    using integer arithmetic. The epoch of the date part is cached because it changes once a day.
+    """
+    __parsed = ('', 0)
+    __formatted = (-1, '')
+
+    @staticmethod
+    def toNanos(value):
+        if len(value) < 17 or value[8] != '-' or value[11] != ':' or value[14] != ':':
+            raise ValueError('time data %r is not a FIX UTCTimestamp' % value)
+        date, epoch = UTCTimestamp.__parsed
+        if value[:8] != date:
+            date = value[:8]
+            epoch = calendar.timegm((int(date[:4]), int(date[4:6]), int(date[6:8]), 0, 0, 0))
+            UTCTimestamp.__parsed = (date, epoch)
+        seconds = epoch + int(value[9:11]) * 3600 + int(value[12:14]) * 60 + int(value[15:17])
+        nanos = 0
+        if len(value) > 17:
+            fraction = value[18:]
+            if value[17] != '.' or not 0 < len(fraction) <= 9:
+                raise ValueError('time data %r is not a FIX UTCTimestamp' % value)
+            nanos = int(fraction) * 10 ** (9 - len(fraction))
+        return seconds * 1000000000 + nanos
+
+    @staticmethod
+    def toMicros(value):
+        return UTCTimestamp.toNanos(value) // 1000
+
+    @staticmethod
+    def format(micros):
+        seconds, fraction = divmod(int(micros), 1000000)
+        days, daySeconds = divmod(seconds, 86400)
+        day, date = UTCTimestamp.__formatted
+        if day != days:
+            date = time.strftime('%Y%m%d', time.gmtime(days * 86400))
+            UTCTimestamp.__formatted = (days, date)
+        hours, rest = divmod(daySeconds, 3600)
+        return '%s-%02d:%02d:%02d.%03d' % (date, hours, rest // 60, rest % 60, fraction // 1000)
+
+    @staticmethod
+    def now():
+        return UTCTimestamp.format(time.time() * 1000000)
+
+
+class LatencyHistogram(object):
+    """
+    Fixed memory log-linear histogram of latencies in microseconds (HDR style).
+    Each power of two range is split into 2^(precision-1) linear sub-buckets,
+    so the relative error of a reported percentile is below 2^(1-precision).
+    """
+    def __init__(self, highest=60000000, precision=5):
+        self.__bits = precision
+        self.__sub = 1 << precision
+        self.__half = self.__sub >> 1
+        self.__highest = highest
+        self.__counts = [0] * self.__index(highest) + [0]
+        self.__total = 0
+        self.__max = 0
+
+    def __index(self, value):
+        if value < self.__sub:
+            return value
+        shift = value.bit_length() - self.__bits
+        return self.__sub + (shift - 1) * self.__half + (value >> shift) - self.__half
+
+    def __upper(self, index):
+        if index < self.__sub:
+            return index
+        shift = (index - self.__sub) // self.__half + 1
+        bucket = (index - self.__sub) % self.__half + self.__half
+        return ((bucket + 1) << shift) - 1
+
+    def record(self, micros):
+        value = min(max(int(micros), 0), self.__highest)
+        self.__counts[self.__index(value)] += 1
+        self.__total += 1
+        if value > self.__max:
+            self.__max = value
+
+    def percentile(self, percent):
+        if self.__total == 0:
+            return 0
+        target = max(1, int(-(-self.__total * percent // 100)))
+        seen = 0
+        for index, count in enumerate(self.__counts):
+            seen += count
+            if seen >= target:
+                return min(self.__upper(index), self.__max)
+        return self.__max
+
+    def reset(self):
+        self.__counts = [0] * len(self.__counts)
+        self.__total = 0
+        self.__max = 0
+
+    def snapshot(self, reset=False):
+        """
+        Summary of the recorded latencies in seconds
+        :param reset: clear the histogram after reading it
+        :return: dict with count, p50, p90, p99 and max
+        """
+        result = {'count': self.__total,
+                  'p50': self.percentile(50) / 1000000.0,
+                  'p90': self.percentile(90) / 1000000.0,
+                  'p99': self.percentile(99) / 1000000.0,
+                  'max': self.__max / 1000000.0}
+        if reset:
+            self.reset()
+        return result
+
+
+class ClockOffsetEstimator(object):
+    """
+    NTP style estimate of the counterparty clock offset in microseconds.
+    For a request stamped t0 by us, answered with t1 by the counterparty after a local
+    round trip of rtt, the offset is t1 - (t0 + rtt / 2). The sample with the smallest
+    round trip in the recent window is the least affected by queuing and is used as the estimate.
+    """
+    def __init__(self, window=8):
+        self.__samples = deque(maxlen=window)
+        self.__offset = None
+
+    def addSample(self, requestMicros, remoteMicros, rttMicros):
+        if rttMicros < 0:
+            return
+        self.__samples.append((rttMicros, remoteMicros - requestMicros - rttMicros // 2))
+        self.__offset = min(self.__samples)[1]
+
+    def offset(self):
+        return self.__offset
 
 
 class MessageStore(Observable):
+    # request MsgType -> name of the round trip it starts
+    RoundTrips = {
+        fix.MsgType_NewOrderSingle: 'NewOrderSingle',
+        fix.MsgType_OrderCancelRequest: 'OrderCancelRequest',
+        fix.MsgType_CollateralInquiry: 'CollateralInquiry',
+        fix.MsgType_RequestForPositions: 'RequestForPositions',
+        fix.MsgType_TestRequest: 'TestRequest',
+        fix.MsgType_Logon: 'Logon',
+        fix.MsgType_Logout: 'Logout',
+    }
+    # MsgType -> (key tag, key in header, timestamp tag, timestamp in header),
+    # messages without a timestamp tag are stamped with the local time and messages without the key tag,
+    # like the Heartbeats that do not answer a TestRequest, are not correlated
+    Correlation = {
+        fix.MsgType_Logon: (34, True, 52, True),
+        fix.MsgType_Logout: (34, True, 52, True),
+        fix.MsgType_TestRequest: (112, False, 52, True),
+        fix.MsgType_Heartbeat: (112, False, 52, True),
+        fix.MsgType_NewOrderSingle: (11, False, 60, False),
+        fix.MsgType_ExecutionReport: (11, False, 60, False),
+        fix.MsgType_OrderCancelRequest: (11, False, 60, False),
+        fix.MsgType_OrderCancelReject: (11, False, 60, False),
+        fix.MsgType_CollateralInquiry: (909, False, None, False),
+        fix.MsgType_CollateralReport: (909, False, None, False),
+        fix.MsgType_RequestForPositions: (710, False, None, False),
+        fix.MsgType_PositionReport: (710, False, None, False),
+        fix.MsgType_RequestForPositionsAck: (710, False, None, False),
+    }
+    # list orders are answered per ClOrdID and are not timed, their replies are expected without a request
+    Uncorrelated = (fix.MsgType_NewOrderList, fix.MsgType_ListStatus)
+    # request MsgTypes answered with a timestamp taken from the counterparty clock
+    ClockSamples = (fix.MsgType_NewOrderSingle, fix.MsgType_OrderCancelRequest, fix.MsgType_Logon)
+
     def __init__(self, logger, settings):
-        super(MessageStore, self).__init__()
+        super(MessageStore, self).__init__(logger)
         self.Logger = logger
         self.Settings = settings
-        self.__out = {}
-        self.__in = {}
+        self.__out = OrderedDict()
+        self.__in = OrderedDict()
+        # keys of requests already timed or not timed, further responses to them are not stored
+        self.__matched = OrderedDict()
         self.__lock = threading.RLock()
         self.__latency = int(self.Settings.get().getString('MaxLatency'))
+        self.__maxSize = getSetting(self.Settings, 'MaxStoreSize', 10000)
+        self.__ttl = getSetting(self.Settings, 'StoreTTL', 300)
+        self.__histograms = dict((name, LatencyHistogram()) for name in MessageStore.RoundTrips.values())
+        self.__clock = ClockOffsetEstimator()
 
     @staticmethod
     def parse(date):
         return datetime.strptime(date, '%Y%m%d-%H:%M:%S.%f' if '.' in date else '%Y%m%d-%H:%M:%S')
 
-    def __timeCheck(self, request, response):
-        requestTime = MessageStore.parse(request)
-        responseTime = MessageStore.parse(response)
-        delta = responseTime - requestTime if responseTime > requestTime else requestTime - responseTime
-        lag_in_seconds = (delta.seconds*1000 + delta.microseconds/1000.0)/1000.0
-        if lag_in_seconds > self.__latency:
-            self.notifyMsgHandlers(Notify.Latency, MaxLatency=self.__latency, CurrentTimeLag=lag_in_seconds)
+    def __timeCheck(self, request, response, msgType, roundTrip):
+        """
+        Compare the timestamps of a matched request and response
+        :param request: request timestamp, our clock
+        :param response: response timestamp, counterparty clock for ClockSamples types
+        :param msgType: request MsgType
+        :param roundTrip: local monotonic time between request and response in seconds,
+        negative if the response was seen first
+        """
+        requestMicros = UTCTimestamp.toMicros(request)
+        responseMicros = UTCTimestamp.toMicros(response)
+        delta = responseMicros - requestMicros
+        if msgType in MessageStore.ClockSamples:
+            delta -= self.__clock.offset() or 0
+            self.__clock.addSample(requestMicros, responseMicros, int(roundTrip * 1000000))
+        lag_in_seconds = delta / 1000000.0
+        if msgType in MessageStore.RoundTrips:
+            self.__histograms[MessageStore.RoundTrips[msgType]].record(
+                roundTrip * 1000000 if roundTrip >= 0 else abs(delta))
+        if abs(lag_in_seconds) > self.__latency or roundTrip > self.__latency:
+            self.notifyMsgHandlers(Notify.Latency, MaxLatency=self.__latency, CurrentTimeLag=lag_in_seconds,
+                                   RoundTripTime=roundTrip, ClockOffset=self.clockOffset())
             self.Logger.error("Max Latency exceeded for messages: %s %s" % (request, response))
 
-    @staticmethod
-    def __uncorkValue(message):
-        msgType = fix.MsgType()
-        message.getHeader().getField(msgType)
-        val = msgType.getValue()
-        if val == fix.MsgType_Logon or val == fix.MsgType_Logout or val == fix.MsgType_Heartbeat:
-            sndTime = fix.SendingTime()
-            message.getHeader().getField(sndTime)
-            return sndTime.getString()
-        if val == fix.MsgType_NewOrderSingle or val == fix.MsgType_ExecutionReport \
-                or val == fix.MsgType_OrderCancelRequest or val == fix.MsgType_OrderCancelReject:
-            transTime = fix.TransactTime()
-            message.getField(transTime)
-            return transTime.getString()
-        if val == fix.MsgType_CollateralInquiry or val == fix.MsgType_CollateralReport \
-                or val == fix.MsgType_RequestForPositions or val == fix.MsgType_PositionReport \
-                or val == fix.MsgType_RequestForPositionsAck:
-            return datetime.now().strftime("%Y%m%d-%H:%M:%S")
-        return None
+    def clockOffset(self):
+        """
+        Estimated offset of the counterparty clock from ours
+        :return: seconds, None until a request/response pair with a counterparty timestamp was seen
+        """
+        offset = self.__clock.offset()
+        return None if offset is None else offset / 1000000.0
 
     @staticmethod
-    def __uncorkKey(message):
+    def __uncork(message, msgType):
         """
-        Return a value that can be used as a key based on a message type
+        Return a value that can be used as a key and the timestamp of a message
         :param message: FIX message
-        :return: key
-        """
-        msgType = fix.MsgType()
-        message.getHeader().getField(msgType)
-        if msgType.getValue() == fix.MsgType_Logon:
-            sequence = fix.MsgSeqNum()
-            message.getHeader().getField(sequence)
-            return '%s_%s' % (fix.MsgType_Logon, sequence.getValue())
-        if msgType.getValue() == fix.MsgType_Logout:
-            sequence = fix.MsgSeqNum()
-            message.getHeader().getField(sequence)
-            return '%s_%s' % (fix.MsgType_Logout, sequence.getValue())
-        if msgType.getValue() == fix.MsgType_Heartbeat:
-            sequence = fix.MsgSeqNum()
-            message.getHeader().getField(sequence)
-            return '%s_%s' % (fix.MsgType_Heartbeat, sequence.getValue())
-        if msgType.getValue() == fix.MsgType_NewOrderSingle or msgType.getValue() == fix.MsgType_ExecutionReport \
-                or msgType.getValue() == fix.MsgType_OrderCancelRequest \
-                or msgType.getValue() == fix.MsgType_OrderCancelReject:
-            cId = fix.ClOrdID()
-            message.getField(cId)
-            return cId.getValue()
-        if msgType.getValue() == fix.MsgType_CollateralInquiry or msgType.getValue() == fix.MsgType_CollateralReport:
-            colId = fix.CollInquiryID()
-            message.getField(colId)
-            return colId.getValue()
-        if msgType.getValue() == fix.MsgType_RequestForPositions or msgType.getValue() == fix.MsgType_PositionReport \
-                or msgType.getValue() == fix.MsgType_RequestForPositionsAck:
-            posId = fix.PosReqID()
-            message.getField(posId)
-            return posId.getValue()
-        return None
+        :param msgType: MsgType of the message
+        :return: (key, timestamp) or (None, None) for messages without the key tag
+        """
+        keyTag, keyInHeader, timeTag, timeInHeader = MessageStore.Correlation[msgType]
+        if keyInHeader:
+            key = '%s_%s' % (msgType, message.getHeader().getField(keyTag))
+        elif not message.isSetField(keyTag):
+            return None, None
+        elif keyTag == 112:
+            # TestReqID is free text, keep it apart from the order and report ids
+            key = 'TestReqID_%s' % message.getField(keyTag)
+        else:
+            key = message.getField(keyTag)
+        if timeTag is None:
+            return key, UTCTimestamp.now()
+        return key, message.getHeader().getField(timeTag) if timeInHeader else message.getField(timeTag)
 
     def addTimeLagListener(self, callback):
         self.addMessageHandler(Notify.Latency, callback)
 
-    def addRequest(self, message):
-        key = MessageStore.__uncorkKey(message)
-        value = MessageStore.__uncorkValue(message)
-        if key is None or value is None:
+    def latencySnapshot(self, reset=False):
+        """
+        Round trip latency percentiles per request message type
+        :param reset: clear the histograms after reading them
+        :return: dict of round trip name -> dict with count, p50, p90, p99 and max in seconds
+        """
+        with self.__lock:
+            return dict((name, histogram.snapshot(reset)) for name, histogram in self.__histograms.items())
+
+    def size(self):
+        """
+        Number of requests and responses still waiting for their counterpart
+        :return: (requests, responses)
+        """
+        with self.__lock:
+            return len(self.__out), len(self.__in)
+
+    def __evict(self, entries, now):
+        """
+        Drop entries older than StoreTTL and the oldest entries above MaxStoreSize
+        :param entries: insertion ordered dictionary of key -> (value, stamp, msgType)
+        :param now: current monotonic time in seconds
+        """
+        expired = now - self.__ttl
+        while entries:
+            key, (value, stamp, msgType) = next(iter(entries.items()))
+            if stamp > expired and len(entries) <= self.__maxSize:
+                break
+            del entries[key]
+            if value is not None:
+                self.Logger.debug('Evicted unmatched message %s %s' % (key, value))
+
+    def __add(self, key, value, msgType, entries, counterparts):
+        with self.__lock:
+            now = monotonic()
+            if key in counterparts:
+                other, stamp, otherType = counterparts.pop(key)
+                entries.pop(key, None)
+                if entries is self.__out:
+                    self.__timeCheck(value, other, msgType, stamp - now)
+                else:
+                    self.__timeCheck(other, value, otherType, now - stamp)
+                self.__expect(key, now, msgType)
+            elif entries is self.__in and key in self.__matched:
+                # later ExecutionReports of an order or the PositionReports after the ack
+                pass
+            else:
+                entries.pop(key, None)
+                entries[key] = (value, now, msgType)
+            self.__evict(self.__out, now)
+            self.__evict(self.__in, now)
+            self.__evict(self.__matched, now)
+
+    def __expect(self, key, now, msgType):
+        self.__matched.pop(key, None)
+        self.__matched[key] = (None, now, msgType)
+
+    def addRequest(self, message, msgType=None):
+        if msgType is None:
+            msgType = message.getHeader().getField(35)
+        if msgType == fix.MsgType_NewOrderList:
+            group = fix44.NewOrderList.NoOrders()
+            with self.__lock:
+                now = monotonic()
+                for i in range(1, int(message.getField(68)) + 1):
+                    message.getGroup(i, group)
+                    self.__expect(group.getField(11), now, msgType)
+                self.__evict(self.__matched, now)
+        if msgType in MessageStore.Uncorrelated:
+            return
+        if msgType not in MessageStore.Correlation:
             self.Logger.error('Unknown request message type %s' % message)
             return
-        with self.__lock:
-            self.__out[key] = value
-            if key in self.__in:
-                self.__timeCheck(self.__out[key], self.__in[key])
-
-    def addResponse(self, message):
-        key = MessageStore.__uncorkKey(message)
-        value = MessageStore.__uncorkValue(message)
-        if key is None or value is None:
+        key, value = MessageStore.__uncork(message, msgType)
+        if key is None:
+            return
+        self.__add(key, value, msgType, self.__out, self.__in)
+
+    def addResponse(self, message, msgType=None):
+        if msgType is None:
+            msgType = message.getHeader().getField(35)
+        if msgType in MessageStore.Uncorrelated:
+            return
+        if msgType not in MessageStore.Correlation:
             self.Logger.error('Unknown response message type: %s' % message)
             return
+        key, value = MessageStore.__uncork(message, msgType)
+        if key is None:
+            return
+        self.__add(key, value, msgType, self.__in, self.__out)
+
+
+class OrderRecord(object):
+    __slots__ = ('ClientOrderId', 'Symbol', 'Maturity', 'Side', 'OrderType', 'Quantity', 'Price', 'Status',
+                 'AvgPx', 'CancelIds', 'Updated')
+
+    def __init__(self, clientOrderId, symbol, maturity, side, ordType, qty, price, status):
+        self.ClientOrderId = clientOrderId
+        self.Symbol = symbol
+        self.Maturity = maturity
+        self.Side = side
+        self.OrderType = ordType
+        self.Quantity = qty
+        self.Price = price
+        self.Status = status
+        self.AvgPx = None
+        self.CancelIds = ()
+        self.Updated = monotonic()
+
+
+class OrderStore(object):
+    """
+    State of the orders sent in this session keyed by ClOrdID, updated from ExecutionReports
+    and OrderCancelRejects. Open orders are indexed by symbol/maturity and status; terminal
+    orders leave the indexes and are archived after ArchiveAfter seconds into an archive
+    bounded by MaxArchivedOrders. Cancel requests are forgotten when they are rejected or, once their order
+    is no longer open, after the same ArchiveAfter and MaxArchivedOrders limits.
+    """
+    def __init__(self, logger, settings):
+        self.Logger = logger
+        self.__archiveAfter = getSetting(settings, 'ArchiveAfter', 60)
+        self.__maxArchived = getSetting(settings, 'MaxArchivedOrders', 10000)
+        self.__orders = {}
+        self.__cancels = OrderedDict()
+        self.__instruments = {}
+        self.__statuses = {}
+        self.__terminal = OrderedDict()
+        self.__archive = OrderedDict()
+        self.__lock = threading.RLock()
+
+    def __index(self, record):
+        self.__instruments.setdefault((record.Symbol, record.Maturity), set()).add(record.ClientOrderId)
+        self.__statuses.setdefault(record.Status, set()).add(record.ClientOrderId)
+
+    def __unindex(self, record):
+        self.__instruments.get((record.Symbol, record.Maturity), set()).discard(record.ClientOrderId)
+        self.__statuses.get(record.Status, set()).discard(record.ClientOrderId)
+
+    def add(self, trade):
+        """
+        Track a sent order
+        :param trade: Trade returned by FixClient.send
+        """
+        record = OrderRecord(trade.OrderId, trade.Symbol, trade.Maturity, trade.OrderSide, trade.OrderType,
+                             trade.Quantity, trade.Price, OrderStatus.PendingNew)
+        with self.__lock:
+            self.__orders[record.ClientOrderId] = record
+            self.__index(record)
+
+    def addCancel(self, cancelId, origClOrdID):
+        """
+        Link a cancel request to the order it cancels
+        """
+        with self.__lock:
+            self.__cancels.pop(cancelId, None)
+            self.__cancels[cancelId] = (origClOrdID, monotonic())
+            record = self.__orders.get(origClOrdID)
+            if record is not None:
+                record.CancelIds += (cancelId,)
+
+    def apply(self, event):
+        """
+        Update the order an order event belongs to
+        :param event: FixEvent of a Notify.Order notification
+        """
+        with self.__lock:
+            clientOrderId = event.OrigClOrdID or self.__original(event.ClientOrderId)
+            record = self.__orders.get(clientOrderId)
+            if event.Status == OrderStatus.CancelRejected:
+                # a rejected cancel request gets no further reports
+                self.__cancels.pop(event.ClientOrderId, None)
+                if record is not None:
+                    record.Updated = monotonic()
+                return
+            if record is None:
+                if clientOrderId in self.__terminal or clientOrderId in self.__archive:
+                    return
+                record = OrderRecord(clientOrderId, event.Symbol, event.Maturity, event.Side, None, event.Quantity,
+                                     None, event.Status)
+                self.__orders[clientOrderId] = record
+            else:
+                self.__unindex(record)
+                record.Status = event.Status
+            record.AvgPx = event.AvgPx if event.AvgPx is not None else record.AvgPx
+            record.Updated = monotonic()
+            if record.Status in TerminalStatuses:
+                del self.__orders[clientOrderId]
+                self.__terminal[clientOrderId] = record
+            else:
+                self.__index(record)
+            self.archive()
+
+    def archive(self):
+        """
+        Move terminal orders older than ArchiveAfter to the bounded archive
+        """
+        with self.__lock:
+            expired = monotonic() - self.__archiveAfter
+            while self.__terminal:
+                clientOrderId, record = next(iter(self.__terminal.items()))
+                if record.Updated > expired:
+                    break
+                del self.__terminal[clientOrderId]
+                self.__archive[clientOrderId] = record
+                for cancelId in record.CancelIds:
+                    self.__cancels.pop(cancelId, None)
+            while len(self.__archive) > self.__maxArchived:
+                self.__archive.popitem(last=False)
+            self.__expireCancels(expired)
+
+    def __expireCancels(self, expired):
+        """
+        Drop cancel requests older than ArchiveAfter unless their order is still open, like the cancels of
+        unknown orders, and the oldest cancel requests above MaxArchivedOrders
+        :param expired: monotonic time before which a cancel request is expired
+        """
+        for cancelId, (origClOrdID, stamp) in list(self.__cancels.items()):
+            if stamp > expired:
+                break
+            if origClOrdID not in self.__orders:
+                del self.__cancels[cancelId]
+        while len(self.__cancels) > self.__maxArchived:
+            self.__cancels.popitem(last=False)
+
+    def __original(self, clientOrderId):
+        """
+        :return: ClOrdID of the order a cancel request cancels, clientOrderId itself for orders
+        """
+        cancel = self.__cancels.get(clientOrderId)
+        return clientOrderId if cancel is None else cancel[0]
+
+    def get(self, clientOrderId):
+        """
+        :param clientOrderId: ClOrdID of an order or of a cancel request
+        :return: OrderRecord or None
+        """
+        with self.__lock:
+            clientOrderId = self.__original(clientOrderId)
+            for orders in (self.__orders, self.__terminal, self.__archive):
+                if clientOrderId in orders:
+                    return orders[clientOrderId]
+            return None
+
+    def chain(self, clientOrderId):
+        """
+        :param clientOrderId: ClOrdID of an order or of a cancel request
+        :return: ClOrdIDs from the original order to its latest cancel request
+        """
+        with self.__lock:
+            origClOrdID = self.__original(clientOrderId)
+            record = self.get(origClOrdID)
+            return [origClOrdID] + list(record.CancelIds if record is not None else ())
+
+    def openOrders(self, symbol=None, maturity=None):
+        """
+        :return: open OrderRecords, all of them or of one symbol and maturity
+        """
+        with self.__lock:
+            if symbol is None:
+                return list(self.__orders.values())
+            return [self.__orders[clientOrderId] for clientOrderId in self.__instruments.get((symbol, maturity), ())]
+
+    def byStatus(self, status):
+        """
+        :return: open OrderRecords in a status, terminal statuses are not indexed
+        """
+        with self.__lock:
+            return [self.__orders[clientOrderId] for clientOrderId in self.__statuses.get(status, ())]
+
+    def size(self):
+        """
+        :return: (open, terminal, archived) order counts
+        """
+        with self.__lock:
+            return len(self.__orders), len(self.__terminal), len(self.__archive)
+
+
+class PositionKeeper(Observable):
+    """
+    Net position per symbol/maturity, seeded from a RequestForPositions snapshot and updated
+    with the LastQty of every fill execution report. Instruments missing from a snapshot have no position.
+    A later snapshot replaces the positions and notifies PositionDrift for every difference.
+    """
+    def __init__(self, logger):
+        super(PositionKeeper, self).__init__(logger)
+        self.Logger = logger
+        self.__positions = {}
+        self.__seeded = False
+        self.__lock = threading.RLock()
+
+    def seed(self, reports):
+        """
+        Replace the positions with a snapshot. A snapshot with fewer reports than its TotalNumPosReports
+        raises ValueError and leaves the positions unseeded or unchanged.
+        :param reports: PositionReport events of one RequestForPositions
+        :return: list of ((symbol, maturity), expected, actual) that differed from the kept positions
+        """
+        totals = [r.TotalNumPosReports for r in reports if getattr(r, 'TotalNumPosReports', None) is not None]
+        if totals and len(reports) < max(totals):
+            raise ValueError('Incomplete position snapshot, %s of %s reports' % (len(reports), max(totals)))
+        positions = {}
+        for report in reports:
+            key = (report.Symbol, report.Maturity)
+            positions[key] = positions.get(key, 0) + report.LongQty - report.ShortQty
+        drift = []
+        with self.__lock:
+            if self.__seeded:
+                for key in set(positions) | set(self.__positions):
+                    expected, actual = self.__positions.get(key, 0), positions.get(key, 0)
+                    if expected != actual:
+                        drift.append((key, expected, actual))
+            self.__positions = positions
+            self.__seeded = True
+        for (symbol, maturity), expected, actual in drift:
+            self.Logger.error('Position drift for %s %s. Expected: %s, Actual: %s' % (symbol, maturity, expected, actual))
+            self.notifyMsgHandlers(Notify.PositionDrift, Symbol=symbol, Maturity=maturity, Expected=expected,
+                                   Actual=actual)
+        return drift
+
+    def apply(self, event, maturity):
+        """
+        Add a fill to the position
+        :param event: FixEvent of a Notify.Order notification
+        :param maturity: maturity of the order
+        """
+        if event.ExecType not in FillExecTypes or not event.LastQty:
+            return
+        if maturity is None:
+            self.Logger.error('Unknown maturity of filled order %s %s' % (event.ClientOrderId, event.Symbol))
+            return
+        quantity = event.LastQty if event.Side == OrderSide.Buy else -event.LastQty
+        with self.__lock:
+            key = (event.Symbol, maturity)
+            self.__positions[key] = self.__positions.get(key, 0) + quantity
+
+    def seeded(self):
+        return self.__seeded
+
+    def position(self, symbol, maturity):
+        """
+        :return: net position, None until seeded
+        """
+        with self.__lock:
+            return self.__positions.get((symbol, maturity), 0) if self.__seeded else None
+
+    def positions(self):
+        with self.__lock:
+            return dict(self.__positions)
+
+
+class BalanceCache(object):
+    """
+    Account balance from the latest CollateralReport. Callers accept a cached balance up to a
+    maximum age; older balances are refreshed by one CollateralInquiry shared by all concurrent
+    callers. Amounts reserved for pending orders are deducted from the available balance.
+    """
+    def __init__(self, logger):
+        self.Logger = logger
+        self.__balance = None
+        self.__currency = None
+        self.__updated = None
+        self.__refresh = None
+        self.__reservations = {}
+        self.__lock = threading.RLock()
+
+    def update(self, event):
+        """
+        :param event: FixEvent of a CollateralReport
+        """
+        with self.__lock:
+            self.__balance = event.Balance
+            self.__currency = event.Currency
+            self.__updated = monotonic()
+
+    def invalidate(self):
+        with self.__lock:
+            self.__updated = None
+
+    def __available(self):
+        if self.__balance is None:
+            return None, None
+        return self.__balance - sum(self.__reservations.values()), self.__currency
+
+    def get(self, maxAge, refresh, timeout=None):
+        """
+        :param maxAge: seconds a cached balance stays valid
+        :param refresh: callable sending a CollateralInquiry and returning its reply Future
+        :param timeout: seconds to wait for a refresh
+        :return: (available balance, currency) or (None, None) if the refresh brought no CollateralReport
+        """
         with self.__lock:
-            self.__in[key] = value
-            if key in self.__out:
-                self.__timeCheck(self.__out[key], self.__in[key])
+            if self.__updated is not None and monotonic() - self.__updated <= maxAge:
+                return self.__available()
+            sender = self.__refresh is None or self.__refresh.done()
+            if sender:
+                self.__refresh = Future()
+            future = self.__refresh
+        # sending can wait for the throttle or a logon, the callback thread must still update and release
+        if sender:
+            try:
+                refresh().add_done_callback(lambda reply: BalanceCache.__chain(reply, future))
+            except Exception as e:
+                future.set_exception(e)
+        future.result(timeout)
+        with self.__lock:
+            return self.__available()
+
+    @staticmethod
+    def __chain(reply, future):
+        if reply.cancelled():
+            future.cancel()
+        elif reply.exception() is not None:
+            future.set_exception(reply.exception())
+        else:
+            future.set_result(reply.result())
+
+    def reserve(self, key, amount):
+        with self.__lock:
+            self.__reservations[key] = amount
+
+    def tryReserve(self, key, amount, predicate):
+        """
+        Check the available balance and reserve in one step, so concurrent callers never both pass on the same funds
+        :param predicate: callable(available balance, currency) deciding whether to reserve
+        :return: (reserved, available balance before the reservation, currency),
+        (False, None, None) before the first CollateralReport
+        """
+        with self.__lock:
+            balance, currency = self.__available()
+            if balance is None or not predicate(balance, currency):
+                return False, balance, currency
+            self.__reservations[key] = amount
+            return True, balance, currency
+
+    def release(self, key):
+        with self.__lock:
+            self.__reservations.pop(key, None)
+
+    def reserved(self):
+        with self.__lock:
+            return sum(self.__reservations.values())
+
+
+class MessageLogger(object):
+    """
+    Logs FIX messages with a level per MsgType and optional sampling, e.g. of heartbeats.
+    Messages filtered out are never formatted. With AsyncLogging the record is formatted
+    and written by a background thread instead of the QuickFIX callback thread.
+    """
+    def __init__(self, logger, settings):
+        self.Logger = logger
+        self.__level = logging.getLevelName(getSetting(settings, 'MessageLogLevel', 'INFO', str))
+        self.__levels = dict((msgType, logging.getLevelName(level)) for msgType, level in
+                             MessageLogger.__pairs(getSetting(settings, 'MessageLogLevels', '', str)))
+        self.__sampling = dict((msgType, int(every)) for msgType, every in
+                               MessageLogger.__pairs(getSetting(settings, 'MessageLogSampling', '', str)))
+        self.__counts = dict((msgType, 0) for msgType in self.__sampling)
+        self.__dropped = 0
+        self.__queue = None
+        self.__writer = None
+        if getSetting(settings, 'AsyncLogging', 'N', str) == 'Y':
+            self.__queue = Queue(getSetting(settings, 'LogQueueSize', 10000))
+            self.__writer = threading.Thread(target=self.__write)
+            self.__writer.daemon = True
+            self.__writer.name = 'Message Logger'
+            self.__writer.start()
+
+    @staticmethod
+    def __pairs(value):
+        """
+        Parse MsgType:value pairs, e.g. 0:DEBUG,8:INFO
+        """
+        return [pair.strip().split(':', 1) for pair in value.split(',') if pair.strip()]
+
+    def __write(self):
+        while True:
+            record = self.__queue.get()
+            if record is None:
+                break
+            self.Logger.log(*record)
+
+    def enabled(self, msgType):
+        """
+        Check whether a message of this type is going to be logged and count it for sampling
+        """
+        if not self.Logger.isEnabledFor(self.__levels.get(msgType, self.__level)):
+            return False
+        if msgType in self.__sampling:
+            self.__counts[msgType] += 1
+            return self.__counts[msgType] % self.__sampling[msgType] == 1 or self.__sampling[msgType] == 1
+        return True
+
+    def log(self, msgType, text, *args):
+        """
+        Log a message, formatting is deferred to the handler
+        :param msgType: MsgType of the message
+        :param text: format string
+        :param args: format arguments, FIX messages should be passed as strings from message.toString()
+        """
+        record = (self.__levels.get(msgType, self.__level), text) + args
+        if self.__queue is None:
+            self.Logger.log(*record)
+            return
+        try:
+            self.__queue.put_nowait(record)
+        except Full:
+            self.__dropped += 1
+
+    def dropped(self):
+        return self.__dropped
+
+    def stop(self):
+        """
+        Write the queued records and stop the background writer
+        """
+        if self.__writer is not None:
+            self.__queue.put(None)
+            self.__writer.join()
+            self.__queue = None
+            self.__writer = None
+
+
+class SessionState(object):
+    """
+    Connection state, message counts, sequence numbers and round trip latency of one FIX session.
+    Account, Username, Password, Strategies and MaxMessageRate are read from its [SESSION] section.
+    """
+    def __init__(self, logger, settings, sessionID):
+        self.SessionID = sessionID
+        self.Name = sessionID.toString()
+        self.SenderCompID = sessionID.getSenderCompID().getValue()
+        self.TargetCompID = sessionID.getTargetCompID().getValue()
+        self.Account = getSetting(settings, 'Account', None, str, sessionID)
+        self.Username = getSetting(settings, 'Username', None, str, sessionID)
+        self.Password = getSetting(settings, 'Password', None, str, sessionID)
+        self.Strategies = frozenset(strategy.strip() for strategy in
+                                    getSetting(settings, 'Strategies', '', str, sessionID).split(',')
+                                    if strategy.strip())
+        self.MaxMessageRate = getSetting(settings, 'MaxMessageRate', 0, int, sessionID)
+        self.Store = MessageStore(logger, settings)
+        self.Connected = False
+        self.Trigger = threading.Event()
+        self.Sent = 0
+        self.Received = 0
+        self.__window = 0
+        self.__count = 0
+        self.__lock = threading.Lock()
+
+    def sequenceNumbers(self):
+        """
+        :return: (next outgoing MsgSeqNum, next expected incoming MsgSeqNum), None before the session is created
+        """
+        session = fix.Session.lookupSession(self.SessionID)
+        if session is None:
+            return None, None
+        return session.getExpectedSenderNum(), session.getExpectedTargetNum()
+
+    def load(self):
+        """
+        :return: (share of MaxMessageRate used, messages sent) in the current one second window
+        """
+        with self.__lock:
+            count = self.__count if monotonic() - self.__window < 1 else 0
+        return (float(count) / self.MaxMessageRate if self.MaxMessageRate else 0.0), count
+
+    def throttle(self):
+        """
+        Count an application message, waiting for the next one second window when MaxMessageRate
+        messages were already sent in this one
+        """
+        while True:
+            with self.__lock:
+                now = monotonic()
+                if now - self.__window >= 1:
+                    self.__window, self.__count = now, 0
+                if not self.MaxMessageRate or self.__count < self.MaxMessageRate:
+                    self.__count += 1
+                    return
+                wait = self.__window + 1 - now
+            time.sleep(wait)
+
+    def snapshot(self, reset=False):
+        """
+        :param reset: clear the latency histograms after reading them
+        :return: dict of the session state
+        """
+        sender, target = self.sequenceNumbers()
+        return {'Account': self.Account, 'Strategies': sorted(self.Strategies), 'Connected': self.Connected,
+                'Sent': self.Sent, 'Received': self.Received, 'NextSenderMsgSeqNum': sender,
+                'NextTargetMsgSeqNum': target, 'Latency': self.Store.latencySnapshot(reset)}
+
+
+class SessionRouter(object):
+    """
+    Chooses the session of a request by account and strategy tag. Sessions of the same account
+    and strategies are equivalent; requests are spread over the connected ones, least loaded first.
+    """
+    def __init__(self, sessions, defaultAccount):
+        """
+        :param sessions: list of SessionState
+        :param defaultAccount: account of requests without account and strategy
+        """
+        self.Sessions = sessions
+        self.DefaultAccount = defaultAccount
+        self.__next = 0
+        self.__lock = threading.Lock()
+
+    def candidates(self, account=None, strategy=None):
+        """
+        Sessions tagged with the strategy, or the untagged sessions when none is
+        :return: list of SessionState, raises ValueError when no session matches
+        """
+        if account is None and strategy is None:
+            account = self.DefaultAccount
+        sessions = [s for s in self.Sessions if account is None or s.Account == account]
+        if strategy is None:
+            sessions = [s for s in sessions if not s.Strategies] or sessions
+        else:
+            sessions = [s for s in sessions if strategy in s.Strategies] or \
+                [s for s in sessions if not s.Strategies]
+        if not sessions:
+            raise ValueError('No session for account %s strategy %s' % (account, strategy))
+        return sessions
+
+    def route(self, account=None, strategy=None):
+        """
+        :return: SessionState of the next request
+        """
+        sessions = self.candidates(account, strategy)
+        sessions = [s for s in sessions if s.Connected] or sessions
+        if len(sessions) == 1:
+            return sessions[0]
+        with self.__lock:
+            self.__next += 1
+            start = self.__next % len(sessions)
+        # rotate so that equally loaded sessions take turns
+        sessions = sessions[start:] + sessions[:start]
+        return min(sessions, key=lambda s: s.load())
+
+
+class AccountBook(object):
+    """
+    Balance and positions of one account, shared by the sessions trading it
+    """
+    def __init__(self, logger, account):
+        self.Account = account
+        self.Balance = BalanceCache(logger)
+        self.Positions = PositionKeeper(logger)
 
 
 class GainApplication(fix.Application):
+    Sides = {fix.Side_BUY: OrderSide.Buy, fix.Side_SELL: OrderSide.Sell}
+    Statuses = {fix.OrdStatus_NEW: OrderStatus.New, fix.OrdStatus_PARTIALLY_FILLED: OrderStatus.PartiallyFilled,
+                fix.OrdStatus_CANCELED: OrderStatus.Cancelled, fix.OrdStatus_FILLED: OrderStatus.Filled,
+                fix.OrdStatus_REJECTED: OrderStatus.Rejected}
+    # MsgType -> (notification, ((event attribute, tag, type, required), ...), constant event attributes)
+    Decoders = {
+        fix.MsgType_RequestForPositionsAck: (Notify.Account, (
+            ('Account', 1, str, True),
+            ('PosReqID', 710, str, True),
+            ('TotalNumPosReports', 727, int, False),
+            ('PosReqResult', 728, int, False),
+        ), {'Symbol': None, 'Maturity': None, 'NoPositions': 0, 'LongQty': 0, 'ShortQty': 0, 'PosAmt': 0,
+            'SettlPrice': 0, 'NoPosAmt': 0, 'ClearingBusinessDate': None,
+            'AccountInquiry': AccountInquiry.RequestForPositions}),
+        fix.MsgType_PositionReport: (Notify.Account, (
+            ('Account', 1, str, True),
+            ('PosReqID', 710, str, True),
+            ('Symbol', 55, str, True),
+            ('Maturity', 200, str, True),
+            ('NoPositions', 702, int, True),
+            ('LongQty', 704, float, True),
+            ('ShortQty', 705, float, True),
+            ('PosAmt', 708, float, True),
+            ('ClearingBusinessDate', 715, str, True),
+            ('SettlPrice', 730, float, True),
+            ('NoPosAmt', 753, int, True),
+            ('TotalNumPosReports', 727, int, False),
+            ('LastRptRequested', 912, str, False),
+        ), {'AccountInquiry': AccountInquiry.RequestForPositions}),
+        fix.MsgType_CollateralReport: (Notify.Account, (
+            ('Account', 1, str, True),
+            ('Currency', 15, str, True),
+            ('Balance', 901, float, True),
+            ('CollInquiryID', 909, str, True),
+        ), {'AccountInquiry': AccountInquiry.CollateralInquiry}),
+        fix.MsgType_OrderCancelReject: (Notify.Order, (
+            ('ClientOrderId', 11, str, True),
+            ('OrigClOrdID', 41, str, True),
+        ), {'Symbol': None, 'Maturity': None, 'AvgPx': None, 'Quantity': None, 'Side': None,
+            'ExecType': None, 'LastQty': None, 'Status': OrderStatus.CancelRejected}),
+        fix.MsgType_ExecutionReport: (Notify.Order, (
+            ('ClientOrderId', 11, str, True),
+            ('Status', 39, Statuses.get, True),
+            ('AvgPx', 6, float, True),
+            ('Quantity', 38, float, True),
+            ('Side', 54, Sides.get, True),
+            ('Symbol', 55, str, True),
+            ('Maturity', 200, str, False),
+            ('OrigClOrdID', 41, str, False),
+            ('Account', 1, str, False),
+            ('ExecType', 150, str, False),
+            ('LastQty', 32, float, False),
+        ), {}),
+    }
+    # event attributes holding the id of a request waiting for a reply
+    ReplyKeys = ('ClientOrderId', 'OrigClOrdID', 'PosReqID', 'CollInquiryID')
+
     def __init__(self, settings, logger):
         super(GainApplication, self).__init__()
-        self.__messageStore = MessageStore(logger, settings)
-        self.Notifier = Observable()
+        self.Notifier = Observable(logger)
+        self.Dispatcher = EventDispatcher.Create(logger, settings)
+        self.Notifier.setDispatcher(self.Dispatcher)
+        self.Replies = ReplyRegistry(logger, getSetting(settings, 'ReplyTimeout', 30, float))
+        self.MessageLog = MessageLogger(logger, settings)
+        self.Orders = OrderStore(logger, settings)
         self.Settings = settings
         self.sessionID = ''
         self.FixClientRef = None
@@ -383,179 +1831,212 @@ class GainApplication(fix.Application):
         self.connection_trigger = threading.Event()
         self.connected = False
         self.__latency = int(self.Settings.get().getString('MaxLatency'))
+        # every [SESSION] of the configuration, keyed by SessionID string
+        self.Sessions = OrderedDict()
+        self.Accounts = OrderedDict()
+        for sessionID in sorted(settings.getSessions(), key=lambda s: s.toString()):
+            session = SessionState(logger, settings, sessionID)
+            self.Sessions[session.Name] = session
+            if session.Account not in self.Accounts:
+                self.Accounts[session.Account] = AccountBook(logger, session.Account)
+        self.__compIDs = dict(((s.SenderCompID, s.TargetCompID), s) for s in self.Sessions.values())
+        defaultAccount = getSetting(settings, 'Account', None, str)
+        self.Router = SessionRouter(list(self.Sessions.values()),
+                                    defaultAccount if defaultAccount in self.Accounts else next(iter(self.Accounts)))
+        self.Default = self.Router.candidates()[0]
+        self.Balance = self.Accounts[self.Default.Account].Balance
+        self.Positions = self.Accounts[self.Default.Account].Positions
+        self.Config = ClientSettings(self.Default.Account,
+                                     self.Default.Username,
+                                     self.Default.Password,
+                                     self.__latency,
+                                     getSetting(self.Settings, 'NewOrderList', 'N', str) == 'Y')
+
+    def session(self, sessionID=None, message=None):
+        """
+        :param sessionID: SessionID of a QuickFIX callback
+        :param message: outgoing message stamped with the SenderCompID and TargetCompID of its session
+        :return: SessionState, the default session if neither identifies one
+        """
+        if sessionID is not None:
+            return self.Sessions.get(sessionID.toString(), self.Default)
+        header = message.getHeader()
+        if header.isSetField(49) and header.isSetField(56):
+            return self.__compIDs.get((header.getField(49), header.getField(56)), self.Default)
+        return self.Default
+
+    def account(self, account=None):
+        """
+        :return: AccountBook of the account, of the default session by default
+        """
+        return self.Accounts[account if account is not None else self.Default.Account]
 
     def onCreate(self, sessionID):
         self.Logger.info("Session created. Session: %s" % sessionID)
         return
 
+    def __connect(self, sessionID, connected):
+        session = self.session(sessionID)
+        session.Connected = connected
+        if connected:
+            session.Trigger.set()
+        else:
+            session.Trigger.clear()
+        # usable while every account has a session logged on, the router skips the sessions that are down
+        self.connected = all(any(s.Connected for s in self.Sessions.values() if s.Account == account)
+                             for account in self.Accounts)
+        if self.connected:
+            self.connection_trigger.set()
+        else:
+            self.connection_trigger.clear()
+        self.Notifier.notifyMsgHandlers(Notify.Session, Session=session.Name, Account=session.Account,
+                                        Connected=connected)
+
     def onLogon(self, sessionID):
         self.sessionID = sessionID
-        self.connected = True
         self.Logger.info("onLogon received from server. Session: %s" % sessionID)
-        self.connection_trigger.set()
+        self.__connect(sessionID, True)
         return
 
     def onLogout(self, sessionID):
-        self.connected = False
         self.Logger.info("onLogout received from server. Session: %s" % sessionID)
-        self.connection_trigger.clear()
+        self.__connect(sessionID, False)
         return
 
     def toAdmin(self, message, sessionID):
         try:
-            msgType = fix.MsgType()
-            message.getHeader().getField(msgType)
-            if msgType.getValue() == fix.MsgType_Logon:
-                uuid = self.Settings.get().getString('Username')
-                password = self.Settings.get().getString('Password')
-                message.getHeader().setField(fix.Password(password))
-                message.getHeader().setField(fix.StringField(12003, uuid))
-            self.Logger.info("Sending Admin message to server. Session: %s. Message: %s" % (sessionID, message))
-            self.__messageStore.addRequest(message)
+            msgType = message.getHeader().getField(35)
+            session = self.session(sessionID)
+            if msgType == fix.MsgType_Logon:
+                message.getHeader().setField(fix.Password(session.Password))
+                message.getHeader().setField(fix.StringField(12003, session.Username))
+            self.__logMessage("Sending Admin message to server. Session: %s. Message: %s", message, msgType, sessionID)
+            session.Sent += 1
+            session.Store.addRequest(message, msgType)
         except fix.RuntimeError as e:
-            self.Logger.error('Error in toAdmin', e)
+            self.Logger.error('Error in toAdmin: %s', e)
         return
 
+    def __logMessage(self, text, message, msgType, sessionID):
+        if self.MessageLog.enabled(msgType):
+            self.MessageLog.log(msgType, text, sessionID.toString(), message.toString())
+
     def toApp(self, message, sessionID):
         try:
-            self.Logger.info("Sending Application message to server. Session: %s. Message: %s" % (sessionID, message))
-            self.__messageStore.addRequest(message)
+            msgType = message.getHeader().getField(35)
+            self.__logMessage("Sending Application message to server. Session: %s. Message: %s",
+                              message, msgType, sessionID)
+            session = self.session(sessionID)
+            session.Sent += 1
+            session.Store.addRequest(message, msgType)
         except fix.RuntimeError as e:
-            self.Logger.error('Error in toApp', e)
+            self.Logger.error('Error in toApp: %s', e)
         return
 
     def fromAdmin(self, message, sessionID):
         try:
-            self.Logger.info("Received Admin message from server. Session: %s. Message: %s" % (sessionID, message))
-            self.__messageStore.addResponse(message)
+            msgType = message.getHeader().getField(35)
+            self.__logMessage("Received Admin message from server. Session: %s. Message: %s", message, msgType, sessionID)
+            session = self.session(sessionID)
+            session.Received += 1
+            session.Store.addResponse(message, msgType)
         except fix.RuntimeError as e:
-            self.Logger.error('Error in fromAdmin', e)
+            self.Logger.error('Error in fromAdmin: %s', e)
         return
 
-    def __unpackMessage(self, message):
-        msgType = fix.MsgType()
-        message.getHeader().getField(msgType)
-        if msgType.getValue() == fix.MsgType_RequestForPositionsAck:
-            account = fix.Account()
-            message.getField(account)
-            posId = fix.PosReqID()
-            message.getField(posId)
-            self.Notifier.notifyMsgHandlers(Notify.Account, Account=account.getValue(), PosReqID=posId.getValue(),
-                                            Symbol=None, Maturity=None,
-                                            NoPositions=0,
-                                            LongQty=0, ShortQty=0,
-                                            PosAmt=0, SettlPrice=0,
-                                            NoPosAmt=0, ClearingBusinessDate=None,
-                                            AccountInquiry=AccountInquiry.RequestForPositions)
-        elif msgType.getValue() == fix.MsgType_PositionReport:
-            account = fix.Account()
-            message.getField(account)
-            posId = fix.PosReqID()
-            message.getField(posId)
-            symbol = fix.Symbol()
-            message.getField(symbol)
-            maturity = fix.MaturityMonthYear()
-            message.getField(maturity)
-            noPositions = fix.NoPositions()
-            message.getField(noPositions)
-            longQty = fix.LongQty()
-            message.getField(longQty)
-            shortQty = fix.ShortQty()
-            message.getField(shortQty)
-            posAmt = fix.PosAmt()
-            message.getField(posAmt)
-            cBusDate = fix.ClearingBusinessDate()
-            message.getField(cBusDate)
-            settlePrice = fix.SettlPrice()
-            message.getField(settlePrice)
-            noPosAmt = fix.NoPosAmt()
-            message.getField(noPosAmt)
-            self.Notifier.notifyMsgHandlers(Notify.Account, Account=account.getValue(), PosReqID=posId.getValue(),
-                Symbol=symbol.getValue(), Maturity=maturity.getValue(), NoPositions=noPositions.getValue(),
-                LongQty=longQty.getValue(), ShortQty = shortQty.getValue(), PosAmt=posAmt.getValue(),SettlPrice=settlePrice.getValue(),
-                NoPosAmt=noPosAmt.getValue(), ClearingBusinessDate=cBusDate.getValue(), AccountInquiry=AccountInquiry.RequestForPositions)
-        elif msgType.getValue() == fix.MsgType_CollateralReport:
-            account = fix.Account()
-            message.getField(account)
-            ccy = fix.Currency()
-            message.getField(ccy)
-            csh = fix.CashOutstanding()
-            message.getField(csh)
-            colId = fix.CollInquiryID()
-            message.getField(colId)
-            self.Notifier.notifyMsgHandlers(Notify.Account, Account=account.getValue(), Currency=ccy.getValue(),
-                                            Balance=csh.getValue(), CollInquiryID=colId.getValue(),
-                                            AccountInquiry=AccountInquiry.CollateralInquiry)
-        elif msgType.getValue() == fix.MsgType_OrderCancelReject:
-            cId = fix.ClOrdID()
-            message.getField(cId)
-            origClOrdID = fix.OrigClOrdID()
-            message.getField(origClOrdID)
-            self.Notifier.notifyMsgHandlers(Notify.Order, ClientOrderId=cId.getValue(), Symbol=None,
-                                            AvgPx=None, Quantity=None, Side=None, Status=OrderStatus.CancelRejected,
-                                            OrigClOrdID=origClOrdID.getValue(), Sender=self.FixClientRef)
-        elif msgType.getValue() == fix.MsgType_ExecutionReport:
-            cId = fix.ClOrdID()
-            message.getField(cId)
-            fixStatus = fix.OrdStatus()
-            message.getField(fixStatus)
-            price = fix.AvgPx()
-            message.getField(price)
-            qty = fix.OrderQty()
-            message.getField(qty)
-            side = fix.Side()
-            message.getField(side)
-            symbol = fix.Symbol()
-            message.getField(symbol)
-            orderSide = None
-            origOrderId = None
-            if side.getValue() == fix.Side_BUY:
-                orderSide = OrderSide.Buy
-            elif side.getValue() == fix.Side_SELL:
-                orderSide = OrderSide.Sell
-            status = None
-            if fixStatus.getValue() == fix.OrdStatus_NEW:
-                status = OrderStatus.New
-            elif fixStatus.getValue() == fix.OrdStatus_CANCELED:
-                status = OrderStatus.Cancelled
-                origClOrdID = fix.OrigClOrdID()
-                message.getField(origClOrdID)
-                origOrderId = origClOrdID.getValue()
-            elif fixStatus.getValue() == fix.OrdStatus_FILLED:
-                status = OrderStatus.Filled
-            elif fixStatus.getValue() == fix.OrdStatus_REJECTED:
-                status = OrderStatus.Rejected
-            if status is not None:
-                self.Notifier.notifyMsgHandlers(Notify.Order, ClientOrderId=cId.getValue(), Symbol=symbol.getValue(),
-                                                AvgPx=price.getValue(), Quantity=qty.getValue(), Side=orderSide,
-                                                Status=status, OrigClOrdID=origOrderId, Sender=self.FixClientRef)
+    def __unpackMessage(self, message, msgType, session):
+        """
+        Decode an application message with its Decoders entry, update the client state and notify the listeners
+        :param message: FIX message
+        :param msgType: MsgType of the message
+        :param session: SessionState the message was received on
+        """
+        decoder = GainApplication.Decoders.get(msgType)
+        if decoder is None:
+            return
+        name, fields, constants = decoder
+        values = dict(constants)
+        for attribute, tag, cast, required in fields:
+            values[attribute] = cast(message.getField(tag)) if required or message.isSetField(tag) else None
+        if msgType == fix.MsgType_ExecutionReport:
+            if values['Status'] is None:
+                return
+            if values['Status'] != OrderStatus.Cancelled:
+                values['OrigClOrdID'] = None
+        if name == Notify.Order:
+            values['Sender'] = self.FixClientRef
+            values['Account'] = values.get('Account') or session.Account
+        values['Session'] = session.Name
+        # the client state and the pending replies are updated before any listener runs
+        e = self.Notifier.createEvent(**values)
+        # reports of an account missing from the configuration update the account of the session
+        book = self.Accounts.get(e.Account) or self.Accounts[session.Account]
+        if name == Notify.Order:
+            self.Orders.apply(e)
+            if e.ExecType in FillExecTypes:
+                record = self.Orders.get(e.ClientOrderId)
+                book.Positions.apply(e, e.Maturity or (record.Maturity if record is not None else None))
+                book.Balance.invalidate()
+            if e.Status in TerminalStatuses:
+                for other in self.Accounts.values():
+                    other.Balance.release(e.OrigClOrdID or e.ClientOrderId)
+        elif msgType == fix.MsgType_CollateralReport:
+            book.Balance.update(e)
+        for key in GainApplication.ReplyKeys:
+            if values.get(key) is not None:
+                self.Replies.resolve(values[key], e)
+        self.Notifier.notifyEvent(name, e)
 
     def fromApp(self, message, sessionID):
         try:
-            self.Logger.info("Received Application message from server. Session: %s. Message: %s" % (sessionID, message))
-            self.__messageStore.addResponse(message)
-            self.__unpackMessage(message)
+            msgType = message.getHeader().getField(35)
+            self.__logMessage("Received Application message from server. Session: %s. Message: %s",
+                              message, msgType, sessionID)
+            session = self.session(sessionID)
+            session.Received += 1
+            session.Store.addResponse(message, msgType)
+            self.__unpackMessage(message, msgType, session)
         except fix.RuntimeError as e:
-            self.Logger.error('Error in fromApp', e)
+            self.Logger.error('Error in fromApp: %s', e)
         return
 
     def send(self, message):
-        if self.connected:
-            self.Logger.info("FixClient is sending: %s" % message.getHeader().getField(fix.MsgType()))
-            fix.Session.sendToTarget(message, self.sessionID)
+        """
+        Send on the session of the SenderCompID and TargetCompID in the message header, the default
+        session without them. Waits while the session is disconnected or at its MaxMessageRate.
+        """
+        session = self.session(message=message)
+        if session.Connected:
+            session.throttle()
+            msgType = message.getHeader().getField(35)
+            if self.MessageLog.enabled(msgType):
+                self.MessageLog.log(msgType, "FixClient is sending: %s", msgType)
+            fix.Session.sendToTarget(message, session.SessionID)
         else:
-            self.Logger.error('Session Not Found. Not connected to FIX engine')
-            while not self.connected:
+            self.Logger.error('Session Not Found. Not connected to FIX engine. Session: %s' % session.Name)
+            while not session.Connected:
                 self.Logger.info('Waiting to reconnect ...')
-                self.connection_trigger.wait(2)
+                session.Trigger.wait(2)
             self.send(message)
         return
 
+    def latencySnapshot(self, reset=False, session=None):
+        """
+        :param session: SessionID string, the default session by default
+        """
+        return (self.Sessions[session] if session is not None else self.Default).Store.latencySnapshot(reset)
+
     def genOrderID(self):
         with self._lock:
             self.orderID += 1
             return str(self.orderID)
 
+    def genOrderIDs(self, count):
+        with self._lock:
+            first = self.orderID + 1
+            self.orderID += count
+            return [str(orderId) for orderId in range(first, self.orderID + 1)]
+
     def genInquiryID(self):
         with self._lock:
             self.inquiryID += 1
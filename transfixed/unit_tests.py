@@ -3,7 +3,15 @@ import logging
 import quickfix as fix
 import quickfix44 as fix44
 import datetime as dt
+import threading
+import time
+import sys
+from concurrent.futures import Future
 from transfixed import gainfixtrader as gain
+try:
+    from test_gain import executor
+except ImportError:
+    executor = None
 
 
 class TestTimeLags(unittest.TestCase):
@@ -36,6 +44,29 @@ class TestTimeLags(unittest.TestCase):
         self.assertEqual(currentLag[0], 10.5)
 
     def test_heartbeat(self):
+        requestTime = fix.SendingTime()
+        requestTime.setString('20170606-03:52:34.924')
+        request = fix44.TestRequest()
+        request.getHeader().setField(requestTime)
+        request.getHeader().setField(fix.MsgSeqNum(1))
+        request.setField(fix.TestReqID('TEST1'))
+
+        responseTime = fix.SendingTime()
+        responseTime.setString('20170606-03:52:14.824')
+        response = fix44.Heartbeat()
+        response.getHeader().setField(responseTime)
+        response.getHeader().setField(fix.MsgSeqNum(5))
+        response.setField(fix.TestReqID('TEST1'))
+        currentLag = {}
+
+        def receive(event):
+            currentLag[0] = event.CurrentTimeLag
+        self.Store.addTimeLagListener(receive)
+        self.Store.addRequest(request)
+        self.Store.addResponse(response)
+        self.assertEqual(currentLag[0], -20.1)
+
+    def test_plain_heartbeats_not_paired(self):
         sequence = fix.MsgSeqNum(1)
         requestTime = fix.SendingTime()
         requestTime.setString('20170606-03:52:34.924')
@@ -55,7 +86,8 @@ class TestTimeLags(unittest.TestCase):
         self.Store.addTimeLagListener(receive)
         self.Store.addRequest(request)
         self.Store.addResponse(response)
-        self.assertEqual(currentLag[0], 20.1)
+        self.assertEqual(currentLag, {})
+        self.assertEqual(self.Store.size(), (0, 0))
 
     def test_order(self):
         cid = fix.ClOrdID('100')
@@ -77,11 +109,942 @@ class TestTimeLags(unittest.TestCase):
         self.Store.addTimeLagListener(receive)
         self.Store.addRequest(request)
         self.Store.addResponse(response)
-        self.assertEqual(currentLag[0], 20.1)
+        self.assertEqual(currentLag[0], -20.1)
+
+    def test_clock_offset(self):
+        def order(cid, requestStamp, responseStamp):
+            requestTime = fix.TransactTime()
+            requestTime.setString(requestStamp)
+            request = fix44.NewOrderSingle()
+            request.setField(requestTime)
+            request.setField(fix.ClOrdID(cid))
+            responseTime = fix.TransactTime()
+            responseTime.setString(responseStamp)
+            response = fix44.ExecutionReport()
+            response.setField(responseTime)
+            response.setField(fix.ClOrdID(cid))
+            return request, response
+        currentLag = {}
+
+        def receive(event):
+            currentLag[0] = event.CurrentTimeLag
+            currentLag[1] = event.RoundTripTime
+        self.Store.addTimeLagListener(receive)
+        self.assertIsNone(self.Store.clockOffset())
+        request, response = order('200', '20170606-03:52:24.000', '20170606-03:52:34.000')
+        self.Store.addRequest(request)
+        self.Store.addResponse(response)
+        self.assertEqual(currentLag[0], 10.0)
+        self.assertTrue(0 <= currentLag[1] < 1)
+        self.assertAlmostEqual(self.Store.clockOffset(), 10.0, delta=0.5)
+
+        request, response = order('201', '20170606-03:53:24.000', '20170606-03:53:40.000')
+        self.Store.addRequest(request)
+        self.Store.addResponse(response)
+        self.assertAlmostEqual(currentLag[0], 6.0, delta=0.5)
+
+    def test_matched_pair_evicted(self):
+        cid = fix.ClOrdID('101')
+        requestTime = fix.TransactTime()
+        requestTime.setString('20170606-03:52:34.924')
+        request = fix44.NewOrderSingle()
+        request.setField(requestTime)
+        request.setField(cid)
+
+        responseTime = fix.TransactTime()
+        responseTime.setString('20170606-03:52:35.824')
+        response = fix44.ExecutionReport()
+        response.setField(responseTime)
+        response.setField(cid)
+
+        self.Store.addRequest(request)
+        self.assertEqual(self.Store.size(), (1, 0))
+        self.Store.addResponse(response)
+        self.assertEqual(self.Store.size(), (0, 0))
+
+    def test_later_replies_not_stored(self):
+        request = fix44.NewOrderSingle()
+        request.setField(fix.TransactTime())
+        request.setField(fix.ClOrdID('102'))
+        self.Store.addRequest(request)
+        for status in (fix.OrdStatus_NEW, fix.OrdStatus_FILLED):
+            response = fix44.ExecutionReport()
+            response.setField(fix.TransactTime())
+            response.setField(fix.ClOrdID('102'))
+            response.setField(fix.OrdStatus(status))
+            self.Store.addResponse(response)
+        self.assertEqual(self.Store.size(), (0, 0))
+
+        orders = fix44.NewOrderList()
+        orders.setField(fix.TotNoOrders(2))
+        for orderId in ('103', '104'):
+            group = fix44.NewOrderList.NoOrders()
+            group.setField(fix.ClOrdID(orderId))
+            orders.addGroup(group)
+        self.Store.addRequest(orders)
+        for orderId in ('103', '104', '103'):
+            response = fix44.ExecutionReport()
+            response.setField(fix.TransactTime())
+            response.setField(fix.ClOrdID(orderId))
+            self.Store.addResponse(response)
+        self.assertEqual(self.Store.size(), (0, 0))
+
+    def test_orphan_counted(self):
+        sequence = fix.MsgSeqNum(7)
+        requestTime = fix.SendingTime()
+        requestTime.setString('20170606-03:52:34.924')
+        request = fix44.TestRequest()
+        request.getHeader().setField(requestTime)
+        request.getHeader().setField(sequence)
+        request.setField(fix.TestReqID('TEST7'))
+
+        self.Store.addRequest(request)
+        self.Store.addRequest(request)
+        self.assertEqual(self.Store.size(), (1, 0))
 
     def tearDown(self):
         pass
 
+
+class TestUTCTimestamp(unittest.TestCase):
+
+    def test_seconds(self):
+        self.assertEqual(gain.UTCTimestamp.toNanos('20170606-03:52:24'), 1496721144 * 1000000000)
+
+    def test_milliseconds(self):
+        self.assertEqual(gain.UTCTimestamp.toMicros('20170606-03:52:24.324'), 1496721144324000)
+
+    def test_microseconds(self):
+        self.assertEqual(gain.UTCTimestamp.toMicros('20170606-03:52:24.324512'), 1496721144324512)
+
+    def test_nanoseconds(self):
+        self.assertEqual(gain.UTCTimestamp.toNanos('20170606-03:52:24.324512901'), 1496721144324512901)
+
+    def test_matches_strptime(self):
+        epoch = dt.datetime(1970, 1, 1)
+        for value in ('20161231-23:59:59.999', '20170101-00:00:00', '20170606-03:52:24.000001'):
+            delta = gain.MessageStore.parse(value) - epoch
+            micros = (delta.days * 86400 + delta.seconds) * 1000000 + delta.microseconds
+            self.assertEqual(gain.UTCTimestamp.toMicros(value), micros)
+
+    def test_date_change(self):
+        self.assertEqual(gain.UTCTimestamp.toMicros('20170607-00:00:00') -
+                         gain.UTCTimestamp.toMicros('20170606-23:59:59.5'), 500000)
+
+    def test_format(self):
+        self.assertEqual(gain.UTCTimestamp.format(1496721144324512), '20170606-03:52:24.324')
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, gain.UTCTimestamp.toNanos, '20170606 03:52:24')
+        self.assertRaises(ValueError, gain.UTCTimestamp.toNanos, '20170606-03:52:24,324')
+
+
+class TestLatencyHistogram(unittest.TestCase):
+
+    def test_percentiles(self):
+        histogram = gain.LatencyHistogram()
+        for micros in range(1, 1001):
+            histogram.record(micros * 1000)
+        snapshot = histogram.snapshot()
+        self.assertEqual(snapshot['count'], 1000)
+        self.assertAlmostEqual(snapshot['p50'], 0.5, delta=0.5 / 16)
+        self.assertAlmostEqual(snapshot['p90'], 0.9, delta=0.9 / 16)
+        self.assertAlmostEqual(snapshot['p99'], 0.99, delta=0.99 / 16)
+        self.assertEqual(snapshot['max'], 1.0)
+
+    def test_reset_on_read(self):
+        histogram = gain.LatencyHistogram()
+        histogram.record(250)
+        self.assertEqual(histogram.snapshot(True)['count'], 1)
+        self.assertEqual(histogram.snapshot()['count'], 0)
+        self.assertEqual(histogram.snapshot()['p99'], 0)
+
+    def test_store_snapshot(self):
+        logger = logging.getLogger()
+        store = gain.MessageStore(logger, fix.SessionSettings('gain_config.ini'))
+        sequence = fix.MsgSeqNum(3)
+        requestTime = fix.SendingTime()
+        requestTime.setString('20170606-03:52:24.324')
+        request = fix44.TestRequest()
+        request.getHeader().setField(requestTime)
+        request.getHeader().setField(sequence)
+        request.setField(fix.TestReqID('TEST3'))
+        responseTime = fix.SendingTime()
+        responseTime.setString('20170606-03:52:24.824')
+        response = fix44.Heartbeat()
+        response.getHeader().setField(responseTime)
+        response.getHeader().setField(sequence)
+        response.setField(fix.TestReqID('TEST3'))
+        store.addResponse(response)
+        store.addRequest(request)
+        snapshot = store.latencySnapshot()
+        self.assertEqual(snapshot['TestRequest']['count'], 1)
+        self.assertEqual(snapshot['TestRequest']['max'], 0.5)
+        self.assertEqual(snapshot['NewOrderSingle']['count'], 0)
+
+class TestEventDispatcher(unittest.TestCase):
+
+    def test_ordered_per_key(self):
+        dispatcher = gain.EventDispatcher(logging.getLogger(), threads=4)
+        notifier = gain.Observable()
+        notifier.setDispatcher(dispatcher)
+        received = {}
+        threads = set()
+
+        def receive(event):
+            received.setdefault(event.ClientOrderId, []).append(event.Seq)
+            threads.add(threading.current_thread().name)
+        notifier.addMessageHandler(gain.Notify.Order, receive)
+        for seq in range(100):
+            for cid in ('1', '2', '3'):
+                notifier.notifyMsgHandlers(gain.Notify.Order, ClientOrderId=cid, OrigClOrdID=None, Seq=seq)
+        dispatcher.stop()
+        for cid in ('1', '2', '3'):
+            self.assertEqual(received[cid], list(range(100)))
+        self.assertNotIn(threading.current_thread().name, threads)
+        stats = dispatcher.stats()
+        self.assertEqual(stats['Dropped'], 0)
+        self.assertEqual(sum(h['count'] for h in stats['Listeners'].values()), 300)
+
+    def test_drop_on_overflow(self):
+        dispatcher = gain.EventDispatcher(logging.getLogger(), threads=1, queueSize=1,
+                                          overflow=gain.DispatchOverflow.Drop)
+        release = threading.Event()
+        dispatcher.dispatch('1', [lambda e: release.wait(5)], None)
+        time.sleep(0.1)
+        dispatcher.dispatch('1', [], None)
+        dispatcher.dispatch('1', [], None)
+        self.assertEqual(dispatcher.stats()['Dropped'], 1)
+        self.assertEqual(dispatcher.stats()['QueueDepth'], [1])
+        release.set()
+        dispatcher.stop()
+
+    def test_inline_overflow_keeps_order(self):
+        dispatcher = gain.EventDispatcher(logging.getLogger(), threads=1, queueSize=2,
+                                          overflow=gain.DispatchOverflow.Inline)
+        release = threading.Event()
+        received = []
+
+        def receive(seq):
+            if seq == 1:
+                release.wait(5)
+            received.append((seq, threading.current_thread().name))
+        dispatcher.dispatch('1', [receive], 1)
+        time.sleep(0.1)
+        dispatcher.dispatch('1', [receive], 2)
+        dispatcher.dispatch('1', [receive], 3)
+        threading.Timer(0.1, release.set).start()
+        dispatcher.dispatch('1', [receive], 4)
+        dispatcher.dispatch('1', [receive], 5)
+        dispatcher.stop()
+        self.assertEqual([seq for seq, name in received], [1, 2, 3, 4, 5])
+        self.assertEqual(received[3][1], threading.current_thread().name)
+
+
+class TestReplyRegistry(unittest.TestCase):
+
+    def setUp(self):
+        self.Replies = gain.ReplyRegistry(logging.getLogger(), 5)
+
+    @staticmethod
+    def event(**kwargs):
+        e = gain.FixEvent()
+        for k, v in kwargs.items():
+            setattr(e, k, v)
+        return e
+
+    def test_order_resolved_on_terminal_status(self):
+        future = self.Replies.register('100', statuses=gain.TerminalStatuses)
+        self.Replies.resolve('100', self.event(Status=gain.OrderStatus.New))
+        self.assertFalse(future.done())
+        self.Replies.resolve('99', self.event(Status=gain.OrderStatus.Filled))
+        self.assertFalse(future.done())
+        filled = self.event(Status=gain.OrderStatus.Filled)
+        self.Replies.resolve('100', filled)
+        self.assertIs(future.result(0), filled)
+        self.assertEqual(self.Replies.pending(), 0)
+
+    def test_positions_collected(self):
+        future = self.Replies.register('INQ1', collect=True)
+        self.Replies.resolve('INQ1', self.event(Symbol=None, TotalNumPosReports=2))
+        self.Replies.resolve('INQ1', self.event(Symbol='6E', TotalNumPosReports=2))
+        self.assertFalse(future.done())
+        self.Replies.resolve('INQ1', self.event(Symbol='6B', TotalNumPosReports=2))
+        self.assertEqual([e.Symbol for e in future.result(0)], ['6E', '6B'])
+
+    def test_no_positions(self):
+        future = self.Replies.register('INQ2', collect=True)
+        self.Replies.resolve('INQ2', self.event(Symbol=None, TotalNumPosReports=None,
+                                                PosReqResult=fix.PosReqResult_NO_POSITIONS_FOUND_THAT_MATCH_CRITERIA))
+        self.assertEqual(future.result(0), [])
+        future = self.Replies.register('INQ4', collect=True)
+        self.Replies.resolve('INQ4', self.event(Symbol=None, TotalNumPosReports=0))
+        self.assertEqual(future.result(0), [])
+
+    def test_positions_without_total(self):
+        future = self.Replies.register('INQ5', collect=True)
+        self.Replies.resolve('INQ5', self.event(Symbol=None, TotalNumPosReports=None, PosReqResult=0))
+        self.Replies.resolve('INQ5', self.event(Symbol='6E', TotalNumPosReports=None))
+        self.assertFalse(future.done())
+        self.Replies.resolve('INQ5', self.event(Symbol='6B', TotalNumPosReports=None, LastRptRequested='Y'))
+        self.assertEqual([e.Symbol for e in future.result(0)], ['6E', '6B'])
+        future = self.Replies.register('INQ6', timeout=0.05, collect=True)
+        self.Replies.resolve('INQ6', self.event(Symbol=None, TotalNumPosReports=None))
+        self.Replies.resolve('INQ6', self.event(Symbol='6E', TotalNumPosReports=None))
+        self.assertRaises(gain.ReplyTimeout, future.result, 2)
+
+    def test_timeout(self):
+        future = self.Replies.register('INQ3', timeout=0.05)
+        self.assertRaises(gain.ReplyTimeout, future.result, 2)
+        self.assertEqual(self.Replies.pending(), 0)
+
+class TestFixClientSend(unittest.TestCase):
+
+    def setUp(self):
+        self.Client = gain.FixClient.Create(logging.getLogger(), 'gain_config.ini', False)
+        self.Sent = []
+        self.Client.SocketInitiator.application.send = self.Sent.append
+
+    def test_stamped_from_template(self):
+        first = self.Client.send(gain.BuyFutureLimitOrder('6E', '201709', 1, 1.1))
+        second = self.Client.send(gain.BuyFutureLimitOrder('6E', '201709', 3, 1.2))
+        self.assertNotEqual(first.OrderId, second.OrderId)
+        for trade, message in zip((first, second), self.Sent):
+            self.assertEqual(message.getField(fix.ClOrdID()).getValue(), trade.OrderId)
+            self.assertEqual(message.getField(fix.OrderQty()).getValue(), trade.Quantity)
+            self.assertEqual(message.getField(fix.Price()).getValue(), trade.Price)
+            self.assertEqual(message.getField(fix.Symbol()).getValue(), '6E')
+            self.assertEqual(message.getField(fix.Side()).getValue(), fix.Side_BUY)
+            self.assertEqual(message.getField(fix.Account()).getValue(), '[OEC Account]')
+            self.assertEqual(message.getHeader().getField(fix.MsgType()).getValue(), fix.MsgType_NewOrderSingle)
+
+    def test_market_order_has_no_price(self):
+        self.Client.send(gain.BuyFutureLimitOrder('6E', '201709', 1, 1.1))
+        self.Client.send(gain.BuyFutureMarketOrder('6E', '201709', 1))
+        self.assertFalse(self.Sent[1].isSetField(fix.Price()))
+        self.assertEqual(self.Sent[1].getField(fix.OrdType()).getValue(), fix.OrdType_MARKET)
+
+    def test_send_many(self):
+        orders = [gain.BuyFutureMarketOrder('6E', '201709', 1), gain.SellFutureLimitOrder('6B', '201709', 2, 1.3)]
+        trades = self.Client.sendMany(orders, reply=True)
+        self.assertEqual(len(self.Sent), 2)
+        self.assertEqual(int(trades[1].OrderId), int(trades[0].OrderId) + 1)
+        self.assertEqual([m.getField(fix.ClOrdID()).getValue() for m in self.Sent], [t.OrderId for t in trades])
+        self.assertEqual([t.Symbol for t in trades], ['6E', '6B'])
+        self.assertEqual(self.Client.SocketInitiator.application.Replies.pending(), 2)
+
+    def test_send_many_as_list(self):
+        orders = [gain.BuyFutureMarketOrder('6E', '201709', 1), gain.SellFutureLimitOrder('6B', '201709', 2, 1.3)]
+        trades = self.Client.sendMany(orders, orderList=True)
+        self.assertEqual(len(self.Sent), 1)
+        message = self.Sent[0]
+        self.assertEqual(message.getHeader().getField(fix.MsgType()).getValue(), fix.MsgType_NewOrderList)
+        self.assertEqual(message.getField(fix.TotNoOrders()).getValue(), 2)
+        self.assertEqual(message.getField(fix.ListID()).getValue(), 'L%s' % trades[0].OrderId)
+
+    def test_sync_positions_needs_complete_snapshot(self):
+        application = self.Client.SocketInitiator.application
+
+        def acknowledge(message):
+            ack = fix44.RequestForPositionsAck()
+            for field in (fix.Account('[OEC Account]'), fix.PosReqID(message.getField(fix.PosReqID()).getValue()),
+                          fix.PosReqResult(fix.PosReqResult_VALID_REQUEST)):
+                ack.setField(field)
+            application.fromApp(ack, application.Default.SessionID)
+        application.send = acknowledge
+        self.assertRaises(gain.ReplyTimeout, self.Client.syncPositions, 0.1)
+        self.assertIsNone(self.Client.position('6E', '201709'))
+
+    def test_concurrent_syncs_share_one_request(self):
+        application = self.Client.SocketInitiator.application
+        requests = []
+
+        def acknowledge(message):
+            requests.append(message)
+            ack = fix44.RequestForPositionsAck()
+            for field in (fix.Account('[OEC Account]'), fix.PosReqID(message.getField(fix.PosReqID()).getValue()),
+                          fix.TotalNumPosReports(0)):
+                ack.setField(field)
+            threading.Timer(0.1, application.fromApp, (ack, application.Default.SessionID)).start()
+        application.send = acknowledge
+        results = []
+        syncs = [threading.Thread(target=lambda: results.append(self.Client.syncPositions(1))) for _ in range(4)]
+        for sync in syncs:
+            sync.start()
+        for sync in syncs:
+            sync.join()
+        self.assertEqual((len(requests), results), (1, [[]] * 4))
+        self.assertTrue(self.Client.positionsSynchronised())
+
+
+class TestOrderStore(unittest.TestCase):
+
+    def setUp(self):
+        self.Orders = gain.OrderStore(logging.getLogger(), fix.SessionSettings('gain_config.ini'))
+
+    @staticmethod
+    def event(clientOrderId, status, origClOrdID=None, avgPx=None):
+        e = gain.FixEvent()
+        e.ClientOrderId = clientOrderId
+        e.Status = status
+        e.OrigClOrdID = origClOrdID
+        e.AvgPx = avgPx
+        e.Symbol = '6E'
+        e.Maturity = '201709'
+        e.Side = gain.OrderSide.Buy
+        e.Quantity = 1
+        return e
+
+    def test_open_orders_by_instrument(self):
+        self.Orders.add(gain.Trade('1', '6E', '201709', 1, gain.OrderType.Limit, gain.OrderSide.Buy, 1.1))
+        self.Orders.add(gain.Trade('2', '6E', '201712', 1, gain.OrderType.Limit, gain.OrderSide.Buy, 1.1))
+        self.Orders.add(gain.Trade('3', '6B', '201709', 1, gain.OrderType.Market, gain.OrderSide.Sell))
+        self.Orders.apply(self.event('1', gain.OrderStatus.New))
+        self.assertEqual([o.ClientOrderId for o in self.Orders.openOrders('6E', '201709')], ['1'])
+        self.assertEqual([o.ClientOrderId for o in self.Orders.byStatus(gain.OrderStatus.New)], ['1'])
+        self.assertEqual(len(self.Orders.byStatus(gain.OrderStatus.PendingNew)), 2)
+        self.Orders.apply(self.event('3', gain.OrderStatus.Filled, avgPx=1.3))
+        self.assertEqual(self.Orders.get('3').Status, gain.OrderStatus.Filled)
+        self.assertEqual(self.Orders.get('3').AvgPx, 1.3)
+        self.assertEqual(self.Orders.openOrders('6B', '201709'), [])
+        self.assertEqual(self.Orders.size(), (2, 1, 0))
+
+    def test_unknown_order_keeps_maturity(self):
+        self.Orders.apply(self.event('20', gain.OrderStatus.New))
+        self.assertEqual(self.Orders.get('20').Maturity, '201709')
+        self.assertEqual([o.ClientOrderId for o in self.Orders.openOrders('6E', '201709')], ['20'])
+
+    def test_cancel_chain(self):
+        self.Orders.add(gain.Trade('10', '6E', '201709', 1, gain.OrderType.Limit, gain.OrderSide.Buy, 1.1))
+        self.Orders.addCancel('11', '10')
+        self.Orders.apply(self.event('11', gain.OrderStatus.CancelRejected, '10'))
+        self.assertEqual(self.Orders.get('10').Status, gain.OrderStatus.PendingNew)
+        self.Orders.addCancel('12', '10')
+        self.Orders.apply(self.event('12', gain.OrderStatus.Cancelled, '10'))
+        self.assertEqual(self.Orders.chain('12'), ['10', '11', '12'])
+        self.assertIs(self.Orders.get('12'), self.Orders.get('10'))
+        self.assertEqual(self.Orders.get('10').Status, gain.OrderStatus.Cancelled)
+
+    def test_archive_bounded(self):
+        dictionary = fix.SessionSettings('gain_config.ini')
+        settings = dictionary.get()
+        settings.setString('ArchiveAfter', '0')
+        settings.setString('MaxArchivedOrders', '2')
+        dictionary.set(settings)
+        orders = gain.OrderStore(logging.getLogger(), dictionary)
+        for clientOrderId in ('1', '2', '3'):
+            orders.add(gain.Trade(clientOrderId, '6E', '201709', 1, gain.OrderType.Market, gain.OrderSide.Buy))
+            orders.apply(self.event(clientOrderId, gain.OrderStatus.Filled))
+        self.assertEqual(orders.size(), (0, 0, 2))
+        self.assertIsNone(orders.get('1'))
+        self.assertEqual(orders.get('3').Status, gain.OrderStatus.Filled)
+
+    def test_cancels_forgotten(self):
+        dictionary = fix.SessionSettings('gain_config.ini')
+        settings = dictionary.get()
+        settings.setString('ArchiveAfter', '0')
+        settings.setString('MaxArchivedOrders', '2')
+        dictionary.set(settings)
+        orders = gain.OrderStore(logging.getLogger(), dictionary)
+        orders.add(gain.Trade('1', '6E', '201709', 1, gain.OrderType.Limit, gain.OrderSide.Buy, 1.1))
+        orders.addCancel('2', '1')
+        orders.apply(self.event('2', gain.OrderStatus.CancelRejected))
+        self.assertIsNone(orders.get('2'))
+        orders.addCancel('3', '1')
+        for cancelId in ('11', '12', '13'):
+            orders.addCancel(cancelId, '10')
+        orders.archive()
+        self.assertIsNone(orders.get('11'))
+        self.assertIs(orders.get('3'), orders.get('1'))
+        self.assertEqual(orders.chain('1'), ['1', '2', '3'])
+
+
+class TestPositionKeeper(unittest.TestCase):
+
+    def setUp(self):
+        self.Positions = gain.PositionKeeper(logging.getLogger())
+
+    @staticmethod
+    def report(symbol, maturity, longQty, shortQty):
+        e = gain.FixEvent()
+        e.Symbol, e.Maturity, e.LongQty, e.ShortQty = symbol, maturity, longQty, shortQty
+        return e
+
+    @staticmethod
+    def fill(side, quantity, execType=fix.ExecType_TRADE):
+        e = gain.FixEvent()
+        e.ClientOrderId, e.Symbol, e.Side, e.LastQty, e.ExecType = '1', '6E', side, quantity, execType
+        return e
+
+    def test_fills_update_seeded_position(self):
+        self.assertIsNone(self.Positions.position('6E', '201709'))
+        self.Positions.seed([self.report('6E', '201709', 3, 1)])
+        self.assertEqual(self.Positions.position('6E', '201709'), 2)
+        self.assertEqual(self.Positions.position('6E', '201712'), 0)
+        self.Positions.apply(self.fill(gain.OrderSide.Buy, 2), '201709')
+        self.Positions.apply(self.fill(gain.OrderSide.Sell, 5), '201712')
+        self.Positions.apply(self.fill(gain.OrderSide.Sell, 7, fix.ExecType_NEW), '201709')
+        self.assertEqual(self.Positions.position('6E', '201709'), 4)
+        self.assertEqual(self.Positions.position('6E', '201712'), -5)
+
+    def test_resync_flags_drift(self):
+        drifted = []
+        self.Positions.addMessageHandler(gain.Notify.PositionDrift, drifted.append)
+        self.Positions.seed([self.report('6E', '201709', 1, 0)])
+        self.Positions.apply(self.fill(gain.OrderSide.Buy, 1), '201709')
+        drift = self.Positions.seed([self.report('6E', '201709', 3, 0)])
+        self.assertEqual(drift, [(('6E', '201709'), 2, 3)])
+        self.assertEqual((drifted[0].Expected, drifted[0].Actual), (2, 3))
+        self.assertEqual(self.Positions.seed([]), [(('6E', '201709'), 3, 0)])
+
+    def test_incomplete_snapshot_not_seeded(self):
+        report = self.report('6E', '201709', 1, 0)
+        report.TotalNumPosReports = 2
+        self.assertRaises(ValueError, self.Positions.seed, [report])
+        self.assertFalse(self.Positions.seeded())
+        self.assertIsNone(self.Positions.position('6E', '201709'))
+
+
+class TestBalanceCache(unittest.TestCase):
+
+    def setUp(self):
+        self.Balance = gain.BalanceCache(logging.getLogger())
+        self.Inquiries = 0
+
+    def report(self, balance):
+        e = gain.FixEvent()
+        e.Balance, e.Currency = balance, 'USD'
+        return e
+
+    def refresh(self):
+        self.Inquiries += 1
+        future = Future()
+        self.Balance.update(self.report(1000.0 * self.Inquiries))
+        future.set_result(None)
+        return future
+
+    def test_cached_until_stale(self):
+        self.assertEqual(self.Balance.get(5, self.refresh), (1000.0, 'USD'))
+        self.assertEqual(self.Balance.get(5, self.refresh), (1000.0, 'USD'))
+        self.assertEqual(self.Inquiries, 1)
+        self.assertEqual(self.Balance.get(0, self.refresh), (2000.0, 'USD'))
+        self.Balance.invalidate()
+        self.assertEqual(self.Balance.get(5, self.refresh), (3000.0, 'USD'))
+        self.assertEqual(self.Inquiries, 3)
+
+    def test_unseeded_reserve(self):
+        self.assertEqual(self.Balance.tryReserve('1', 100.0, lambda balance, ccy: True), (False, None, None))
+        self.assertEqual(self.Balance.reserved(), 0)
+
+        def refresh():
+            future = Future()
+            future.set_result(None)
+            return future
+        self.assertEqual(self.Balance.get(5, refresh), (None, None))
+
+    def test_single_flight_refresh(self):
+        pending = Future()
+
+        def refresh():
+            self.Inquiries += 1
+            return pending
+        results = []
+        callers = [threading.Thread(target=lambda: results.append(self.Balance.get(5, refresh, 1)))
+                   for _ in range(4)]
+        for caller in callers:
+            caller.start()
+        time.sleep(0.1)
+        self.Balance.update(self.report(500.0))
+        pending.set_result(None)
+        for caller in callers:
+            caller.join()
+        self.assertEqual(self.Inquiries, 1)
+        self.assertEqual(results, [(500.0, 'USD')] * 4)
+
+    def test_refresh_sent_outside_lock(self):
+        def refresh():
+            updater = threading.Thread(target=self.Balance.update, args=(self.report(700.0),))
+            updater.start()
+            updater.join(1)
+            self.assertFalse(updater.is_alive())
+            future = Future()
+            future.set_result(None)
+            return future
+        self.assertEqual(self.Balance.get(5, refresh, 1), (700.0, 'USD'))
+
+        def failed():
+            raise ValueError('No session')
+        self.Balance.invalidate()
+        self.assertRaises(ValueError, self.Balance.get, 5, failed, 1)
+
+    def test_reservations_reduce_available(self):
+        self.Balance.update(self.report(1000.0))
+        self.Balance.reserve('1', 300)
+        self.Balance.reserve('2', 200)
+        self.assertEqual(self.Balance.get(5, self.refresh), (500.0, 'USD'))
+        self.Balance.release('1')
+        self.Balance.release('3')
+        self.assertEqual(self.Balance.reserved(), 200)
+        self.assertEqual(self.Balance.get(5, self.refresh), (800.0, 'USD'))
+
+    def test_try_reserve_checks_and_reserves_at_once(self):
+        self.Balance.update(self.report(1000.0))
+        enough = lambda balance, currency: currency == 'USD' and balance >= 600
+        self.assertEqual(self.Balance.tryReserve('1', 600, enough), (True, 1000.0, 'USD'))
+        self.assertEqual(self.Balance.tryReserve('2', 600, enough), (False, 400.0, 'USD'))
+        self.assertEqual(self.Balance.reserved(), 600)
+
+
+class TestDecoder(unittest.TestCase):
+
+    def setUp(self):
+        self.Application = gain.GainApplication(fix.SessionSettings('gain_config.ini'), logging.getLogger())
+        self.SessionID = fix.SessionID('FIX.4.4', 'SENDER', 'TARGET')
+        self.Events = []
+        self.Application.Notifier.addMessageHandler(gain.Notify.Order, self.Events.append)
+        self.Application.Notifier.addMessageHandler(gain.Notify.Account, self.Events.append)
+
+    def report(self, status, orig=None):
+        report = fix44.ExecutionReport()
+        report.setField(fix.ClOrdID('300'))
+        report.setField(fix.OrdStatus(status))
+        report.setField(fix.AvgPx(1.25))
+        report.setField(fix.OrderQty(2))
+        report.setField(fix.Side(fix.Side_SELL))
+        report.setField(fix.Symbol('6E'))
+        report.setField(fix.TransactTime())
+        if orig is not None:
+            report.setField(fix.OrigClOrdID(orig))
+        return report
+
+    def test_execution_report(self):
+        self.Application.fromApp(self.report(fix.OrdStatus_FILLED, '299'), self.SessionID)
+        event = self.Events[0]
+        self.assertEqual(event.ClientOrderId, '300')
+        self.assertEqual(event.Status, gain.OrderStatus.Filled)
+        self.assertEqual(event.Side, gain.OrderSide.Sell)
+        self.assertEqual(event.AvgPx, 1.25)
+        self.assertEqual(event.Quantity, 2)
+        self.assertIsNone(event.OrigClOrdID)
+
+    def test_cancelled_keeps_orig(self):
+        self.Application.fromApp(self.report(fix.OrdStatus_CANCELED, '299'), self.SessionID)
+        self.assertEqual(self.Events[0].OrigClOrdID, '299')
+
+    def test_partial_fill_reaches_position(self):
+        self.Application.Positions.seed([])
+        partial = self.report(fix.OrdStatus_PARTIALLY_FILLED)
+        for field in (fix.MaturityMonthYear('201709'), fix.ExecType(fix.ExecType_TRADE), fix.LastQty(1)):
+            partial.setField(field)
+        self.Application.fromApp(partial, self.SessionID)
+        cancelled = self.report(fix.OrdStatus_CANCELED)
+        for field in (fix.MaturityMonthYear('201709'), fix.ExecType(fix.ExecType_CANCELED)):
+            cancelled.setField(field)
+        self.Application.fromApp(cancelled, self.SessionID)
+        self.assertEqual([e.Status for e in self.Events],
+                         [gain.OrderStatus.PartiallyFilled, gain.OrderStatus.Cancelled])
+        self.assertEqual(self.Application.Positions.position('6E', '201709'), -1)
+
+    def test_failing_listener_after_state(self):
+        seen = []
+
+        def fail(event):
+            seen.append((self.Application.Orders.get('300').Status, reply.done()))
+            raise ValueError('listener failed')
+        self.Application.Notifier.addMessageHandler(gain.Notify.Order, fail)
+        reply = self.Application.Replies.register('300', statuses=(gain.OrderStatus.New,))
+        self.Application.fromApp(self.report(fix.OrdStatus_NEW), self.SessionID)
+        self.Application.fromApp(self.report(fix.OrdStatus_CANCELED), self.SessionID)
+        self.assertEqual(seen, [(gain.OrderStatus.New, True), (gain.OrderStatus.Cancelled, True)])
+        self.assertEqual(reply.result(0).Status, gain.OrderStatus.New)
+        self.assertEqual([e.Status for e in self.Events], [gain.OrderStatus.New, gain.OrderStatus.Cancelled])
+        self.assertEqual(self.Application.Orders.get('300').Status, gain.OrderStatus.Cancelled)
+
+    def test_unknown_status_ignored(self):
+        self.Application.fromApp(self.report(fix.OrdStatus_PENDING_CANCEL), self.SessionID)
+        self.assertEqual(self.Events, [])
+
+    def test_collateral_report(self):
+        report = fix44.CollateralReport()
+        report.setField(fix.Account('ACC'))
+        report.setField(fix.Currency('USD'))
+        report.setField(fix.CashOutstanding(1500.5))
+        report.setField(fix.CollInquiryID('INQ1'))
+        self.Application.fromApp(report, self.SessionID)
+        event = self.Events[0]
+        self.assertEqual((event.Account, event.Currency, event.Balance, event.CollInquiryID),
+                         ('ACC', 'USD', 1500.5, 'INQ1'))
+        self.assertEqual(event.AccountInquiry, gain.AccountInquiry.CollateralInquiry)
+
+
+class TestSessionRouting(unittest.TestCase):
+
+    def setUp(self):
+        settings = fix.SessionSettings('gain_config.ini')
+        self.Default = settings.getSessions()[0]
+        self.add(settings, 'SECOND', MaxMessageRate='2')
+        self.add(settings, 'ALPHA', Account='B', Strategies='alpha,beta')
+        self.Application = gain.GainApplication(settings, logging.getLogger())
+        initiator = type('Initiator', (object,), {'application': self.Application})()
+        self.Client = gain.FixClient(initiator, logging.getLogger())
+        self.Sent = []
+        self.Application.send = self.Sent.append
+
+    def add(self, settings, sender, **values):
+        dictionary = settings.get(self.Default)
+        dictionary.setString('SenderCompID', sender)
+        for name, value in values.items():
+            dictionary.setString(name, value)
+        settings.set(fix.SessionID('FIX.4.4', sender, 'OEC_TEST'), dictionary)
+
+    def sender(self, message):
+        return message.getHeader().getField(49)
+
+    def test_sessions_from_config(self):
+        self.assertEqual(len(self.Application.Sessions), 3)
+        self.assertEqual(list(self.Application.Accounts), ['B', '[OEC Account]'])
+        self.assertEqual(self.Application.Default.Account, '[OEC Account]')
+        alpha = self.Application.Sessions['FIX.4.4:ALPHA->OEC_TEST']
+        self.assertEqual((alpha.Strategies, alpha.MaxMessageRate), (frozenset(['alpha', 'beta']), 0))
+        self.assertEqual(self.Application.Sessions['FIX.4.4:SECOND->OEC_TEST'].MaxMessageRate, 2)
+
+    def test_route_by_account_and_strategy(self):
+        byAccount = self.Client.send(gain.BuyFutureMarketOrder('6E', '201709', 1), account='B')
+        byStrategy = self.Client.send(gain.BuyFutureMarketOrder('6E', '201709', 1), strategy='beta')
+        self.Client.send(gain.BuyFutureMarketOrder('6E', '201709', 1))
+        self.assertEqual([self.sender(m) for m in self.Sent[:2]], ['ALPHA', 'ALPHA'])
+        self.assertEqual(self.Sent[0].getField(fix.Account()).getValue(), 'B')
+        self.assertEqual((byAccount.Session, byStrategy.Session), ('FIX.4.4:ALPHA->OEC_TEST',) * 2)
+        self.assertIn(self.sender(self.Sent[2]), ('SECOND', '[OEC Username]'))
+        self.assertEqual(self.Sent[2].getField(fix.Account()).getValue(), '[OEC Account]')
+        self.Client.cancel(byAccount)
+        self.assertEqual(self.sender(self.Sent[3]), 'ALPHA')
+        self.assertIs(self.Application.session(message=self.Sent[3]), self.Application.Sessions[byAccount.Session])
+        # untagged sessions take strategies no session is tagged with
+        self.assertIn(self.Client.route(strategy='gamma'), ('FIX.4.4:SECOND->OEC_TEST',
+                                                            'FIX.4.4:[OEC Username]->OEC_TEST'))
+        self.assertRaises(ValueError, self.Client.send, gain.BuyFutureMarketOrder('6E', '201709', 1), account='C')
+
+    def test_spread_over_equivalent_sessions(self):
+        events = []
+        self.Client.addSessionListener(events.append)
+        for session in self.Application.Sessions.values():
+            self.Application.onLogon(session.SessionID)
+        self.assertTrue(self.Application.connected)
+        self.assertEqual((events[0].Session, events[0].Connected), ('FIX.4.4:ALPHA->OEC_TEST', True))
+        routes = [self.Client.route() for _ in range(4)]
+        self.assertEqual(sorted(routes), ['FIX.4.4:SECOND->OEC_TEST'] * 2 + ['FIX.4.4:[OEC Username]->OEC_TEST'] * 2)
+        second = self.Application.Sessions['FIX.4.4:SECOND->OEC_TEST']
+        second.throttle()
+        second.throttle()
+        self.assertEqual(second.load(), (1.0, 2))
+        self.assertEqual(set(self.Client.route() for _ in range(4)), set(['FIX.4.4:[OEC Username]->OEC_TEST']))
+        self.Application.onLogout(self.Application.Sessions['FIX.4.4:[OEC Username]->OEC_TEST'].SessionID)
+        self.assertTrue(self.Application.connected)
+        self.assertFalse(self.Client.sessions()['FIX.4.4:[OEC Username]->OEC_TEST']['Connected'])
+        self.assertEqual(set(self.Client.route() for _ in range(4)), set(['FIX.4.4:SECOND->OEC_TEST']))
+        self.Application.onLogout(self.Application.Sessions['FIX.4.4:ALPHA->OEC_TEST'].SessionID)
+        self.assertFalse(self.Application.connected)
+        self.assertFalse(self.Application.connection_trigger.is_set())
+
+    def test_events_carry_session(self):
+        events = []
+        self.Application.Notifier.addMessageHandler(gain.Notify.Order, events.append)
+        alpha = fix.SessionID('FIX.4.4', 'ALPHA', 'OEC_TEST')
+        report = fix44.ExecutionReport()
+        for field in (fix.ClOrdID('300'), fix.OrdStatus(fix.OrdStatus_NEW), fix.AvgPx(0), fix.OrderQty(1),
+                      fix.Side(fix.Side_BUY), fix.Symbol('6E'), fix.TransactTime()):
+            report.setField(field)
+        self.Application.fromApp(report, alpha)
+        self.assertEqual((events[0].Session, events[0].Account), ('FIX.4.4:ALPHA->OEC_TEST', 'B'))
+        collateral = fix44.CollateralReport()
+        for field in (fix.Account('B'), fix.Currency('USD'), fix.CashOutstanding(1500.5), fix.CollInquiryID('INQ1')):
+            collateral.setField(field)
+        self.Application.fromApp(collateral, alpha)
+        self.assertEqual(self.Client.balance(account='B'), (1500.5, 'USD'))
+        self.assertEqual(self.Client.sessions()['FIX.4.4:ALPHA->OEC_TEST']['Received'], 2)
+        self.assertEqual(self.Client.sessions()['FIX.4.4:SECOND->OEC_TEST']['Received'], 0)
+
+
+class TestMessageLogger(unittest.TestCase):
+
+    def setUp(self):
+        self.Settings = fix.SessionSettings('gain_config.ini')
+        self.Logger = logging.getLogger('transfixed.test')
+        self.Logger.setLevel(logging.INFO)
+        self.Records = []
+        test = self
+
+        class Collect(logging.Handler):
+            def emit(self, record):
+                test.Records.append((record.levelno, record.getMessage(), record.threadName))
+        self.Handler = Collect()
+        self.Logger.addHandler(self.Handler)
+
+    def configure(self, **values):
+        dictionary = self.Settings.get()
+        for name, value in values.items():
+            dictionary.setString(name, value)
+        self.Settings.set(dictionary)
+        return gain.MessageLogger(self.Logger, self.Settings)
+
+    def test_levels_and_sampling(self):
+        log = self.configure(MessageLogLevels='8:WARNING,D:DEBUG', MessageLogSampling='0:3')
+        for i in range(7):
+            if log.enabled(fix.MsgType_Heartbeat):
+                log.log(fix.MsgType_Heartbeat, 'heartbeat %s', i)
+        self.assertFalse(log.enabled(fix.MsgType_NewOrderSingle))
+        self.assertTrue(log.enabled(fix.MsgType_ExecutionReport))
+        log.log(fix.MsgType_ExecutionReport, 'report %s', '8=FIX.4.4')
+        self.assertEqual([r[1] for r in self.Records], ['heartbeat 0', 'heartbeat 3', 'heartbeat 6', 'report 8=FIX.4.4'])
+        self.assertEqual(self.Records[-1][0], logging.WARNING)
+
+    def test_background_writer(self):
+        log = self.configure(AsyncLogging='Y')
+        log.log(fix.MsgType_ExecutionReport, 'report %s', '8=FIX.4.4')
+        log.stop()
+        self.assertEqual(self.Records, [(logging.INFO, 'report 8=FIX.4.4', 'Message Logger')])
+
+    def tearDown(self):
+        self.Logger.removeHandler(self.Handler)
+
+
+class StubFixClient(object):
+    """
+    FixClient replying to collateral inquiries from another thread
+    """
+    def __init__(self):
+        self.Logger = logging.getLogger()
+        self.Notifier = gain.Observable()
+
+    def addOrderListener(self, callback):
+        self.Notifier.addMessageHandler(gain.Notify.Order, callback)
+
+    def removeOrderListener(self, callback):
+        self.Notifier.removeMsgHandler(gain.Notify.Order, callback)
+
+    def collateralInquiry(self, reply=False, timeout=None, account=None):
+        future = Future()
+
+        def respond():
+            e = gain.FixEvent()
+            e.Balance = 1000.0
+            future.set_result(e)
+            self.Notifier.notifyMsgHandlers(gain.Notify.Order, ClientOrderId='1', Status=gain.OrderStatus.Filled)
+        threading.Timer(0.01, respond).start()
+        return future
+
+    def send(self, order, reply=False, timeout=None, until=None, account=None, strategy=None):
+        time.sleep(0.2)
+        e = gain.FixEvent()
+        e.ClientOrderId, e.Status = '2', gain.OrderStatus.Filled
+        trade = gain.Trade('2', '6E', '201709', 1, gain.OrderType.Market, gain.OrderSide.Buy)
+        trade.Reply = Future()
+        trade.Reply.set_result(e)
+        return trade
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'asyncio facade requires python 3.5')
+class TestAsyncFixClient(unittest.TestCase):
+
+    def test_inquiry_and_stream(self):
+        import asyncio
+        from transfixed.asyncfixclient import AsyncFixClient
+        loop = asyncio.new_event_loop()
+        client = AsyncFixClient(StubFixClient(), loop)
+        orders = client.orders()
+        report = loop.run_until_complete(client.collateral_inquiry())
+        self.assertEqual(report.Balance, 1000.0)
+        event = loop.run_until_complete(orders.__anext__())
+        self.assertEqual(event.Status, gain.OrderStatus.Filled)
+        orders.close()
+        self.assertRaises(StopAsyncIteration, loop.run_until_complete, orders.__anext__())
+        loop.close()
+
+    def test_send_does_not_block_loop(self):
+        import asyncio
+        from transfixed.asyncfixclient import AsyncFixClient
+        loop = asyncio.new_event_loop()
+        client = AsyncFixClient(StubFixClient(), loop)
+        done = []
+
+        async def tick():
+            await asyncio.sleep(0.01)
+            done.append('tick')
+
+        async def send():
+            event = await client.send(gain.BuyFutureMarketOrder('6E', '201709', 1))
+            done.append(event.Status)
+
+        async def both():
+            await asyncio.gather(send(), tick())
+        loop.run_until_complete(both())
+        self.assertEqual(done, ['tick', gain.OrderStatus.Filled])
+        loop.close()
+
+
+@unittest.skipIf(executor is None, 'exchange simulator in test_gain is not on the path')
+class TestExchangeSimulator(unittest.TestCase):
+
+    def setUp(self):
+        self.Exchange = executor.Exchange({'6E': 1.1}, spread=0.02, marketMaker=False)
+
+    def order(self, clOrdID, side, quantity, price=None):
+        return executor.Order(clOrdID, None, 'A', '6E', '201709', side,
+                              fix.OrdType_MARKET if price is None else fix.OrdType_LIMIT, quantity, price)
+
+    def test_price_time_priority(self):
+        for clOrdID, price in (('1', 1.2), ('2', 1.1), ('3', 1.1)):
+            self.assertEqual(self.Exchange.newOrder(self.order(clOrdID, fix.Side_SELL, 1, price)), [])
+        buy = self.order('4', fix.Side_BUY, 2.5, 1.15)
+        fills = self.Exchange.newOrder(buy)
+        self.assertEqual([(f[0].ClOrdID, f[1], f[2]) for f in fills], [('2', 1, 1.1), ('4', 1, 1.1),
+                                                                        ('3', 1, 1.1), ('4', 1, 1.1)])
+        self.assertEqual((buy.Leaves, buy.Open), (0.5, True))
+        self.assertEqual(self.Exchange.book('6E', '201709').best(fix.Side_SELL).ClOrdID, '1')
+        self.assertEqual(self.Exchange.account('A').Positions[('6E', '201709')], 0)
+
+    def test_cancel_and_unfilled_market_order(self):
+        self.Exchange.newOrder(self.order('1', fix.Side_BUY, 1, 1.0))
+        self.assertEqual(self.Exchange.cancel('1').ClOrdID, '1')
+        self.assertIsNone(self.Exchange.cancel('1'))
+        market = self.order('2', fix.Side_SELL, 1)
+        self.assertEqual(self.Exchange.newOrder(market), [])
+        self.assertFalse(market.Open)
+
+    def test_market_maker(self):
+        self.Exchange.MarketMaker = True
+        self.Exchange.newOrder(self.order('1', fix.Side_SELL, 1, 1.095))
+        buy = self.order('2', fix.Side_BUY, 3)
+        fills = self.Exchange.newOrder(buy)
+        self.assertEqual([(f[0].ClOrdID, f[1], f[2]) for f in fills], [('1', 1, 1.095), ('2', 1, 1.095),
+                                                                        ('2', 2, 1.11)])
+        self.assertAlmostEqual(buy.avgPx(), (1.095 + 2 * 1.11) / 3)
+        self.assertEqual(self.Exchange.account('A').Positions[('6E', '201709')], 2)
+        self.assertEqual(self.Exchange.newOrder(self.order('3', fix.Side_BUY, 1, 1.1)), [])
+
+    def test_latency_model(self):
+        self.assertEqual(executor.LatencyModel(0.01).sample(), 0.01)
+        model = executor.LatencyModel(0.01, 0.005, 'uniform', seed=1)
+        samples = [model.sample() for _ in range(100)]
+        self.assertTrue(all(0.005 <= s <= 0.015 for s in samples))
+        self.assertTrue(all(s >= 0 for s in [executor.LatencyModel(0.001, 0.01, 'normal').sample()
+                                             for _ in range(100)]))
+
+
 if __name__ == '__main__':
-    suite = unittest.TestLoader().loadTestsFromTestCase(TestTimeLags)
+    suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(TestTimeLags),
+                                unittest.TestLoader().loadTestsFromTestCase(TestUTCTimestamp),
+                                unittest.TestLoader().loadTestsFromTestCase(TestLatencyHistogram),
+                                unittest.TestLoader().loadTestsFromTestCase(TestEventDispatcher),
+                                unittest.TestLoader().loadTestsFromTestCase(TestReplyRegistry),
+                                unittest.TestLoader().loadTestsFromTestCase(TestFixClientSend),
+                                unittest.TestLoader().loadTestsFromTestCase(TestOrderStore),
+                                unittest.TestLoader().loadTestsFromTestCase(TestPositionKeeper),
+                                unittest.TestLoader().loadTestsFromTestCase(TestBalanceCache),
+                                unittest.TestLoader().loadTestsFromTestCase(TestExchangeSimulator),
+                                unittest.TestLoader().loadTestsFromTestCase(TestDecoder),
+                                unittest.TestLoader().loadTestsFromTestCase(TestSessionRouting),
+                                unittest.TestLoader().loadTestsFromTestCase(TestMessageLogger),
+                                unittest.TestLoader().loadTestsFromTestCase(TestAsyncFixClient)])
     unittest.TextTestRunner(verbosity=2).run(suite)
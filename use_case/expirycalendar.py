@@ -0,0 +1,113 @@
+import datetime
+
+ONE_DAY = datetime.timedelta(days=1)
+
+
+def nth_weekday(year, month, weekday, n):
+    """
+    :param weekday: Monday is 0
+    :return: date of the n-th weekday of the month
+    """
+    first = datetime.date(year, month, 1)
+    return first + datetime.timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+
+def business_day_on_or_before(date, holidays):
+    while date.weekday() > 4 or date in holidays:
+        date -= ONE_DAY
+    return date
+
+
+def load_holidays(path):
+    """
+    :param path: text file with one ISO date (YYYY-MM-DD) per line, # starts a comment
+    :return: frozenset of dates
+    """
+    holidays = set()
+    with open(path) as f:
+        for line in f:
+            line = line.split('#')[0].strip()
+            if line:
+                holidays.add(datetime.datetime.strptime(line, '%Y-%m-%d').date())
+    return frozenset(holidays)
+
+
+class VixRule(object):
+    """
+    http://cfe.cboe.com/products/spec_vix.aspx
+
+    The Wednesday that is thirty days prior to the third Friday of the calendar month immediately
+    following the contract month. If that Friday is a CBOE holiday, thirty days prior to the
+    business day immediately preceding that Friday. A holiday Wednesday moves to the business day before.
+    """
+    def lastTradeDate(self, year, month, holidays):
+        friday = nth_weekday(year + month // 12, month % 12 + 1, 4, 3)
+        return business_day_on_or_before(business_day_on_or_before(friday, holidays) -
+                                         datetime.timedelta(days=30), holidays)
+
+
+class CmeFxRule(object):
+    """
+    CME FX futures: the second business day before the third Wednesday of the contract month
+    """
+    def lastTradeDate(self, year, month, holidays):
+        date = nth_weekday(year, month, 2, 3)
+        for _ in range(2):
+            date = business_day_on_or_before(date - ONE_DAY, holidays)
+        return date
+
+
+class EquityIndexRule(object):
+    """
+    Equity index futures: the third Friday of the contract month, or the business day before it
+    """
+    def lastTradeDate(self, year, month, holidays):
+        return business_day_on_or_before(nth_weekday(year, month, 4, 3), holidays)
+
+
+class ExpiryCalendar(object):
+    """
+    Last trade dates by (Symbol, maturity) computed once per process. The rule of a security is its
+    ExpiryRule attribute or is chosen from its exchange and market group, VIX rules otherwise.
+    """
+    Rules = {'VIX': VixRule(), 'CMEFX': CmeFxRule(), 'EquityIndex': EquityIndexRule()}
+    Products = {('CFE', 'Indices'): 'VIX', ('CME', 'Currencies'): 'CMEFX', ('CME', 'Indices'): 'EquityIndex'}
+    Default = 'VIX'
+
+    def __init__(self, holidays=frozenset()):
+        self.Holidays = holidays
+        self.__expiries = {}
+
+    def rule(self, security):
+        name = security.get('ExpiryRule')
+        if name is None:
+            description = security.get('Description', {})
+            name = self.Products.get((description.get('Exchange'), description.get('MarketGroup')), self.Default)
+        return self.Rules[name]
+
+    def expiry(self, security, maturity):
+        """
+        :param security: Securities item
+        :param maturity: contract month as YYYYMM
+        :return: last trade date
+        """
+        key = (security['Symbol'], maturity)
+        date = self.__expiries.get(key)
+        if date is None:
+            year, month = int(maturity[:4]), int(maturity[4:])
+            if len(maturity) != 6 or not 1 <= month <= 12:
+                raise ValueError('Invalid maturity %s' % maturity)
+            date = self.__expiries[key] = self.rule(security).lastTradeDate(year, month, self.Holidays)
+        return date
+
+    def warm(self, securities, months=24, start=None):
+        """
+        Compute the expiries of the next months contracts of every security
+        :return: number of entries in the calendar
+        """
+        start = start or datetime.date.today()
+        for security in securities:
+            for i in range(months):
+                year, month = start.year + (start.month - 1 + i) // 12, (start.month - 1 + i) % 12 + 1
+                self.expiry(security, '%04d%02d' % (year, month))
+        return len(self.__expiries)
@@ -3,19 +3,22 @@ import json
 import datetime
 from datetime import timedelta
 import decimal
-import boto3
+import threading
 from queue import Queue
-from queue import Empty
+from collections import OrderedDict
+from functools import reduce
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from future.utils import with_metaclass
 from transfixed import gainfixtrader as gain
 import base64
 import hmac
 import hashlib
 import os
-import smtplib
 import atexit
-from email.mime.multipart import MIMEMultipart
-from email.mime.text import MIMEText
-from botocore.exceptions import ClientError
+from securitycache import SecurityCache
+from statuswriter import StatusWriter
+from reportsender import SmtpTransport, ReportSender
+from expirycalendar import ExpiryCalendar, load_holidays
 
 # Helper class to convert a DynamoDB item to JSON.
 class DecimalEncoder(json.JSONEncoder):
@@ -27,49 +30,120 @@ class DecimalEncoder(json.JSONEncoder):
                 return int(o)
         return super(DecimalEncoder, self).default(o)
 
+def client_error():
+    """
+    botocore is imported on first use, the except clauses call this only when an exception is raised
+    """
+    from botocore.exceptions import ClientError
+    return ClientError
+
+
+def ses_smtp_password(secret):
+    h = hmac.new(secret.encode('utf-8'), b'SendRawEmail', digestmod=hashlib.sha256)
+    return base64.b64encode(b'\x02' + h.digest()).decode('ascii')
+
+
+def dynamodb():
+    import boto3
+    return boto3.resource('dynamodb', region_name='us-east-1')
+
+
 class Singleton(type):
     _instances = {}
+    _lock = threading.Lock()
     def __call__(cls, *args, **kwargs):
-        if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+        with Singleton._lock:
+            if cls not in cls._instances:
+                cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
         return cls._instances[cls]
 
 
-class LambdaTrader(object):
-    __metaclass__ = Singleton
+class LambdaTrader(with_metaclass(Singleton, object)):
+    """
+    One trader per container. The FIX session stays logged on between warm invocations and is
+    checked with a CollateralInquiry round trip before use.
+    """
     def __init__(self, logger):
         self.Logger = logger
-        self.CurrentPositions = Queue()
-        self.CurrentBalance = Queue()
-        self.SubmittedOrders = Queue()
         self.Messages = []
         self.PendingOrders = Queue()
-        db = boto3.resource('dynamodb', region_name='us-east-1')
-        self.__Securities = db.Table('Securities')
-        self.__Orders = db.Table('Orders')
+        self.Concurrency = int(os.environ.get('validate_concurrency', 4))
+        self.Timings = OrderedDict()
+        self.__timingsLock = threading.Lock()
+        self.__db = None
+        self.__reports = None
+        self.StatusWriter = StatusWriter(self.Logger, self.orders_table,
+                                         int(os.environ.get('status_writer_threads', 4)),
+                                         latency=self.StatusWriteLatency)
+        self.FixClient = None
+        self.HealthCheckTimeout = int(os.environ.get('health_check_timeout', 5))
+
+    def connect(self):
         self.FixClient = gain.FixClient.Create(self.Logger, 'config.ini', False)
         self.FixClient.addOrderListener(self.OrderNotificationReceived)
         self.FixClient.addAccountInquiryListener(self.AccountInquiryReceived)
+        self.FixClient.start()
+
+    def disconnect(self):
+        if self.FixClient is not None:
+            self.FixClient.removeOrderListener(self.OrderNotificationReceived)
+            self.FixClient.removeAccountInquiryListener(self.AccountInquiryReceived)
+            self.FixClient.stop()
+            self.FixClient = None
+
+    def healthy(self):
+        """
+        :return: True if the session is logged on and answers a CollateralInquiry
+        """
+        application = self.FixClient.SocketInitiator.application
+        if not application.connected:
+            application.connection_trigger.wait(self.HealthCheckTimeout)
+        if not application.connected:
+            self.Logger.warning('FIX session is not logged on')
+            return False
+        try:
+            self.FixClient.collateralInquiry(reply=True, timeout=self.HealthCheckTimeout).result()
+        except Exception as e:
+            self.Logger.warning('FIX session health check failed: %s' % e)
+            return False
+        return True
+
+    def ensure_session(self):
+        """
+        Log on in a cold container, reuse the session in a warm one and reconnect if it is not healthy
+        :return: COLD, WARM or RECONNECT
+        """
+        if self.FixClient is None:
+            self.connect()
+            return 'COLD'
+        if self.healthy():
+            return 'WARM'
+        self.disconnect()
+        self.connect()
+        return 'RECONNECT'
+
+    def end_invocation(self):
+        """
+        Drop the state of the invocation so nothing leaks into the next warm one
+        """
+        self.StatusWriter.flush()
+        while not self.PendingOrders.empty():
+            self.PendingOrders.get_nowait()
+        self.Messages = []
+        self.Timings = OrderedDict()
 
     def AccountInquiryReceived(self, event):
         if event.AccountInquiry == gain.AccountInquiry.CollateralInquiry:
             self.Logger.info('CollInquiryID: %s Account: %s' % (event.CollInquiryID, event.Account))
             self.Logger.info('Balance: %s Currency: %s' % (event.Balance, event.Currency))
-            self.CurrentBalance.put((event.CollInquiryID, event.Balance, event.Currency))
-            self.CurrentBalance.task_done()
         if event.AccountInquiry == gain.AccountInquiry.RequestForPositions:
             self.Logger.info('PosReqID: %s Account: %s' % (event.PosReqID, event.Account))
             self.Logger.info('Quantity: %s Amount: %s' % (event.LongQty - event.ShortQty, event.PosAmt))
-            self.CurrentPositions.put((event.PosReqID, event.Symbol, event.Maturity, event.LongQty - event.ShortQty))
-            self.CurrentPositions.task_done()
 
     def OrderNotificationReceived(self, event):
         self.Logger.info('OrderId: %s Status: %s Side: %s' % (event.ClientOrderId, event.Status, event.Side))
         self.Logger.info('Symbol: %s AvgPx: %s Quantity: %s' % (event.Symbol, event.AvgPx, event.Quantity))
         self.Logger.info('order notification received')
-        if event.Status == gain.OrderStatus.Filled or event.Status == gain.OrderStatus.Rejected:
-            self.SubmittedOrders.put((event.ClientOrderId, event.Status, event.AvgPx))
-            self.SubmittedOrders.task_done()
 
     def SendOrder(self, side, quantity, symbol, maturity, newOrderId, transactionTime):
 
@@ -78,20 +152,43 @@ class LambdaTrader(object):
             order = gain.BuyFutureMarketOrder(symbol, maturity, quantity)
         elif side.upper() == gain.OrderSide.Sell.upper():
             order = gain.SellFutureMarketOrder(symbol, maturity, quantity)
-        trade = self.FixClient.send(order)
-        orderId, status, price = self.SubmittedOrders.get(True, 5)
-        while trade.OrderId != orderId:
-            self.Logger.error('requests do not match orderId: %s, trade.OrderId: %s' % (orderId, trade.OrderId))
-            orderId, status, price = self.SubmittedOrders.get(True, 5)
+        try:
+            trade = self.FixClient.send(order, reply=True, timeout=5)
+            event = trade.Reply.result()
+        finally:
+            self.FixClient.release(newOrderId['S'])
+        orderId, status, price = event.ClientOrderId, event.Status, event.AvgPx
         self.Logger.info('Confirmed orderId %s. Status: %s. Price: %s. Symbol: %s' % (orderId, status, price, symbol))
         self.UpdateStatus('Confirmed newOrderId: %s. ClientOrderId: %s. Status: %s. Side: %s. Qty: %s. Symbol: %s. '
                         'Maturity: %s. Price: %s'
                         % (newOrderId, orderId, status, side, quantity, symbol, maturity, price),
                           newOrderId, transactionTime, orderId, status)
 
+    @property
+    def db(self):
+        if self.__db is None:
+            self.__db = dynamodb()
+        return self.__db
+
+    @staticmethod
+    def orders_table():
+        import boto3
+        return boto3.session.Session().resource('dynamodb', region_name='us-east-1').Table('Orders')
+
+    def StatusWriteLatency(self, seconds, attempts, error):
+        self.record_timing('UpdateStatus', seconds)
+        if attempts > 1:
+            self.Logger.warning('UpdateStatus took %s attempts, %.3f sec' % (attempts, seconds))
+
     def UpdateStatus(self, text, newOrderId, transactionTime, clientOrderId, status):
-        try:
-            response = self.__Orders.update_item(
+        """
+        Queue the conditional status update of a PENDING order. The report text is added to
+        Messages when the update completes, StatusWriter.flush() waits for all of them.
+        """
+        def done(response, error):
+            self.StatusUpdated(text, response, error)
+
+        self.StatusWriter.submit(done,
                 Key={
                     'NewOrderId': newOrderId['S'],
                     'TransactionTime': transactionTime['S'],
@@ -108,15 +205,16 @@ class LambdaTrader(object):
                     ':p': 'PENDING'
                 },
                 ReturnValues="UPDATED_NEW")
-            text += '. %s' % response['Attributes']
 
-        except ClientError as e:
-            self.Logger.error(e.response['Error']['Message'])
-            text += '%s. %s' % ('', e.response['Error']['Message'])
-        except Exception as e:
-            self.Logger.error(e)
-            text += '%s. %s' % ('', e)
+    def StatusUpdated(self, text, response, error):
+        if isinstance(error, client_error()):
+            self.Logger.error(error.response['Error']['Message'])
+            text += '%s. %s' % ('', error.response['Error']['Message'])
+        elif error is not None:
+            self.Logger.error(error)
+            text += '%s. %s' % ('', error)
         else:
+            text += '. %s' % response['Attributes']
             text += ". UpdateItem succeeded."
             self.Logger.info(json.dumps(response, indent=4, cls=DecimalEncoder))
 
@@ -124,46 +222,58 @@ class LambdaTrader(object):
         self.Messages.append(text)
 
 
+    @property
+    def Reports(self):
+        if self.__reports is None:
+            transport = SmtpTransport(self.Logger, 'email-smtp.us-east-1.amazonaws.com', 587,
+                                      os.environ['aws_access_key_id'],
+                                      lambda: ses_smtp_password(os.environ['aws_secret_access_key']),
+                                      os.environ['email_address'], os.environ['email_address'])
+            self.__reports = ReportSender(self.Logger, transport, 'Lambda FIX Trader report',
+                                          int(os.environ.get('report_max_bytes', 100000)),
+                                          int(os.environ.get('report_max_delay', 30)))
+        return self.__reports
+
     def SendReport(self, text):
         try:
-            self.Logger.info('Send Email: %s', text)
-
-            def hash_smtp_pass_from_secret_key(key):
-                message = "SendRawEmail"
-                version = '\x02'
-                h = hmac.new(key, message, digestmod=hashlib.sha256)
-                return base64.b64encode("{0}{1}".format(version, h.digest()))
-
-            msg = MIMEMultipart('alternative')
-            msg['Subject'] = 'Lambda FIX Trader report'
-            msg['From'] = os.environ['email_address']
-            msg['To'] = os.environ['email_address']
-            mime_text = MIMEText(text, 'html')
-            msg.attach(mime_text)
-
-            server = smtplib.SMTP('email-smtp.us-east-1.amazonaws.com', 587, timeout=10)
-            server.set_debuglevel(10)
-            server.starttls()
-            server.ehlo()
-            server.login(os.environ['aws_access_key_id'],
-                         hash_smtp_pass_from_secret_key(os.environ['aws_secret_access_key']))
-            server.sendmail(os.environ['email_address'], os.environ['email_address'], msg.as_string())
-            res = server.quit()
-            self.Logger.info(res)
+            self.Logger.info('Queue Email: %s', text)
+            self.Reports.add(text)
         except Exception as e:
             self.Logger.error(e)
 
-    def Run(self):
-        if not self.FixClient.SocketInitiator.application.connected:
-            self.FixClient.start()
+    def shutdown(self):
+        if self.__reports is not None:
+            self.__reports.flush(10)
+            self.__reports.stop(10)
+        self.StatusWriter.stop()
+        self.disconnect()
 
+    def Run(self):
         if not self.PendingOrders.empty():
             self.validate()
+            self.StatusWriter.flush()
 
             report = reduce(lambda x, y: x + y, map(lambda x, y: '<br><b>%s</b>. %s\n' % (x + 1, y),
                                                     range(len(self.Messages)), self.Messages))
+            report += self.timings_report()
             self.SendReport(report)
-            self.Messages = []
+
+    def timed(self, stage, func, *args):
+        start = gain.monotonic()
+        try:
+            return func(*args)
+        finally:
+            self.record_timing(stage, gain.monotonic() - start)
+
+    def record_timing(self, stage, seconds):
+        with self.__timingsLock:
+            self.Timings.setdefault(stage, []).append(seconds)
+
+    def timings_report(self):
+        lines = ['<br><b>%s</b>: %s calls, avg %.1f ms, max %.1f ms\n'
+                 % (stage, len(times), 1000 * sum(times) / len(times), 1000 * max(times))
+                 for stage, times in self.Timings.items()]
+        return '<br><b>Stage timings</b>\n' + ''.join(lines) if lines else ''
 
     def validate_order(self, order, security):
         try:
@@ -172,14 +282,15 @@ class LambdaTrader(object):
             riskFactor = float(security['Risk']['RiskFactor'])
             margin = int(security['Risk']['Margin']['Amount'])
             marginCcy = str(security['Risk']['Margin']['Currency'])
-            colReqId = self.FixClient.collateralInquiry()
-            receiveColReqId, balance, ccy = self.CurrentBalance.get(True, 5)
-            while colReqId != receiveColReqId:
-                self.Logger.error('requests do not match colReqId: %s, receiveColReqId: %s' % (colReqId, receiveColReqId))
-                receiveColReqId, balance, ccy = self.CurrentBalance.get(True, 5)
+            # symbols are validated in parallel, the check and the reservation must be one step
+            reserved, balance, ccy = self.FixClient.tryReserve(
+                order['NewOrderId']['S'], margin,
+                lambda balance, ccy: marginCcy == ccy and balance * riskFactor >= margin, timeout=5)
+            if balance is None:
+                raise Exception('No balance received for %s' % security['Symbol'])
             if marginCcy != ccy:
                 raise Exception('Margin Currency does not match Balance Currency for %s' % security['Symbol'])
-            if balance * riskFactor < margin:
+            if not reserved:
                 raise Exception('Margin exceeded for %s. Balance: %s, RF: %s, Margin: %s'
                                 % (security['Symbol'], balance, riskFactor, margin))
         except Exception as e:
@@ -189,6 +300,7 @@ class LambdaTrader(object):
             return False, None
         else:
             if ordType.upper() != gain.OrderType.Market.upper():
+                self.FixClient.release(order['NewOrderId']['S'])
                 supported = 'Only MARKET Orders are supported'
                 self.Logger.error(supported)
                 self.UpdateStatus('Error validate_order NewOrderId: %s. %s' % (order['NewOrderId'], supported),
@@ -197,6 +309,7 @@ class LambdaTrader(object):
             if side.upper() == gain.OrderSide.Buy.upper() or side.upper() == gain.OrderSide.Sell.upper():
                 return True, side
             else:
+                self.FixClient.release(order['NewOrderId']['S'])
                 error = 'Unknown side received. Side: %s' % side
                 self.Logger.error(error)
                 self.UpdateStatus('Error validate_order NewOrderId: %s. %s' % (order['NewOrderId'], error),
@@ -204,44 +317,27 @@ class LambdaTrader(object):
                 return False, None
 
     def validate_quantity(self, order, security):
-        otherPositionsInSecurity = False
         try:
             quantity = int(order['Details']['M']['Quantity']['N'])
             side = order['Details']['M']['Side']['S']
             symbol = order['Details']['M']['Symbol']['S']
             maturity = order['Details']['M']['Maturity']['S']
             maxPosition = security['Risk']['MaxPosition']
-            reqId = self.FixClient.requestForPositions()
-            receiveReqId, receivedSymbol, receivedMaturity, position = self.CurrentPositions.get(True, 5)
-            while reqId != receiveReqId or symbol != receivedSymbol or maturity != receivedMaturity:
-                otherPositionsInSecurity = True
-                self.Logger.error('requests do not match reqId: %s, receivedId: %s, maturity: %s, receivedMaturity: %s'
-                                  % (reqId, receiveReqId, maturity, receivedMaturity))
-                receiveReqId, receivedSymbol, receivedMaturity, position = self.CurrentPositions.get(True, 5)
+            position = self.FixClient.position(symbol, maturity)
+            if position is None:
+                self.FixClient.syncPositions(timeout=5)
+                position = self.FixClient.position(symbol, maturity)
 
             if side.upper() == gain.OrderSide.Buy.upper() and  maxPosition < position + quantity:
                 raise Exception('MaxPosition exceeded for %s' % security['Symbol'])
             if side.upper()== gain.OrderSide.Sell.upper() and  maxPosition < abs(position - quantity):
                 raise Exception('MaxPosition exceeded for %s' % security['Symbol'])
-        except Empty:
+        except TimeoutError:
             error = 'No reply to requestForPositions'
             self.Logger.error(error)
-            if otherPositionsInSecurity:
-                self.Logger.error('Gain Futures does not send a reply to requestForPositions if position is 0 and there is'
-                                  'a position in other maturity in this contract')
-                if maxPosition < quantity:
-                    self.UpdateStatus('Error validate_quantity NewOrderId: %s. %s' % (order['NewOrderId'], error+
-                                                                                      '. MaxPosition exceeded for %s' %
-                                                                                      security['Symbol']),
-                                      order['NewOrderId'], order['TransactionTime'], 0, 'INVALID')
-                    return 0
-                else:
-                    return quantity
-
-            else:
-                self.UpdateStatus('Error validate_quantity NewOrderId: %s. %s' % (order['NewOrderId'], error),
+            self.UpdateStatus('Error validate_quantity NewOrderId: %s. %s' % (order['NewOrderId'], error),
                               order['NewOrderId'],order['TransactionTime'], 0, 'INVALID')
-                return 0
+            return 0
         except Exception as e:
             self.Logger.error(e)
             self.UpdateStatus('Error validate_quantity NewOrderId: %s. %s' % (order['NewOrderId'], e),
@@ -250,13 +346,10 @@ class LambdaTrader(object):
         else:
             return quantity
 
-    def validate_maturity(self, order):
+    def validate_maturity(self, order, security):
         try:
             maturity = order['Details']['M']['Maturity']['S']
-            year = int(maturity[:4])
-            month = int(maturity[-2:])
-            date = datetime.date(year, month, 1)
-            expiry = self.get_expiry_date(date)
+            expiry = expiries.expiry(security, maturity)
             if expiry <= datetime.date.today() + timedelta(days=1):
                 raise Exception('%s maturity date has expired' % expiry)
 
@@ -272,12 +365,8 @@ class LambdaTrader(object):
         try:
             symbol = order['Details']['M']['Symbol']['S']
             self.Logger.info('Validating %s' % symbol)
-            response = self.__Securities.get_item(
-                Key={
-                    'Symbol': symbol
-                }
-            )
-        except ClientError as e:
+            item = securities.get(symbol, self.load_security)
+        except client_error() as e:
             self.Logger.error(e.response['Error']['Message'])
             self.UpdateStatus('ClientError validate_symbol NewOrderId: %s. %s' % (order['NewOrderId'], e),
                               order['NewOrderId'],order['TransactionTime'], 0, 'INVALID')
@@ -289,75 +378,110 @@ class LambdaTrader(object):
             return False, None
         else:
             # self.Logger.info(json.dumps(security, indent=4, cls=DecimalEncoder))
-            if response.has_key('Item') and response['Item']['Symbol'] == symbol and response['Item']['TradingEnabled']:
-                return True, response['Item']
+            if item is not None and item['Symbol'] == symbol and item['TradingEnabled']:
+                return True, item
             self.UpdateStatus('Symbol is unknown or not enabled for trading %s' % symbol,
                               order['NewOrderId'], order['TransactionTime'], 0, 'INVALID')
             return False, None
 
+    def warm_calendar(self, symbols):
+        """
+        Compute the expiries of the securities of a batch, taken from the prefetched security cache
+        :param symbols: symbols of the pending orders
+        """
+        try:
+            items = [item for item in (securities.get(symbol, self.load_security) for symbol in symbols
+                                       if symbol is not None) if item is not None and item['TradingEnabled']]
+            size = expiries.warm(items, int(os.environ.get('expiry_calendar_months', 24)))
+            self.Logger.info('Expiry calendar warmed for %s securities, %s expiries' % (len(items), size))
+        except Exception as e:
+            self.Logger.error('Error warm_calendar: %s' % e)
+
+    def load_security(self, symbol):
+        response = self.db.Table('Securities').get_item(
+            Key={
+                'Symbol': symbol
+            }
+        )
+        return response.get('Item')
+
     def validate(self):
+        """
+        Validate and send the pending orders. Orders on different symbols go through the stages
+        concurrently, orders on the same symbol are handled one after another in arrival order
+        so position limits see the fills of the earlier orders.
+        """
+        bySymbol = OrderedDict()
         while not self.PendingOrders.empty():
-
             order = self.PendingOrders.get()
-            found, security = self.validate_symbol(order)
-            if not found: continue
+            try:
+                symbol = order['Details']['M']['Symbol']['S']
+            except (KeyError, TypeError):
+                symbol = None
+            bySymbol.setdefault(symbol, []).append(order)
 
-            maturity = self.validate_maturity(order)
-            if not maturity: continue
-
-            quantity = self.validate_quantity(order, security)
-            if quantity < 1: continue
-
-            good, side = self.validate_order(order, security)
-            if not good: continue
-
-            self.SendOrder(str(side), int(quantity), str(security['Symbol']), str(maturity),
-                               order['NewOrderId'], order['TransactionTime'])
+        try:
+            securities.prefetch(self.db, 'Securities', bySymbol.keys())
+        except client_error() as e:
+            self.Logger.error(e.response['Error']['Message'])
+        except Exception as e:
+            self.Logger.error(e)
 
+        self.timed('warmCalendar', self.warm_calendar, bySymbol.keys())
+        self.timed('syncPositions', self.sync_positions)
+        start = gain.monotonic()
+        with ThreadPoolExecutor(max_workers=max(1, self.Concurrency)) as executor:
+            for future in [executor.submit(self.validate_symbol_orders, orders) for orders in bySymbol.values()]:
+                future.result()
+        self.Logger.info('Validated %s symbols in %.3f sec' % (len(bySymbol), gain.monotonic() - start))
 
-    # lifted from https://github.com/conor10/examples/blob/master/python/expiries/vix.py
-    @staticmethod
-    def get_expiry_date(date):
+    def sync_positions(self):
+        """
+        Seed the positions with one RequestForPositions before the symbols are validated in parallel,
+        instead of one request per symbol worker
         """
-        http://cfe.cboe.com/products/spec_vix.aspx
+        if self.FixClient.positionsSynchronised():
+            return
+        try:
+            self.FixClient.syncPositions(timeout=5)
+        except Exception as e:
+            self.Logger.error('Position sync failed: %s' % e)
 
-        TERMINATION OF TRADING:
+    def validate_symbol_orders(self, orders):
+        for order in orders:
+            try:
+                self.validate_one(order)
+            except Exception as e:
+                self.Logger.error(e)
+                self.UpdateStatus('Error validate NewOrderId: %s. %s' % (order['NewOrderId'], e),
+                                  order['NewOrderId'], order['TransactionTime'], 0, 'ERROR')
 
-        Trading hours for expiring VIX futures contracts end at 7:00 a.m. Chicago
-        time on the final settlement date.
+    def validate_one(self, order):
+        found, security = self.timed('validate_symbol', self.validate_symbol, order)
+        if not found: return
 
-        FINAL SETTLEMENT DATE:
+        maturity = self.timed('validate_maturity', self.validate_maturity, order, security)
+        if not maturity: return
 
-        The Wednesday that is thirty days prior to the third Friday of the
-        calendar month immediately following the month in which the contract
-        expires ("Final Settlement Date"). If the third Friday of the month
-        subsequent to expiration of the applicable VIX futures contract is a
-        CBOE holiday, the Final Settlement Date for the contract shall be thirty
-        days prior to the CBOE business day immediately preceding that Friday.
-        """
-        # Date of third friday of the following month
-        if date.month == 12:
-            third_friday_next_month = datetime.date(date.year + 1, 1, 15)
-        else:
-            third_friday_next_month = datetime.date(date.year,
-                                                    date.month + 1, 15)
+        quantity = self.timed('validate_quantity', self.validate_quantity, order, security)
+        if quantity < 1: return
 
-        one_day = datetime.timedelta(days=1)
-        thirty_days = datetime.timedelta(days=30)
-        while third_friday_next_month.weekday() != 4:
-            # Using += results in a timedelta object
-            third_friday_next_month = third_friday_next_month + one_day
+        good, side = self.timed('validate_order', self.validate_order, order, security)
+        if not good: return
 
-        # TODO: Incorporate check that it's a trading day, if so move the 3rd
-        # Friday back by one day before subtracting
-        return third_friday_next_month - thirty_days
+        self.timed('SendOrder', self.SendOrder, str(side), int(quantity), str(security['Symbol']), str(maturity),
+                   order['NewOrderId'], order['TransactionTime'])
 
 trader = None
+invocations = 0
+expiries = ExpiryCalendar(load_holidays(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'holidays.txt')))
+securities = SecurityCache(logging.getLogger(), int(os.environ.get('securities_ttl', 300)),
+                           int(os.environ.get('securities_negative_ttl', 60)))
 @atexit.register
 def lambda_exit():
     if trader is not None:
         trader.Logger.info('lambda_exit is called')
-        trader.FixClient.stop()
+        trader.shutdown()
 
 
 def main(event, context):
@@ -368,26 +492,38 @@ def main(event, context):
     logger.info('event %s' % event)
     logger.info('context %s' % context)
 
-    response = {'State':'OK'}
+    global trader, invocations
+    invocations += 1
+    response = {'State':'OK', 'Invocation': invocations}
+    inserts = []
+    for record in event['Records']:
+        if record['eventName'] == 'INSERT':
+            logger.info('New Order received NewOrderId: %s', record['dynamodb']['Keys']['NewOrderId'])
+            inserts.append(record['dynamodb']['NewImage'])
+        else:
+            logger.info('Not INSERT event is ignored')
+    response['Inserts'] = len(inserts)
+    if not inserts:
+        return response
+
     try:
         logger.info('Start fix trader')
-        global trader
+        start = gain.monotonic()
         trader = LambdaTrader(logger)
-        for record in event['Records']:
-            if record['eventName'] == 'INSERT':
-                logger.info('New Order received NewOrderId: %s', record['dynamodb']['Keys']['NewOrderId'])
-                trader.PendingOrders.put_nowait(record['dynamodb']['NewImage'])
-            else:
-                logger.info('Not INSERT event is ignored')
-
-        if not trader.PendingOrders.empty():
-            trader.Run()
+        response['Start'] = trader.ensure_session()
+        response['StartTime'] = round(gain.monotonic() - start, 3)
+        logger.info('%s start in %s sec. Invocation: %s' % (response['Start'], response['StartTime'], invocations))
+        for order in inserts:
+            trader.PendingOrders.put_nowait(order)
+        trader.Run()
         logger.info('Stop fix trader')
 
     except Exception as e:
         logger.error(e)
         response['State']='ERROR'
 
+    if trader is not None:
+        trader.end_invocation()
     return response
 
 def lambda_handler(event, context):
@@ -0,0 +1,167 @@
+import threading
+import time
+from collections import deque
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class SmtpTransport(object):
+    """
+    Sends html reports over one SMTP connection kept open between reports. The connection is
+    opened on the first report and opened again once if the server has dropped it.
+    """
+    def __init__(self, logger, host, port, username, password, sender, recipient, timeout=10, factory=None):
+        """
+        :param password: callable returning the SMTP password, called on every login
+        :param factory: callable(host, port, timeout=) returning an smtplib.SMTP like connection
+        """
+        self.Logger = logger
+        self.Host = host
+        self.Port = port
+        self.Username = username
+        self.Password = password
+        self.Sender = sender
+        self.Recipient = recipient
+        self.Timeout = timeout
+        self.__factory = factory
+        self.__server = None
+
+    def __connect(self):
+        factory = self.__factory
+        if factory is None:
+            import smtplib
+            factory = smtplib.SMTP
+        server = factory(self.Host, self.Port, timeout=self.Timeout)
+        server.starttls()
+        server.ehlo()
+        server.login(self.Username, self.Password())
+        return server
+
+    def send(self, subject, html):
+        from email.mime.multipart import MIMEMultipart
+        from email.mime.text import MIMEText
+        msg = MIMEMultipart('alternative')
+        msg['Subject'] = subject
+        msg['From'] = self.Sender
+        msg['To'] = self.Recipient
+        msg.attach(MIMEText(html, 'html'))
+        for attempt in (1, 2):
+            if self.__server is None:
+                self.__server = self.__connect()
+            try:
+                self.__server.sendmail(self.Sender, self.Recipient, msg.as_string())
+                return
+            except Exception as e:
+                self.Logger.warning('SMTP send failed, attempt %s: %s' % (attempt, e))
+                self.close()
+                if attempt == 2:
+                    raise
+
+    def close(self):
+        server, self.__server = self.__server, None
+        if server is not None:
+            try:
+                server.quit()
+            except Exception as e:
+                self.Logger.info('SMTP quit failed: %s' % e)
+
+
+class ReportSender(object):
+    """
+    Background worker sending queued report text. Reports queued within MaxDelay seconds of the
+    first queued one are joined into one message of at most MaxBytes; a larger report is sent alone.
+    """
+    def __init__(self, logger, transport, subject, maxBytes=100000, maxDelay=30):
+        """
+        :param transport: object with send(subject, html) and close()
+        """
+        self.Logger = logger
+        self.Transport = transport
+        self.Subject = subject
+        self.MaxBytes = maxBytes
+        self.MaxDelay = maxDelay
+        self.__queue = deque()
+        self.__first = None
+        self.__sending = False
+        self.__stop = False
+        self.__flush = False
+        self.__sent = 0
+        self.__condition = threading.Condition()
+        self.__thread = threading.Thread(target=self.__run, name='Report Sender')
+        self.__thread.daemon = True
+        self.__thread.start()
+
+    def add(self, text):
+        with self.__condition:
+            if self.__first is None:
+                self.__first = monotonic()
+            self.__queue.append(text)
+            self.__condition.notify_all()
+
+    def __size(self):
+        return sum(len(text) for text in self.__queue)
+
+    def __due(self):
+        return self.__queue and (self.__flush or self.__stop or self.__size() >= self.MaxBytes or
+                                 monotonic() - self.__first >= self.MaxDelay)
+
+    def __batch(self):
+        batch = [self.__queue.popleft()]
+        size = len(batch[0])
+        while self.__queue and size + len(self.__queue[0]) <= self.MaxBytes:
+            size += len(self.__queue[0])
+            batch.append(self.__queue.popleft())
+        self.__first = monotonic() if self.__queue else None
+        return batch
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__due():
+                    if self.__stop:
+                        self.Transport.close()
+                        return
+                    self.__flush = False
+                    self.__condition.notify_all()
+                    timeout = None if self.__first is None else max(0, self.__first + self.MaxDelay - monotonic())
+                    self.__condition.wait(timeout)
+                batch = self.__batch()
+                self.__sending = True
+            try:
+                self.Transport.send(self.Subject, ''.join(batch))
+            except Exception as e:
+                self.Logger.error('Error in ReportSender: %s', e)
+            with self.__condition:
+                self.__sending = False
+                self.__sent += 1
+                self.__condition.notify_all()
+
+    def sent(self):
+        """
+        :return: number of messages handed to the transport
+        """
+        with self.__condition:
+            return self.__sent
+
+    def flush(self, timeout=None):
+        """
+        Send the queued reports now
+        :return: True if the queue is empty when the call returns
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        with self.__condition:
+            self.__flush = True
+            self.__condition.notify_all()
+            while self.__queue or self.__sending:
+                remaining = None if deadline is None else deadline - monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self.__flush = True
+                self.__condition.wait(remaining)
+            return not self.__queue and not self.__sending
+
+    def stop(self, timeout=None):
+        with self.__condition:
+            self.__stop = True
+            self.__condition.notify_all()
+        self.__thread.join(timeout)
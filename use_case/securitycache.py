@@ -0,0 +1,75 @@
+import threading
+import time
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class SecurityCache(object):
+    """
+    TTL cache of Securities items keyed by Symbol. Kept at module level by the trader so it
+    survives warm Lambda invocations. Unknown (None) and disabled symbols are kept for a shorter TTL.
+    """
+    BatchSize = 100
+
+    def __init__(self, logger, ttl=300, negativeTtl=60):
+        self.Logger = logger
+        self.Ttl = ttl
+        self.NegativeTtl = negativeTtl
+        self.__items = {}
+        self.__lock = threading.Lock()
+
+    def __put(self, symbol, item):
+        expires = monotonic() + (self.Ttl if item is not None and item.get('TradingEnabled') else self.NegativeTtl)
+        with self.__lock:
+            self.__items[symbol] = (item, expires)
+
+    def __cached(self, symbol):
+        with self.__lock:
+            entry = self.__items.get(symbol)
+        if entry is None or entry[1] < monotonic():
+            return False, None
+        return True, entry[0]
+
+    def prefetch(self, db, table, symbols):
+        """
+        Load the symbols missing from the cache with BatchGetItem
+        :param db: boto3 DynamoDB resource
+        :param table: name of the Securities table
+        :param symbols: symbols of the batch
+        :return: number of symbols requested from DynamoDB
+        """
+        missing = sorted(set(s for s in symbols if s is not None and not self.__cached(s)[0]))
+        for i in range(0, len(missing), self.BatchSize):
+            keys = [{'Symbol': symbol} for symbol in missing[i:i + self.BatchSize]]
+            found = {}
+            request = {table: {'Keys': keys}}
+            while request:
+                response = db.batch_get_item(RequestItems=request)
+                for item in response.get('Responses', {}).get(table, []):
+                    found[item['Symbol']] = item
+                request = response.get('UnprocessedKeys')
+            for key in keys:
+                self.__put(key['Symbol'], found.get(key['Symbol']))
+        if missing:
+            self.Logger.info('Prefetched %s securities, %s found' % (len(missing), len(
+                [s for s in missing if self.__cached(s)[1] is not None])))
+        return len(missing)
+
+    def get(self, symbol, load):
+        """
+        :param symbol: Symbol of the security
+        :param load: callable returning the item of a symbol or None, called on a cache miss
+        :return: Securities item or None if the symbol is unknown
+        """
+        hit, item = self.__cached(symbol)
+        if not hit:
+            item = load(symbol)
+            self.__put(symbol, item)
+        return item
+
+    def invalidate(self, symbol=None):
+        with self.__lock:
+            if symbol is None:
+                self.__items.clear()
+            else:
+                self.__items.pop(symbol, None)
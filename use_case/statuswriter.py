@@ -0,0 +1,96 @@
+import threading
+import time
+import random
+from concurrent.futures import ThreadPoolExecutor, wait
+
+monotonic = getattr(time, 'monotonic', time.time)
+
+
+class StatusWriter(object):
+    """
+    Writes order status updates to DynamoDB from a small pool of background threads.
+    Each thread uses its own table from the factory, throttled writes are retried with
+    exponential backoff and flush() waits for everything submitted so far.
+    """
+    Throttles = ('ProvisionedThroughputExceededException', 'ThrottlingException', 'RequestLimitExceeded')
+
+    def __init__(self, logger, tableFactory, threads=4, retries=5, backoff=0.05, latency=None):
+        """
+        :param tableFactory: callable returning a boto3 Table, called once per writer thread
+        :param latency: callable(seconds, attempts, error) called after every update
+        """
+        self.Logger = logger
+        self.Retries = retries
+        self.Backoff = backoff
+        self.Latency = latency
+        self.__tableFactory = tableFactory
+        self.__local = threading.local()
+        self.__executor = ThreadPoolExecutor(max_workers=threads)
+        self.__pending = []
+        self.__lock = threading.Lock()
+
+    def __table(self):
+        table = getattr(self.__local, 'table', None)
+        if table is None:
+            table = self.__local.table = self.__tableFactory()
+        return table
+
+    def __throttled(self, error):
+        response = getattr(error, 'response', None) or {}
+        return response.get('Error', {}).get('Code') in self.Throttles
+
+    def __write(self, update, done):
+        start = monotonic()
+        delay = self.Backoff
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                response = self.__table().update_item(**update)
+            except Exception as e:
+                if attempt <= self.Retries and self.__throttled(e):
+                    time.sleep(delay * (1 + random.random()))
+                    delay *= 2
+                    continue
+                response, error = None, e
+            else:
+                error = None
+            break
+        if self.Latency is not None:
+            try:
+                self.Latency(monotonic() - start, attempt, error)
+            except Exception as e:
+                self.Logger.error('Error in latency hook: %s', e)
+        done(response, error)
+
+    def submit(self, done, **update):
+        """
+        Queue an update_item call
+        :param done: callable(response, error) called on the writer thread when the update completes
+        :param update: keyword arguments of update_item
+        :return: Future of the update
+        """
+        future = self.__executor.submit(self.__write, update, done)
+        with self.__lock:
+            self.__pending = [f for f in self.__pending if not f.done()]
+            self.__pending.append(future)
+        return future
+
+    def flush(self, timeout=None):
+        """
+        Wait for all submitted updates
+        :return: number of updates still running after timeout
+        """
+        with self.__lock:
+            pending = list(self.__pending)
+        notDone = wait(pending, timeout).not_done
+        with self.__lock:
+            self.__pending = [f for f in self.__pending if not f.done()]
+        for future in pending:
+            if future.done() and future.exception() is not None:
+                self.Logger.error('Error in status update: %s', future.exception())
+        return len(notDone)
+
+    def stop(self):
+        self.flush()
+        self.__executor.shutdown(wait=True)
@@ -0,0 +1,382 @@
+import unittest
+import logging
+import os
+import threading
+import securitycache
+import statuswriter
+import reportsender
+import expirycalendar
+import datetime as dt
+from concurrent.futures import Future
+try:
+    import lambdatrader
+except ImportError:
+    lambdatrader = None
+
+
+class StubDynamoDB(object):
+    """
+    DynamoDB resource answering BatchGetItem from a dict of items, at most Limit keys per call
+    """
+    def __init__(self, items, limit=None):
+        self.Items = items
+        self.Limit = limit
+        self.Calls = []
+
+    def batch_get_item(self, RequestItems):
+        self.Calls.append(RequestItems)
+        responses, unprocessed = {}, {}
+        for table, request in RequestItems.items():
+            keys = request['Keys']
+            processed = keys if self.Limit is None else keys[:self.Limit]
+            responses[table] = [self.Items[k['Symbol']] for k in processed if k['Symbol'] in self.Items]
+            if len(processed) < len(keys):
+                unprocessed[table] = {'Keys': keys[len(processed):]}
+        return {'Responses': responses, 'UnprocessedKeys': unprocessed}
+
+
+class TestSecurityCache(unittest.TestCase):
+
+    def setUp(self):
+        self.Items = {'6E': {'Symbol': '6E', 'TradingEnabled': True},
+                      'VX': {'Symbol': 'VX', 'TradingEnabled': True},
+                      'ES': {'Symbol': 'ES', 'TradingEnabled': False}}
+        self.Cache = securitycache.SecurityCache(logging.getLogger(), ttl=300, negativeTtl=60)
+        self.Loads = []
+
+    def load(self, symbol):
+        self.Loads.append(symbol)
+        return self.Items.get(symbol)
+
+    def test_prefetch_batches_distinct_symbols(self):
+        db = StubDynamoDB(self.Items)
+        self.assertEqual(self.Cache.prefetch(db, 'Securities', ['6E', 'VX', '6E', 'ZZ', None]), 3)
+        self.assertEqual(len(db.Calls), 1)
+        self.assertEqual(sorted(k['Symbol'] for k in db.Calls[0]['Securities']['Keys']), ['6E', 'VX', 'ZZ'])
+        self.assertEqual(self.Cache.get('6E', self.load), self.Items['6E'])
+        self.assertIsNone(self.Cache.get('ZZ', self.load))
+        self.assertEqual(self.Loads, [])
+        self.assertEqual(self.Cache.prefetch(db, 'Securities', ['6E', 'ZZ']), 0)
+        self.assertEqual(len(db.Calls), 1)
+
+    def test_prefetch_retries_unprocessed_keys(self):
+        db = StubDynamoDB(self.Items, limit=1)
+        self.Cache.prefetch(db, 'Securities', ['6E', 'ES', 'VX'])
+        self.assertEqual(len(db.Calls), 3)
+        self.assertEqual(self.Cache.get('VX', self.load), self.Items['VX'])
+        self.assertEqual(self.Loads, [])
+
+    def test_expiry_and_negative_ttl(self):
+        self.Cache.NegativeTtl = -1
+        self.assertEqual(self.Cache.get('6E', self.load), self.Items['6E'])
+        self.assertEqual(self.Cache.get('ES', self.load), self.Items['ES'])
+        self.assertEqual(self.Cache.get('6E', self.load), self.Items['6E'])
+        self.assertEqual(self.Cache.get('ES', self.load), self.Items['ES'])
+        self.assertEqual(self.Loads, ['6E', 'ES', 'ES'])
+        self.Cache.invalidate('6E')
+        self.Cache.get('6E', self.load)
+        self.assertEqual(self.Loads, ['6E', 'ES', 'ES', '6E'])
+
+
+class Throttled(Exception):
+    response = {'Error': {'Code': 'ProvisionedThroughputExceededException', 'Message': 'Throttled'}}
+
+
+class StubTable(object):
+    """
+    Orders table failing the first Throttles update_item calls
+    """
+    def __init__(self, throttles=0):
+        self.Throttles = throttles
+        self.Updates = []
+        self.Lock = threading.Lock()
+
+    def update_item(self, **update):
+        with self.Lock:
+            if self.Throttles > 0:
+                self.Throttles -= 1
+                raise Throttled()
+            self.Updates.append(update)
+        if update['ExpressionAttributeValues'][':s'] == 'FAIL':
+            raise ValueError('The conditional request failed')
+        return {'Attributes': {'Status': update['ExpressionAttributeValues'][':s']}}
+
+
+class TestStatusWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.Table = StubTable()
+        self.Latencies = []
+        self.Writer = statuswriter.StatusWriter(logging.getLogger(), lambda: self.Table, threads=2, backoff=0.001,
+                                                latency=lambda s, a, e: self.Latencies.append((a, e)))
+        self.Done = []
+
+    def tearDown(self):
+        self.Writer.stop()
+
+    def update(self, orderId, status):
+        self.Writer.submit(lambda r, e: self.Done.append((orderId, r, e)),
+                           Key={'NewOrderId': orderId}, ConditionExpression='#s = :p',
+                           ExpressionAttributeValues={':s': status, ':p': 'PENDING'})
+
+    def test_flush_waits_for_updates(self):
+        for i in range(10):
+            self.update(str(i), 'Filled')
+        self.assertEqual(self.Writer.flush(1), 0)
+        self.assertEqual(sorted(d[0] for d in self.Done), sorted(str(i) for i in range(10)))
+        self.assertTrue(all(u['ConditionExpression'] == '#s = :p' for u in self.Table.Updates))
+        self.assertEqual(len(self.Latencies), 10)
+
+    def test_throttles_are_retried(self):
+        self.Table.Throttles = 2
+        self.update('1', 'Filled')
+        self.Writer.flush(1)
+        self.assertEqual(self.Done, [('1', {'Attributes': {'Status': 'Filled'}}, None)])
+        self.assertEqual(self.Latencies, [(3, None)])
+
+    def test_errors_are_reported(self):
+        self.Writer.Retries = 1
+        self.Table.Throttles = 2
+        self.update('1', 'Filled')
+        self.Writer.flush(1)
+        self.update('2', 'FAIL')
+        self.Writer.flush(1)
+        errors = dict((d[0], d[2]) for d in self.Done)
+        self.assertIsInstance(errors['1'], Throttled)
+        self.assertIsInstance(errors['2'], ValueError)
+
+
+class StubTransport(object):
+
+    def __init__(self):
+        self.Sent = []
+        self.Closed = False
+
+    def send(self, subject, html):
+        self.Sent.append(html)
+
+    def close(self):
+        self.Closed = True
+
+
+class StubSMTP(object):
+    """
+    smtplib.SMTP stand-in, instances record their calls in Log
+    """
+    Log = []
+    Fail = 0
+
+    def __init__(self, host, port, timeout=None):
+        self.Log.append('connect')
+
+    def starttls(self):
+        pass
+
+    def ehlo(self):
+        pass
+
+    def login(self, username, password):
+        self.Log.append('login')
+
+    def sendmail(self, sender, recipient, text):
+        if StubSMTP.Fail > 0:
+            StubSMTP.Fail -= 1
+            raise IOError('Connection unexpectedly closed')
+        self.Log.append('sendmail')
+
+    def quit(self):
+        self.Log.append('quit')
+
+
+class TestReportSender(unittest.TestCase):
+
+    def setUp(self):
+        self.Transport = StubTransport()
+        self.Sender = reportsender.ReportSender(logging.getLogger(), self.Transport, 'report', maxBytes=10, maxDelay=60)
+
+    def tearDown(self):
+        self.Sender.stop(1)
+
+    def test_reports_are_batched_until_flush(self):
+        self.Sender.add('abc')
+        self.Sender.add('def')
+        self.assertEqual(self.Transport.Sent, [])
+        self.assertTrue(self.Sender.flush(1))
+        self.assertEqual(self.Transport.Sent, ['abcdef'])
+
+    def test_size_cap_splits_batches(self):
+        for text in ('12345', '67890', 'abc'):
+            self.Sender.add(text)
+        self.Sender.flush(1)
+        self.assertEqual(self.Transport.Sent, ['1234567890', 'abc'])
+
+    def test_time_cap_sends_without_flush(self):
+        self.Sender.MaxDelay = 0.05
+        self.Sender.add('abc')
+        for _ in range(100):
+            if self.Sender.sent():
+                break
+            threading.Event().wait(0.01)
+        self.assertEqual(self.Transport.Sent, ['abc'])
+
+    def test_stop_sends_and_closes(self):
+        self.Sender.add('abc')
+        self.Sender.stop(1)
+        self.assertEqual(self.Transport.Sent, ['abc'])
+        self.assertTrue(self.Transport.Closed)
+
+    def test_smtp_connection_is_reused(self):
+        del StubSMTP.Log[:]
+        transport = reportsender.SmtpTransport(logging.getLogger(), 'localhost', 25, 'user', lambda: 'secret',
+                                               'a@b.c', 'a@b.c', factory=StubSMTP)
+        transport.send('report', 'one')
+        transport.send('report', 'two')
+        StubSMTP.Fail = 1
+        transport.send('report', 'three')
+        transport.close()
+        self.assertEqual(StubSMTP.Log, ['connect', 'login', 'sendmail', 'sendmail', 'quit',
+                                        'connect', 'login', 'sendmail', 'quit'])
+
+
+class TestExpiryCalendar(unittest.TestCase):
+
+    def setUp(self):
+        self.Calendar = expirycalendar.ExpiryCalendar(expirycalendar.load_holidays(
+            os.path.join(os.path.dirname(os.path.abspath(__file__)), 'holidays.txt')))
+        self.VX = {'Symbol': 'VX', 'Description': {'Exchange': 'CFE', 'MarketGroup': 'Indices'}}
+        self.E6 = {'Symbol': '6E', 'Description': {'Exchange': 'CME', 'MarketGroup': 'Currencies'}}
+        self.ES = {'Symbol': 'ES', 'ExpiryRule': 'EquityIndex'}
+
+    def test_vix(self):
+        self.assertEqual(self.Calendar.expiry(self.VX, '201709'), dt.date(2017, 9, 20))
+        self.assertEqual(self.Calendar.expiry(self.VX, '201712'), dt.date(2017, 12, 20))
+        # third Friday of April 2019 is Good Friday
+        self.assertEqual(self.Calendar.expiry(self.VX, '201903'), dt.date(2019, 3, 19))
+
+    def test_cme_fx(self):
+        self.assertEqual(self.Calendar.expiry(self.E6, '201709'), dt.date(2017, 9, 18))
+        self.assertEqual(self.Calendar.expiry(self.E6, '202612'), dt.date(2026, 12, 14))
+
+    def test_equity_index(self):
+        self.assertEqual(self.Calendar.expiry(self.ES, '202403'), dt.date(2024, 3, 15))
+        self.assertEqual(self.Calendar.expiry(self.ES, '202504'), dt.date(2025, 4, 17))
+
+    def test_warm_and_invalid_maturity(self):
+        self.assertEqual(self.Calendar.warm([self.VX, self.E6], 12, dt.date(2017, 11, 5)), 24)
+        self.assertEqual(self.Calendar.expiry({'Symbol': 'XX'}, '201810'), dt.date(2018, 10, 17))
+        self.assertRaises(ValueError, self.Calendar.expiry, self.VX, '201713')
+
+
+class BalanceFixClient(object):
+    """
+    FixClient keeping the balance and the reservations in a real BalanceCache, orders are filled at once
+    """
+    def __init__(self, balance, currency):
+        self.Balance = lambdatrader.gain.BalanceCache(logging.getLogger())
+        event = lambdatrader.gain.FixEvent()
+        event.Balance, event.Currency = balance, currency
+        self.Balance.update(event)
+        self.Sent = []
+        self.Syncs = 0
+
+    def balance(self, maxAge=None, timeout=None):
+        return self.Balance.get(60, None, timeout)
+
+    def tryReserve(self, key, amount, predicate, maxAge=None, timeout=None):
+        self.Balance.get(60, None, timeout)
+        return self.Balance.tryReserve(key, amount, predicate)
+
+    def release(self, key):
+        self.Balance.release(key)
+
+    def positionsSynchronised(self):
+        return self.Syncs > 0
+
+    def syncPositions(self, timeout=None):
+        self.Syncs += 1
+
+    def send(self, order, reply=False, timeout=None):
+        self.Sent.append(order)
+        event = lambdatrader.gain.FixEvent()
+        event.ClientOrderId, event.Status, event.AvgPx = '1', lambdatrader.gain.OrderStatus.Filled, 1.1
+        trade = type('Trade', (object,), {})()
+        trade.Reply = Future()
+        trade.Reply.set_result(event)
+        return trade
+
+
+@unittest.skipIf(lambdatrader is None, 'lambdatrader needs quickfix and future')
+class TestLambdaTraderMargin(unittest.TestCase):
+
+    def setUp(self):
+        lambdatrader.Singleton._instances.pop(lambdatrader.LambdaTrader, None)
+        self.Trader = lambdatrader.LambdaTrader(logging.getLogger())
+        self.Trader.StatusWriter.stop()
+        self.Table = StubTable()
+        self.Trader.StatusWriter = statuswriter.StatusWriter(logging.getLogger(), lambda: self.Table, threads=1)
+        self.Trader.FixClient = BalanceFixClient(1000.0, 'USD')
+        self.Security = {'Symbol': '6E', 'Risk': {'RiskFactor': 1, 'Margin': {'Amount': 600, 'Currency': 'USD'}}}
+
+    def tearDown(self):
+        self.Trader.StatusWriter.stop()
+        lambdatrader.Singleton._instances.pop(lambdatrader.LambdaTrader, None)
+
+    @staticmethod
+    def order(newOrderId):
+        return {'NewOrderId': {'S': newOrderId}, 'TransactionTime': {'S': '1501177539.2'},
+                'Details': {'M': {'Side': {'S': 'BUY'}, 'OrdType': {'S': 'MARKET'}}}}
+
+    def test_reserve_until_order_is_sent(self):
+        first, second = self.order('N1'), self.order('N2')
+        self.assertEqual(self.Trader.validate_order(first, self.Security), (True, 'BUY'))
+        self.assertEqual(self.Trader.FixClient.Balance.reserved(), 600)
+        self.assertEqual(self.Trader.validate_order(second, self.Security), (False, None))
+        self.Trader.SendOrder('BUY', 1, '6E', '201712', first['NewOrderId'], first['TransactionTime'])
+        self.assertEqual(self.Trader.FixClient.Balance.reserved(), 0)
+        self.assertEqual(len(self.Trader.FixClient.Sent), 1)
+        self.Trader.StatusWriter.flush(1)
+        self.assertEqual(sorted((u['Key']['NewOrderId'], u['ExpressionAttributeValues'][':s'])
+                                for u in self.Table.Updates),
+                         [('N1', lambdatrader.gain.OrderStatus.Filled), ('N2', 'INVALID')])
+
+    def test_parallel_symbols_share_the_balance(self):
+        results = []
+        validators = [threading.Thread(target=lambda i=i: results.append(
+            self.Trader.validate_order(self.order('N%s' % i), self.Security)[0])) for i in range(8)]
+        for validator in validators:
+            validator.start()
+        for validator in validators:
+            validator.join()
+        self.assertEqual(sorted(results), [False] * 7 + [True])
+        self.assertEqual(self.Trader.FixClient.Balance.reserved(), 600)
+
+    def test_positions_synced_once(self):
+        self.Trader.sync_positions()
+        self.Trader.sync_positions()
+        self.assertEqual(self.Trader.FixClient.Syncs, 1)
+
+    def test_calendar_warmed_from_cached_securities(self):
+        security = dict(self.Security, TradingEnabled=True)
+        lambdatrader.securities.get('6E', lambda symbol: security)
+        loads = []
+        self.Trader.load_security = lambda symbol: loads.append(symbol)
+        try:
+            self.Trader.warm_calendar(['6E', 'ES', None])
+        finally:
+            lambdatrader.securities.invalidate()
+        self.assertEqual(loads, ['ES'])
+
+    def test_release_when_order_is_invalid(self):
+        order = self.order('N1')
+        order['Details']['M']['OrdType']['S'] = 'LIMIT'
+        self.assertEqual(self.Trader.validate_order(order, self.Security), (False, None))
+        self.assertEqual(self.Trader.FixClient.Balance.reserved(), 0)
+
+
+if __name__ == '__main__':
+    suite = unittest.TestSuite([unittest.TestLoader().loadTestsFromTestCase(TestSecurityCache),
+                                unittest.TestLoader().loadTestsFromTestCase(TestStatusWriter),
+                                unittest.TestLoader().loadTestsFromTestCase(TestReportSender),
+                                unittest.TestLoader().loadTestsFromTestCase(TestExpiryCalendar),
+                                unittest.TestLoader().loadTestsFromTestCase(TestLambdaTraderMargin)])
+    unittest.TextTestRunner(verbosity=2).run(suite)